@@ -1,5 +1,11 @@
 from django.contrib import admin
-from .models import Patron, AttendanceLog, SystemLog
+from django.http import FileResponse, Http404
+from django.shortcuts import redirect
+from django.template.response import TemplateResponse
+from django.urls import path
+
+from .models import Patron, AttendanceLog, SystemLog, OutboundEmail, ProfilingSettings
+from .profiling import list_captures, profile_path, read_capture
 
 @admin.register(Patron)
 class PatronAdmin(admin.ModelAdmin):
@@ -16,4 +22,54 @@ class AttendanceLogAdmin(admin.ModelAdmin):
 @admin.register(SystemLog)
 class SystemLogAdmin(admin.ModelAdmin):
     list_display = ('action_time', 'user', 'action', 'details')
-    list_filter = ('action', 'user')
\ No newline at end of file
+    list_filter = ('action', 'user')
+
+@admin.register(OutboundEmail)
+class OutboundEmailAdmin(admin.ModelAdmin):
+    list_display = ('created_at', 'to', 'subject', 'status', 'attempts', 'next_attempt_at', 'sent_at')
+    list_filter = ('status',)
+    search_fields = ('to', 'subject')
+    readonly_fields = ('attachment',)
+
+@admin.register(ProfilingSettings)
+class ProfilingSettingsAdmin(admin.ModelAdmin):
+    """One settings row; its page also lists the captured requests."""
+    fields = ('enabled', 'sample_rate', 'slow_ms')
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+    def get_urls(self):
+        view = self.admin_site.admin_view
+        return [
+            path('captures/<str:name>/', view(self.capture_view), name='library_app_profiling_capture'),
+            path('captures/<str:name>/profile/', view(self.profile_download), name='library_app_profiling_download'),
+        ] + super().get_urls()
+
+    def changelist_view(self, request, extra_context=None):
+        settings_row, _ = ProfilingSettings.objects.get_or_create(pk=1)
+        return redirect('admin:library_app_profilingsettings_change', settings_row.pk)
+
+    def change_view(self, request, object_id, form_url='', extra_context=None):
+        extra_context = {**(extra_context or {}), 'captures': list_captures(limit=100)}
+        return super().change_view(request, object_id, form_url, extra_context)
+
+    def capture_view(self, request, name):
+        capture = read_capture(name)
+        if capture is None:
+            raise Http404
+        return TemplateResponse(request, 'admin/library_app/profilingsettings/capture.html', {
+            **self.admin_site.each_context(request),
+            'opts': self.model._meta,
+            'title': f"{capture['method']} {capture['path']}",
+            'capture': capture,
+        })
+
+    def profile_download(self, request, name):
+        path = profile_path(name)
+        if path is None:
+            raise Http404
+        return FileResponse(open(path, 'rb'), as_attachment=True, filename=f'{name}.prof')
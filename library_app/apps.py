@@ -7,6 +7,9 @@ class LibraryAppConfig(AppConfig):
     name = 'library_app'
 
     def ready(self):
+        # Cache invalidation hooks must be connected in every process
+        from . import signals  # noqa: F401
+
         # 1. Check if we are running via 'runserver' (Development)
         is_runserver = 'runserver' in sys.argv
 
@@ -15,7 +18,7 @@ class LibraryAppConfig(AppConfig):
             return
 
         # 3. Prevent scheduler from running during utility commands (migrate, etc.)
-        ignore_commands = ['migrate', 'makemigrations', 'collectstatic', 'createsuperuser', 'force_checkout', 'test']
+        ignore_commands = ['migrate', 'makemigrations', 'collectstatic', 'createsuperuser', 'force_checkout', 'rebuild_attendance_stats', 'benchmark_patron_search', 'send_outbox', 'explain_attendance_queries', 'archive_attendance', 'seed_library_data', 'benchmark_views', 'test']
         if any(cmd in sys.argv for cmd in ignore_commands):
             return
 
@@ -32,8 +35,27 @@ class LibraryAppConfig(AppConfig):
                 print("⏰ Running Scheduled Force Checkout...")
                 call_command('force_checkout')
 
+            def archive_job():
+                call_command('archive_attendance')
+
+            def occupancy_job():
+                from library_app.stats import reconcile_occupancy
+                reconcile_occupancy()
+
+            def outbox_job():
+                from library_app.outbox import drain_outbox
+                while drain_outbox()['claimed']:
+                    pass
+
             scheduler = BackgroundScheduler(timezone=settings.TIME_ZONE)
             scheduler.add_job(auto_checkout_job, 'cron', hour=16, minute=45)
+            # After the forced checkout; moves sessions only on the first run of a new academic
+            # year, and deletes expired scan receipts every night
+            scheduler.add_job(archive_job, 'cron', hour=17, minute=0, max_instances=1, coalesce=True)
+            # Retries and anything the on-commit kick missed
+            scheduler.add_job(outbox_job, 'interval', minutes=1, max_instances=1, coalesce=True)
+            # The live occupancy counter is maintained per scan; this corrects any drift
+            scheduler.add_job(occupancy_job, 'interval', minutes=10, max_instances=1, coalesce=True)
             scheduler.start()
             print(f"✅ Scheduler Started: Auto-Checkout set for 4:45 PM Daily ({settings.TIME_ZONE})")
         except Exception as e:
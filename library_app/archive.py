@@ -0,0 +1,68 @@
+import datetime
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from .dates import local_midnight
+from .models import AttendanceLog, AttendanceArchive, ScanReceipt
+
+BATCH_SIZE = 5000
+
+ARCHIVE_FIELDS = ('pk', 'patron_id', 'scan_time', 'time_out', 'date_only')
+
+
+def academic_year_start(today=None):
+    """First day of the academic year containing today (see ACADEMIC_YEAR_START_MONTH)."""
+    today = today or timezone.localdate()
+    start_month = getattr(settings, 'ACADEMIC_YEAR_START_MONTH', 1)
+    year = today.year if today.month >= start_month else today.year - 1
+    return datetime.date(year, start_month, 1)
+
+
+def archive_cutoff(today=None):
+    """Sessions that started before this (local midnight) belong to a closed academic year."""
+    return local_midnight(academic_year_start(today))
+
+
+def archivable(before):
+    """Closed sessions that started before the cutoff. Open sessions stay put."""
+    return AttendanceLog.objects.filter(scan_time__lt=before, time_out__isnull=False)
+
+
+def archive_attendance(before=None, batch_size=BATCH_SIZE, progress=None):
+    """
+    Moves closed sessions that started before `before` (default: the start
+    of the current academic year) from AttendanceLog into AttendanceArchive,
+    batch_size rows per transaction, so a run can be interrupted and resumed.
+    The rollups are not touched: they already count these sessions.
+    Returns the number of rows moved.
+    """
+    before = before or archive_cutoff()
+    moved = 0
+    while True:
+        with transaction.atomic():
+            rows = list(archivable(before).order_by('pk').values(*ARCHIVE_FIELDS)[:batch_size])
+            if not rows:
+                return moved
+            AttendanceArchive.objects.bulk_create([
+                AttendanceArchive(
+                    id=row['pk'], patron_id=row['patron_id'], scan_time=row['scan_time'],
+                    time_out=row['time_out'], date_only=row['date_only'],
+                )
+                for row in rows
+            ], batch_size=1000)
+            AttendanceLog.objects.filter(pk__in=[row['pk'] for row in rows]).delete()
+        moved += len(rows)
+        if progress:
+            progress(moved)
+
+
+def prune_scan_receipts(now=None):
+    """
+    Deletes scan idempotency receipts older than SCAN_RECEIPT_DAYS; by then
+    no kiosk still holds the scan in its offline queue. Returns how many.
+    """
+    cutoff = (now or timezone.now()) - datetime.timedelta(days=settings.SCAN_RECEIPT_DAYS)
+    deleted, _ = ScanReceipt.objects.filter(received_at__lt=cutoff).delete()
+    return deleted
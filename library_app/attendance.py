@@ -0,0 +1,454 @@
+from collections import namedtuple
+
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.utils import timezone
+
+from .models import (
+    Patron, AttendanceLog, ScanReceipt, DailyAttendanceStat, DepartmentStat, PatronStat, PatronMonthlyStat, Occupancy,
+)
+from .live import live_feed
+from .metrics import timed
+from .patron_cache import patron_cache
+from .stats import StatDeltas
+
+
+# Result of one scan. scan_type is 'in', 'out', or 'full' when a check-in was
+# refused because the library is at capacity; changed is False when a
+# concurrent scan of the same ID (two kiosks, or a double-read) already
+# applied the toggle and this request only reports the resulting state.
+ScanResult = namedtuple('ScanResult', [
+    'patron_id', 'id_number', 'first_name', 'last_name', 'role',
+    'scan_type', 'changed', 'time',
+])
+
+
+# One statement = one round trip. Every CTE sees the same snapshot, so:
+#   * an open session in the snapshot is closed (and no new one is opened);
+#   * otherwise a session is opened, and the partial unique index turns a
+#     racing duplicate check-in into a no-op instead of a second open row;
+#   * a racing duplicate check-out finds the row already closed and, since it
+#     still saw it open in its snapshot, does not reopen it;
+#   * the patron row is key-share locked first, so it can't be deleted under
+#     us, and if it is already gone nothing is written and the fourth column
+#     says so (no foreign key error to untangle, deferred or not);
+#   * with an idempotency key, the ScanReceipt is inserted first with ON
+#     CONFLICT DO NOTHING and the toggle only happens if that inserted a row.
+#     A replay (or the loser of a race on the same key) inserts nothing,
+#     writes nothing, and the last column says so.
+# The daily, per-department and per-patron rollups and the occupancy counter
+# are upserted in the same statement, only for the write that actually
+# happened. With a capacity, a check-in is refused while the counter (as of
+# the snapshot) is at or above it; simultaneous check-ins at the limit can
+# each still get in.
+TOGGLE_SQL = """
+WITH patron AS (
+    SELECT id FROM {patron} WHERE id = %(patron_id)s FOR KEY SHARE
+),
+had_open AS (
+    SELECT EXISTS (
+        SELECT 1 FROM {log} WHERE patron_id = %(patron_id)s AND time_out IS NULL
+    ) AS value
+),
+at_capacity AS (
+    SELECT %(capacity)s::int IS NOT NULL AND COALESCE(
+        (SELECT current FROM {occupancy} WHERE id = 1), 0
+    ) >= %(capacity)s::int AS value
+),
+eligible AS (
+    SELECT EXISTS (SELECT 1 FROM patron)
+       AND ((SELECT value FROM had_open) OR NOT (SELECT value FROM at_capacity)) AS value
+),
+receipt AS (
+    INSERT INTO {receipt} (key, patron_id, scan_type, scanned_at, received_at)
+    SELECT %(key)s, %(patron_id)s,
+           CASE WHEN (SELECT value FROM had_open) THEN 'out' ELSE 'in' END, %(now)s, %(now)s
+    WHERE %(key)s::text IS NOT NULL AND (SELECT value FROM eligible)
+    ON CONFLICT (key) DO NOTHING
+    RETURNING id
+),
+closed AS (
+    UPDATE {log} SET time_out = %(now)s
+    WHERE patron_id = %(patron_id)s AND time_out IS NULL AND EXISTS (SELECT 1 FROM patron)
+      AND (%(key)s::text IS NULL OR EXISTS (SELECT 1 FROM receipt))
+    RETURNING id, scan_time
+),
+opened AS (
+    INSERT INTO {log} (patron_id, scan_time, time_out, date_only)
+    SELECT %(patron_id)s, %(now)s, NULL, %(today)s
+    WHERE EXISTS (SELECT 1 FROM patron)
+      AND NOT (SELECT value FROM had_open) AND NOT (SELECT value FROM at_capacity)
+      AND (%(key)s::text IS NULL OR EXISTS (SELECT 1 FROM receipt))
+    ON CONFLICT (patron_id) WHERE time_out IS NULL DO NOTHING
+    RETURNING id
+),
+daily_in AS (
+    INSERT INTO {stat} (date, department, program, role, visits, checkouts, total_seconds)
+    SELECT %(today)s, %(department)s, %(program)s, %(role)s, 1, 0, 0 FROM opened
+    ON CONFLICT (date, department, program, role)
+    DO UPDATE SET visits = {stat}.visits + 1
+),
+department_in AS (
+    INSERT INTO {department_stat} (department, visits)
+    SELECT %(department)s, 1 FROM opened
+    ON CONFLICT (department)
+    DO UPDATE SET visits = {department_stat}.visits + 1
+),
+daily_out AS (
+    INSERT INTO {stat} (date, department, program, role, visits, checkouts, total_seconds)
+    SELECT (scan_time AT TIME ZONE %(tz)s)::date, %(department)s, %(program)s, %(role)s, 0, 1,
+           GREATEST(0, EXTRACT(EPOCH FROM %(now)s - scan_time))::bigint
+    FROM closed
+    ON CONFLICT (date, department, program, role)
+    DO UPDATE SET checkouts = {stat}.checkouts + 1,
+                  total_seconds = {stat}.total_seconds + EXCLUDED.total_seconds
+),
+patron_in AS (
+    INSERT INTO {patron_stat} (patron_id, visits, total_seconds, last_visit)
+    SELECT %(patron_id)s, 1, 0, %(now)s FROM opened
+    ON CONFLICT (patron_id)
+    DO UPDATE SET visits = {patron_stat}.visits + 1,
+                  last_visit = GREATEST({patron_stat}.last_visit, EXCLUDED.last_visit)
+),
+patron_out AS (
+    INSERT INTO {patron_stat} (patron_id, visits, total_seconds, last_visit)
+    SELECT %(patron_id)s, 0, GREATEST(0, EXTRACT(EPOCH FROM %(now)s - scan_time))::bigint, NULL
+    FROM closed
+    ON CONFLICT (patron_id)
+    DO UPDATE SET total_seconds = {patron_stat}.total_seconds + EXCLUDED.total_seconds
+),
+monthly_in AS (
+    INSERT INTO {monthly_stat} (patron_id, year, month, visits, total_seconds)
+    SELECT %(patron_id)s, %(year)s, %(month)s, 1, 0 FROM opened
+    ON CONFLICT (patron_id, year, month)
+    DO UPDATE SET visits = {monthly_stat}.visits + 1
+),
+monthly_out AS (
+    INSERT INTO {monthly_stat} (patron_id, year, month, visits, total_seconds)
+    SELECT %(patron_id)s,
+           EXTRACT(YEAR FROM scan_time AT TIME ZONE %(tz)s)::int,
+           EXTRACT(MONTH FROM scan_time AT TIME ZONE %(tz)s)::int,
+           0, GREATEST(0, EXTRACT(EPOCH FROM %(now)s - scan_time))::bigint
+    FROM closed
+    ON CONFLICT (patron_id, year, month)
+    DO UPDATE SET total_seconds = {monthly_stat}.total_seconds + EXCLUDED.total_seconds
+),
+occupancy AS (
+    INSERT INTO {occupancy} (id, current)
+    SELECT 1, (SELECT count(*) FROM opened) - (SELECT count(*) FROM closed)
+    WHERE EXISTS (SELECT 1 FROM opened) OR EXISTS (SELECT 1 FROM closed)
+    ON CONFLICT (id)
+    DO UPDATE SET current = {occupancy}.current + EXCLUDED.current
+)
+SELECT (SELECT value FROM had_open),
+       EXISTS (SELECT 1 FROM closed) OR EXISTS (SELECT 1 FROM opened),
+       (SELECT value FROM at_capacity),
+       EXISTS (SELECT 1 FROM patron),
+       %(key)s::text IS NOT NULL AND NOT EXISTS (SELECT 1 FROM receipt) AND (
+           (SELECT value FROM eligible) OR EXISTS (SELECT 1 FROM {receipt} WHERE key = %(key)s)
+       )
+"""
+
+
+def toggle_attendance(id_number, now=None, capacity=None, key=None):
+    """
+    Checks the patron IN if they have no open session, otherwise OUT.
+    Returns a ScanResult, or None if the ID does not exist. With a capacity,
+    a check-in while that many people are inside is refused (scan_type
+    'full'); check-outs always go through.
+
+    key is the kiosk's idempotency key for this scan. The toggle is recorded
+    under it as a ScanReceipt in the same write, so the same scan replayed
+    later (live, or from the offline queue through apply_scan_batch) finds
+    the key taken, toggles nothing and is answered from the receipt.
+
+    The patron's identity comes from patron_cache, so a warm scan only
+    touches the database for the attendance write itself.
+    """
+    now = timezone.localtime(now or timezone.now())
+
+    # Timed separately so /metrics/ and Server-Timing show lookup vs write
+    with timed('scan_lookup'):
+        identity = patron_cache.get(id_number)
+    if identity is None:
+        return None
+
+    try:
+        with timed('scan_write'):
+            if connection.vendor == 'postgresql':
+                had_open, changed, full, replayed = _toggle_postgresql(identity, now, capacity, key)
+            else:
+                had_open, changed, full, replayed = _toggle_generic(identity, now, capacity, key)
+    except Patron.DoesNotExist:
+        # The cached patron was deleted by another process.
+        patron_cache.invalidate(id_number)
+        return None
+
+    if replayed:
+        return _replayed_result(ScanReceipt.objects.select_related('patron').get(key=key))
+
+    if had_open:
+        scan_type = 'out'
+    elif full and not changed:
+        scan_type = 'full'
+    else:
+        scan_type = 'in'
+
+    if changed:
+        # Push it to open dashboards without waiting for the next poll
+        transaction.on_commit(live_feed.notify)
+
+    return ScanResult(
+        identity['id'], identity['id_number'], identity['first_name'], identity['last_name'],
+        identity['role'], scan_type, changed, now,
+    )
+
+
+def _replayed_result(receipt):
+    """The ScanResult recorded under receipt (changed=False), or None if its patron is gone."""
+    if receipt.patron is None or receipt.scan_type not in ('in', 'out'):
+        return None
+    patron = receipt.patron
+    return ScanResult(
+        patron.pk, patron.id_number, patron.first_name, patron.last_name, patron.role,
+        receipt.scan_type, False, timezone.localtime(receipt.scanned_at),
+    )
+
+
+def _toggle_postgresql(identity, now, capacity=None, key=None):
+    sql = TOGGLE_SQL.format(
+        patron=connection.ops.quote_name(Patron._meta.db_table),
+        receipt=connection.ops.quote_name(ScanReceipt._meta.db_table),
+        log=connection.ops.quote_name(AttendanceLog._meta.db_table),
+        stat=connection.ops.quote_name(DailyAttendanceStat._meta.db_table),
+        department_stat=connection.ops.quote_name(DepartmentStat._meta.db_table),
+        patron_stat=connection.ops.quote_name(PatronStat._meta.db_table),
+        monthly_stat=connection.ops.quote_name(PatronMonthlyStat._meta.db_table),
+        occupancy=connection.ops.quote_name(Occupancy._meta.db_table),
+    )
+    params = {
+        'patron_id': identity['id'],
+        'now': now,
+        'today': now.date(),
+        'year': now.year,
+        'month': now.month,
+        'tz': settings.TIME_ZONE,
+        'department': identity['department'] or '',
+        'program': identity['program'] or '',
+        'role': identity['role'] or '',
+        'capacity': capacity,
+        'key': key,
+    }
+
+    had_open, changed, full, found, replayed = _execute(sql, params)
+    if not found:
+        raise Patron.DoesNotExist
+    return had_open, changed, full, replayed
+
+
+def _execute(sql, params):
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.fetchone()
+
+
+def _toggle_generic(identity, now, capacity=None, key=None):
+    """Fallback for databases without ON CONFLICT ... WHERE (e.g. SQLite in dev)."""
+    patron_id = identity['id']
+    classification = (identity['department'], identity['program'], identity['role'])
+    deltas = StatDeltas()
+
+    with transaction.atomic():
+        if not Patron.objects.select_for_update().filter(pk=patron_id).exists():
+            raise Patron.DoesNotExist
+
+        open_log = AttendanceLog.objects.select_for_update().filter(
+            patron_id=patron_id, time_out__isnull=True
+        ).first()
+
+        if open_log is None and capacity is not None and Occupancy.objects.filter(
+            pk=1, current__gte=capacity
+        ).exists():
+            if key and ScanReceipt.objects.filter(key=key).exists():
+                return False, False, False, True
+            return False, False, True, False
+
+        if key:
+            # Claim the key before writing anything; if it's taken this is a replay
+            try:
+                with transaction.atomic():
+                    ScanReceipt.objects.create(
+                        key=key, patron_id=patron_id, scan_type='out' if open_log else 'in', scanned_at=now
+                    )
+            except IntegrityError:
+                return open_log is not None, False, False, True
+
+        if open_log:
+            open_log.time_out = now
+            open_log.save(update_fields=['time_out'])
+            deltas.add_checkout(patron_id, open_log.scan_time, now, *classification)
+            deltas.apply()
+            return True, True, False, False
+
+        try:
+            with transaction.atomic():
+                AttendanceLog.objects.create(patron_id=patron_id, scan_time=now, date_only=now.date())
+        except IntegrityError:
+            # Another kiosk opened the session first.
+            return False, False, False, False
+
+        deltas.add_visit(patron_id, now, *classification)
+        deltas.apply()
+        return False, True, False, False
+
+
+# One queued kiosk scan: idempotency key, scanned ID and client timestamp.
+BatchScan = namedtuple('BatchScan', ['key', 'id_number', 'scanned_at'])
+
+
+def apply_scan_batch(scans):
+    """
+    Applies queued offline scans in client-timestamp order and returns one
+    result dict per scan, in input order.
+
+    Keys that were already applied (a retried flush, or a scan whose live
+    request got through before the kiosk gave up on it) are answered from
+    their ScanReceipt and are not toggled again; so are IDs that don't
+    exist, whose receipt says 'not_found'. The batch normally goes in as one
+    set-based transaction. If that hits an integrity error (e.g. a live scan
+    for the same patron landing mid-batch) the scans are applied one at a
+    time instead, so one conflict doesn't hold back the rest; a scan that
+    still conflicts gets 'retry': True and no receipt.
+    """
+    try:
+        return _apply_scans(scans)
+    except IntegrityError:
+        pass
+
+    results = {}
+    for scan in sorted(scans, key=lambda scan: scan.scanned_at):
+        if scan.key in results:
+            continue
+        try:
+            results[scan.key] = _apply_scans([scan])[0]
+        except IntegrityError:
+            results[scan.key] = {
+                'key': scan.key, 'duplicate': False, 'status': 'error', 'retry': True, 'message': 'Conflict, retry',
+            }
+    return [results[scan.key] for scan in scans]
+
+
+def _apply_scans(scans):
+    """
+    One transaction for the whole batch. All reads and writes are set-based:
+    receipts, patrons and open sessions are fetched once for the whole batch,
+    then closes go out as one bulk_update and new sessions as one bulk_create,
+    and the rollups get one upsert per affected row.
+    """
+    results = {}
+
+    with transaction.atomic():
+        receipts = ScanReceipt.objects.select_related('patron').filter(
+            key__in=[scan.key for scan in scans]
+        )
+        for receipt in receipts:
+            results[receipt.key] = _receipt_result(receipt, duplicate=True)
+
+        # A key repeated within the batch is applied once.
+        unique_scans = {}
+        for scan in scans:
+            if scan.key not in results:
+                unique_scans.setdefault(scan.key, scan)
+        pending = sorted(unique_scans.values(), key=lambda scan: scan.scanned_at)
+        identities = patron_cache.get_many([scan.id_number for scan in pending])
+        # Lock the patrons; any deleted since they were cached count as not found
+        patron_ids = set(Patron.objects.select_for_update().filter(
+            pk__in=[identity['id'] for identity in identities.values()]
+        ).values_list('pk', flat=True))
+        stale = [id_number for id_number, identity in identities.items() if identity['id'] not in patron_ids]
+        if stale:
+            patron_cache.invalidate(*stale)
+            identities = {id_number: identities[id_number] for id_number in identities if id_number not in stale}
+
+        open_sessions = {
+            log.patron_id: log
+            for log in AttendanceLog.objects.select_for_update().filter(
+                patron_id__in=patron_ids, time_out__isnull=True
+            )
+        }
+
+        to_close = []
+        to_create = []
+        new_receipts = []
+        deltas = StatDeltas()
+
+        for scan in pending:
+            identity = identities.get(scan.id_number)
+            if identity is None:
+                new_receipts.append(ScanReceipt(key=scan.key, scan_type='not_found', scanned_at=scan.scanned_at))
+                continue
+
+            classification = (identity['department'], identity['program'], identity['role'])
+            open_log = open_sessions.pop(identity['id'], None)
+            if open_log is not None:
+                # Never close a session before it started (clock skew between kiosks).
+                open_log.time_out = max(scan.scanned_at, open_log.scan_time)
+                if open_log.pk:
+                    to_close.append(open_log)
+                deltas.add_checkout(identity['id'], open_log.scan_time, open_log.time_out, *classification)
+                scan_type = 'out'
+            else:
+                open_log = AttendanceLog(
+                    patron_id=identity['id'], scan_time=scan.scanned_at,
+                    date_only=timezone.localdate(scan.scanned_at),
+                )
+                to_create.append(open_log)
+                open_sessions[identity['id']] = open_log
+                deltas.add_visit(identity['id'], scan.scanned_at, *classification)
+                scan_type = 'in'
+
+            new_receipts.append(ScanReceipt(
+                key=scan.key, patron_id=identity['id'], scan_type=scan_type, scanned_at=scan.scanned_at
+            ))
+
+        # Close first so the new open sessions never collide with the partial unique index.
+        AttendanceLog.objects.bulk_update(to_close, ['time_out'], batch_size=500)
+        AttendanceLog.objects.bulk_create(to_create, batch_size=500)
+        ScanReceipt.objects.bulk_create(new_receipts, batch_size=500)
+        deltas.apply()
+        if to_close or to_create:
+            # Offline scans carry their own (past) times, which the poller's
+            # overlap window doesn't reach: have dashboards reload instead.
+            transaction.on_commit(live_feed.resync)
+
+    by_patron_id = {identity['id']: identity for identity in identities.values()}
+    for receipt in new_receipts:
+        identity = by_patron_id.get(receipt.patron_id)
+        results[receipt.key] = _receipt_result(receipt, identity=identity)
+
+    return [results[scan.key] for scan in scans]
+
+
+def _receipt_result(receipt, identity=None, duplicate=False):
+    result = {'key': receipt.key, 'duplicate': duplicate}
+    if receipt.scan_type == 'not_found':
+        result.update({'status': 'error', 'message': 'ID not found'})
+        return result
+
+    if identity is None and receipt.patron is not None:
+        identity = {
+            'id_number': receipt.patron.id_number,
+            'first_name': receipt.patron.first_name,
+            'last_name': receipt.patron.last_name,
+        }
+    result.update({
+        'status': 'success',
+        'type': receipt.scan_type,
+        'time': timezone.localtime(receipt.scanned_at).strftime('%I:%M %p'),
+    })
+    if identity is not None:
+        result.update({
+            'name': f"{identity['first_name']} {identity['last_name']}",
+            'id': identity['id_number'],
+        })
+    return result
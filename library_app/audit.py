@@ -0,0 +1,93 @@
+import atexit
+import logging
+import threading
+from collections import deque
+
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+
+from .models import SystemLog
+
+logger = logging.getLogger(__name__)
+
+
+class AuditBuffer:
+    """
+    Collects SystemLog entries in memory and writes them with bulk_create
+    from a background thread, once flush_size entries are waiting or every
+    flush_interval seconds, so recording an action costs no database round
+    trip. Whatever is still buffered is written at interpreter exit.
+
+    With AUDIT_LOG_SYNC (tests turn it on) entries are written immediately.
+    """
+
+    def __init__(self, flush_size=50, flush_interval=2.0, max_pending=10000):
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self._pending = deque()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def record(self, user_id, action, details):
+        entry = SystemLog(user_id=user_id, action=action, details=details, action_time=timezone.now())
+        if getattr(settings, 'AUDIT_LOG_SYNC', False):
+            entry.save()
+            return
+
+        with self._lock:
+            if len(self._pending) >= self.max_pending:
+                # The database has been unreachable for a long time; keep the newest entries
+                self._pending.popleft()
+            self._pending.append(entry)
+            size = len(self._pending)
+            self._start()
+        if size >= self.flush_size:
+            self._wakeup.set()
+
+    def flush(self):
+        """Writes everything buffered so far. Safe to call from any thread."""
+        with self._flush_lock:
+            with self._lock:
+                entries = list(self._pending)
+                self._pending.clear()
+            if not entries:
+                return 0
+            try:
+                SystemLog.objects.bulk_create(entries, batch_size=500)
+            except Exception:
+                logger.exception("Writing %s audit log entries failed; will retry", len(entries))
+                with self._lock:
+                    self._pending.extendleft(reversed(entries))
+                    while len(self._pending) > self.max_pending:
+                        self._pending.popleft()
+                return 0
+            return len(entries)
+
+    def _start(self):
+        # Called with self._lock held
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name='audit-log', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            finally:
+                # The flusher owns its own connection; don't hold it between flushes
+                connection.close()
+
+
+audit_log = AuditBuffer(
+    flush_size=getattr(settings, 'AUDIT_FLUSH_SIZE', 50),
+    flush_interval=getattr(settings, 'AUDIT_FLUSH_INTERVAL', 2.0),
+)
+
+# The flusher is a daemon thread; make sure its last entries reach the database
+atexit.register(audit_log.flush)
@@ -0,0 +1,45 @@
+import datetime
+
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+
+def local_midnight(day):
+    """Start of day in the library's time zone (Asia/Manila) as an aware datetime."""
+    return timezone.make_aware(datetime.datetime.combine(day, datetime.time.min))
+
+
+def day_range(first_day, last_day=None):
+    """
+    Half-open [start, end) datetime bounds covering first_day..last_day
+    (inclusive, local time). Filtering with scan_time__gte/__lt on these
+    uses a plain scan_time index, unlike scan_time__date, which casts the
+    column to a local date on every row.
+    """
+    last_day = last_day or first_day
+    return local_midnight(first_day), local_midnight(last_day + datetime.timedelta(days=1))
+
+
+def filter_local_dates(queryset, field, date_start=None, date_end=None):
+    """
+    Applies an inclusive local date range (YYYY-MM-DD strings or dates;
+    either end optional, unparseable values ignored) to a datetime field
+    as a half-open range.
+    """
+    if isinstance(date_start, str):
+        date_start = _parse(date_start)
+    if isinstance(date_end, str):
+        date_end = _parse(date_end)
+
+    if date_start:
+        queryset = queryset.filter(**{f'{field}__gte': local_midnight(date_start)})
+    if date_end:
+        queryset = queryset.filter(**{f'{field}__lt': local_midnight(date_end + datetime.timedelta(days=1))})
+    return queryset
+
+
+def _parse(value):
+    try:
+        return parse_date(value)
+    except ValueError:
+        return None
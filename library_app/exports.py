@@ -0,0 +1,85 @@
+import csv
+
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+
+from .dates import filter_local_dates
+from .models import Patron, AttendanceLog, AttendanceArchive
+
+# Rows fetched per round trip; on PostgreSQL this is a server-side cursor fetch
+CHUNK_SIZE = 2000
+
+PATRON_HEADER = ['ID Number', 'First Name', 'Middle Name', 'Last Name', 'Email', 'Role', 'Department', 'Program', 'Major', 'Year Level']
+ATTENDANCE_HEADER = ['ID Number', 'First Name', 'Last Name', 'Role', 'Department', 'Program', 'Date', 'Time In', 'Time Out', 'Duration (minutes)']
+
+
+class Echo:
+    """File-like object whose write() just hands the line back, for csv.writer."""
+
+    def write(self, value):
+        return value
+
+
+def csv_response(filename, header, rows):
+    """A StreamingHttpResponse that writes header + rows as CSV one line at a time."""
+    writer = csv.writer(Echo())
+
+    def lines():
+        yield writer.writerow(header)
+        for row in rows:
+            yield writer.writerow(row)
+
+    response = StreamingHttpResponse(lines(), content_type='text/csv')
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+
+def filter_attendance_logs(logs, date_start=None, date_end=None, query_id=None):
+    """The scan history filters: local-date range (inclusive) and "ID starts with" (index-backed)."""
+    logs = filter_local_dates(logs, 'scan_time', date_start, date_end)
+    if query_id and query_id.strip():
+        logs = logs.filter(patron__id_number__startswith=query_id.strip())
+    return logs
+
+
+def patron_rows():
+    roles = dict(Patron.ROLE_CHOICES)
+    departments = dict(Patron.DEPARTMENT_CHOICES)
+    patrons = Patron.objects.order_by('last_name', 'pk').values_list(
+        'id_number', 'first_name', 'middle_name', 'last_name', 'email',
+        'role', 'department', 'program', 'major', 'year_level',
+    )
+    for row in patrons.iterator(chunk_size=CHUNK_SIZE):
+        row = list(row)
+        row[5] = roles.get(row[5], row[5])
+        row[6] = departments.get(row[6], row[6])
+        yield row
+
+
+def attendance_rows(logs):
+    departments = dict(Patron.DEPARTMENT_CHOICES)
+    roles = dict(Patron.ROLE_CHOICES)
+    logs = logs.values_list(
+        'patron__id_number', 'patron__first_name', 'patron__last_name',
+        'patron__role', 'patron__department', 'patron__program', 'scan_time', 'time_out',
+    )
+    for id_number, first_name, last_name, role, department, program, scan_time, time_out in logs.iterator(chunk_size=CHUNK_SIZE):
+        time_in = timezone.localtime(scan_time)
+        if time_out:
+            duration = int((time_out - scan_time).total_seconds() // 60)
+            time_out = timezone.localtime(time_out).strftime('%H:%M:%S')
+        else:
+            duration = ''
+        yield [
+            id_number, first_name, last_name,
+            roles.get(role, role), departments.get(department, department), program,
+            time_in.date().isoformat(), time_in.strftime('%H:%M:%S'), time_out or '', duration,
+        ]
+
+
+def export_attendance(date_start=None, date_end=None, query_id=None, archived=False):
+    log_model = AttendanceArchive if archived else AttendanceLog
+    logs = filter_attendance_logs(
+        log_model.objects.order_by('-scan_time', '-pk'), date_start, date_end, query_id
+    )
+    return csv_response('attendance_logs.csv', ATTENDANCE_HEADER, attendance_rows(logs))
@@ -0,0 +1,261 @@
+import codecs
+import csv
+from collections import namedtuple
+
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_email
+from django.db import transaction
+
+from .models import Patron
+from .patron_cache import patron_cache
+
+ACRONYM_MAP = {
+    # SBS
+    "BSA": "Bachelor of Science in Accountancy",
+    "BSBA": "Bachelor of Science in Business Administration",
+    "BSIS": "Bachelor of Science in Information Systems",
+    "BSCS": "Bachelor of Science in Computer Science",
+    "BSRM": "Bachelor of Science in Real Estate Management",
+    "BSREM": "Bachelor of Science in Real Estate Management",
+
+    # SHES
+    "BSN": "Bachelor of Science in Nursing",
+
+    # SEAS
+    "BA English": "Bachelor of Arts in English",
+    "AB English": "Bachelor of Arts in English",
+    "BA History": "Bachelor of Arts in History",
+    "AB History": "Bachelor of Arts in History",
+    "BA PolSci": "Bachelor of Arts in Political Science",
+    "AB PolSci": "Bachelor of Arts in Political Science",
+    "AB Political Science": "Bachelor of Arts in Political Science",
+    "BECEd": "Bachelor of Early Childhood Education",
+    "BEEd": "Bachelor of Elementary Education",
+    "BSEd": "Bachelor of Secondary Education",
+    "BSED": "Bachelor of Secondary Education",
+    "BEED": "Bachelor of Elementary Education",
+    "BECED": "Bachelor of Early Childhood Education",
+    "AB": "Bachelor of Arts",
+
+    # GS
+    "MAED": "Master of Arts in Education",
+    "MAE": "Master of Arts in Education",
+    "MAN": "Master of Arts in Nursing",
+
+    # BES
+    "K1": "Kinder 1",
+    "K2": "Kinder 2",
+    "G1": "Grade 1", "G2": "Grade 2", "G3": "Grade 3",
+    "G4": "Grade 4", "G5": "Grade 5", "G6": "Grade 6",
+    "G7": "Grade 7", "G8": "Grade 8", "G9": "Grade 9",
+    "G10": "Grade 10",
+    "1": "Grade 11",
+    "2": "Grade 12",
+    "SHS": "Grade 11",
+}
+
+YEAR_MAP = {
+    "1": "1st Year",
+    "2": "2nd Year",
+    "3": "3rd Year",
+    "4": "4th Year",
+    "11": "Grade 11",
+    "12": "Grade 12"
+}
+
+SHS_TRACKS = ["STEM", "ABM", "HUMSS", "GAS", "TVL"]
+
+REQUIRED_COLUMNS = ['Code', 'Last Name', 'First Name', 'Course', 'Year']
+
+# Fields an import may set; anything else on the patron is left alone
+IMPORT_FIELDS = ['first_name', 'middle_name', 'last_name', 'program', 'major', 'year_level', 'email', 'role', 'department']
+
+CHUNK_SIZE = 1000
+
+# How many per-row details the result keeps for display
+MAX_DETAILS = 50
+
+InvalidRow = namedtuple('InvalidRow', 'line id_number reason')
+ChangedRow = namedtuple('ChangedRow', 'id_number changes')
+
+
+class ImportResult:
+    """Counts (and a sample of details) for one import or dry run."""
+
+    def __init__(self, dry_run):
+        self.dry_run = dry_run
+        self.created = 0
+        self.updated = 0
+        self.unchanged = 0
+        self.invalid = 0
+        self.invalid_rows = []
+        self.changed_rows = []
+        self.processed = 0
+
+    def add_invalid(self, line, id_number, reason):
+        self.invalid += 1
+        if len(self.invalid_rows) < MAX_DETAILS:
+            self.invalid_rows.append(InvalidRow(line, id_number, reason))
+
+    def add_changed(self, id_number, changes):
+        self.updated += 1
+        if len(self.changed_rows) < MAX_DETAILS:
+            self.changed_rows.append(ChangedRow(id_number, changes))
+
+
+def parse_row(row, department):
+    """
+    Converts one CSV row to Patron field values.
+    - Converts Acronyms to Full Names.
+    - Converts Year Numbers to Text.
+    Raises ValueError with a readable reason if the row can't be imported.
+    """
+    id_number = (row.get('Code') or '').strip()
+    if not id_number:
+        raise ValueError("Missing Code")
+
+    first_name = (row.get('First Name') or '').strip()
+    last_name = (row.get('Last Name') or '').strip()
+    if not first_name or not last_name:
+        raise ValueError("Missing First Name or Last Name")
+
+    raw_program = (row.get('Course') or '').strip()
+    program = ACRONYM_MAP.get(raw_program, raw_program)
+    major = ""
+
+    raw_year = (row.get('Year') or '').strip()
+    year_level = YEAR_MAP.get(raw_year, raw_year)
+
+    # Special Logic for BES Senior High (STEM, ABM, etc.)
+    # 1 -> Grade 11, 2 -> Grade 12
+    if department == 'BES' and raw_program.upper() in SHS_TRACKS:
+        if raw_year == '1':
+            program = "Grade 11"
+            year_level = "Grade 11"
+        elif raw_year == '2':
+            program = "Grade 12"
+            year_level = "Grade 12"
+
+        major = f"Academic Track: {raw_program.upper()}"
+
+    raw_email = (row.get('Email') or '').strip()
+    if raw_email and raw_email.lower() != 'nan':
+        email = raw_email.replace(' ', '')
+        try:
+            validate_email(email)
+        except ValidationError:
+            raise ValueError(f"Invalid Email '{raw_email}'")
+    else:
+        email = None
+
+    fields = {
+        'id_number': id_number,
+        'first_name': first_name,
+        'middle_name': (row.get('Middle Name') or '').strip(),
+        'last_name': last_name,
+        'program': program,
+        'major': major,
+        'year_level': year_level,
+        'email': email,
+        'role': 'student',
+        'department': department,
+    }
+    for name, value in fields.items():
+        max_length = Patron._meta.get_field(name).max_length
+        if value and max_length and len(value) > max_length:
+            raise ValueError(f"{name.replace('_', ' ').title()} is longer than {max_length} characters")
+    return fields
+
+
+def import_patrons(csv_file, department, dry_run=False, progress=None, chunk_size=CHUNK_SIZE):
+    """
+    Creates/updates students from an uploaded CSV (Code, Last Name,
+    First Name, Middle Name, Course, Year, Email).
+
+    The file is parsed as a stream and applied chunk by chunk: one query to
+    fetch the chunk's existing patrons, then one bulk_create and one
+    bulk_update. The whole import runs in one transaction, so a failure
+    leaves nothing half-imported. With dry_run nothing is written; the
+    result says what would have been created, updated, left unchanged or
+    rejected. progress(rows_processed) is called after every chunk.
+    """
+    result = ImportResult(dry_run)
+    reader = csv.DictReader(codecs.iterdecode(csv_file, 'utf-8-sig'))
+    missing = [column for column in REQUIRED_COLUMNS if column not in (reader.fieldnames or [])]
+    if missing:
+        raise ValueError(f"Missing column(s): {', '.join(missing)}")
+
+    seen = set()
+    touched = []
+
+    with transaction.atomic():
+        chunk = []
+        for row in reader:
+            if not any((value or '').strip() for value in row.values() if isinstance(value, str)):
+                continue  # blank spreadsheet row
+
+            try:
+                fields = parse_row(row, department)
+            except ValueError as e:
+                result.add_invalid(reader.line_num, (row.get('Code') or '').strip(), str(e))
+                continue
+
+            if fields['id_number'] in seen:
+                result.add_invalid(reader.line_num, fields['id_number'], "Duplicate Code in file")
+                continue
+            seen.add(fields['id_number'])
+
+            chunk.append(fields)
+            if len(chunk) >= chunk_size:
+                touched += _apply_chunk(chunk, result)
+                chunk = []
+                if progress:
+                    progress(reader.line_num - 1)
+
+        if chunk:
+            touched += _apply_chunk(chunk, result)
+        if progress:
+            progress(reader.line_num - 1)
+
+        if not dry_run:
+            # bulk writes bypass the post_save invalidation signal
+            transaction.on_commit(lambda: patron_cache.invalidate(*touched))
+    return result
+
+
+def _apply_chunk(chunk, result):
+    """Diffs one chunk against the database and writes it. Returns the IDs it wrote."""
+    existing = Patron.objects.in_bulk([fields['id_number'] for fields in chunk], field_name='id_number')
+    to_create, to_update = [], []
+
+    for fields in chunk:
+        patron = existing.get(fields['id_number'])
+        if patron is None:
+            patron = Patron(**fields)
+            patron.search_text = patron.build_search_text()
+            to_create.append(patron)
+            result.created += 1
+            continue
+
+        changes = {
+            name: (getattr(patron, name), fields[name])
+            for name in IMPORT_FIELDS
+            if (getattr(patron, name) or '') != (fields[name] or '')
+        }
+        if not changes:
+            result.unchanged += 1
+            continue
+
+        for name, (_, new) in changes.items():
+            setattr(patron, name, new)
+        patron.search_text = patron.build_search_text()
+        to_update.append(patron)
+        result.add_changed(patron.id_number, changes)
+
+    result.processed += len(chunk)
+    if result.dry_run:
+        return []
+
+    Patron.objects.bulk_create(to_create, batch_size=CHUNK_SIZE)
+    Patron.objects.bulk_update(to_update, IMPORT_FIELDS + ['search_text'], batch_size=CHUNK_SIZE)
+    return [patron.id_number for patron in to_create + to_update]
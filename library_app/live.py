@@ -0,0 +1,194 @@
+import datetime
+import logging
+import secrets
+import threading
+import time
+from collections import deque
+
+from django.db import connection
+from django.utils import timezone
+
+from .dates import day_range
+from .models import AttendanceLog
+from .stats import current_occupancy, today_totals
+
+logger = logging.getLogger(__name__)
+
+FEED_SIZE = 5
+POLL_INTERVAL = 1.0
+# Scans are stamped just before their transaction commits; each poll re-reads
+# this far back so a late commit is still picked up (duplicates are dropped).
+OVERLAP = datetime.timedelta(seconds=10)
+# The poller stops once nobody has asked for events for this long
+IDLE_AFTER = 60.0
+
+FIELDS = ('pk', 'scan_time', 'time_out', 'patron__first_name', 'patron__last_name', 'patron__role')
+
+
+def activity_event(kind, row):
+    """One Recent Activity entry ('in' or 'out') from an AttendanceLog values() row."""
+    at = row['scan_time'] if kind == 'in' else row['time_out']
+    return {
+        'key': f"{kind}-{row['pk']}",
+        'type': kind,
+        'name': f"{row['patron__first_name']} {row['patron__last_name']}",
+        'role': (row['patron__role'] or '').capitalize(),
+        'at': at,
+        'time': timezone.localtime(at).strftime('%I:%M %p'),
+    }
+
+
+def recent_activity(limit=FEED_SIZE, today=None):
+    """
+    Today's latest check-ins and check-outs, newest first. Two bounded index
+    scans (latest scan_time, latest time_out) instead of loading the day.
+    """
+    day_start, day_end = day_range(today or timezone.localdate())
+    logs = AttendanceLog.objects.values(*FIELDS)
+    ins = logs.filter(scan_time__gte=day_start, scan_time__lt=day_end).order_by('-scan_time')[:limit]
+    outs = logs.filter(time_out__gte=day_start, time_out__lt=day_end).order_by('-time_out')[:limit]
+
+    events = [activity_event('in', row) for row in ins] + [activity_event('out', row) for row in outs]
+    events.sort(key=lambda event: event['at'], reverse=True)
+    return events[:limit]
+
+
+def live_counts():
+    """The dashboard's headline numbers: people inside now, today's visits and check-outs."""
+    return {'occupancy': current_occupancy(), **today_totals()}
+
+
+class LiveFeed:
+    """
+    Fans attendance activity out to every open dashboard in this process.
+    One background thread polls the log for new check-ins/check-outs and the
+    headline counts (only while someone is watching), and all clients read
+    from the same buffer, so database load does not grow with the number of
+    screens. Scans handled by this process wake the poller immediately.
+
+    Clients hold an opaque cursor ('<epoch>:<seq>'). A cursor from another
+    process, an earlier run or one that fell out of the buffer reads as None:
+    the client should reload the snapshot from recent_activity().
+    """
+
+    def __init__(self, poll_interval=POLL_INTERVAL, buffer_size=200):
+        self.poll_interval = poll_interval
+        self.epoch = secrets.token_hex(4)
+        self._events = deque(maxlen=buffer_size)   # (seq, event)
+        self._seq = 0
+        self._seen = {}                            # event key -> time, for the overlap window
+        self._since = None
+        self._counts = None
+        self._cond = threading.Condition()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._last_watch = 0.0
+
+    def cursor(self):
+        return f"{self.epoch}:{self._seq}"
+
+    def read(self, cursor):
+        """(events after cursor, new cursor), without waiting."""
+        with self._cond:
+            return self._read(cursor)
+
+    def wait(self, cursor, timeout):
+        """Like read(), but blocks up to timeout seconds for something new."""
+        self.watch()
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while True:
+                events, cursor_now = self._read(cursor)
+                remaining = deadline - time.monotonic()
+                if events != [] or remaining <= 0:
+                    return events, cursor_now
+                self._cond.wait(remaining)
+
+    def watch(self):
+        """Records that someone is watching and makes sure the poller runs."""
+        with self._cond:
+            self._last_watch = time.monotonic()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='live-feed', daemon=True)
+                self._thread.start()
+
+    def notify(self):
+        """Wakes the poller now (call after a scan commits)."""
+        self._wakeup.set()
+
+    def resync(self):
+        """
+        Starts a new epoch so every client reloads its snapshot (call after
+        writes the poller can't see, e.g. offline scans with past timestamps).
+        """
+        with self._cond:
+            self.epoch = secrets.token_hex(4)
+            self._events.clear()
+            self._cond.notify_all()
+        self._wakeup.set()
+
+    def poll(self):
+        """Reads new activity from the database into the buffer. Returns how many events were added."""
+        now = timezone.now()
+        since = (self._since or now) - OVERLAP
+        logs = AttendanceLog.objects.values(*FIELDS)
+        fresh = (
+            [activity_event('in', row) for row in logs.filter(scan_time__gte=since)]
+            + [activity_event('out', row) for row in logs.filter(time_out__gte=since)]
+        )
+        counts = live_counts()
+
+        with self._cond:
+            added = []
+            for event in sorted(fresh, key=lambda event: event['at']):
+                if event['key'] not in self._seen:
+                    self._seen[event['key']] = event['at']
+                    added.append(event)
+            if counts != self._counts:
+                self._counts = counts
+                added.append({'type': 'counts', **counts})
+
+            for event in added:
+                self._seq += 1
+                self._events.append((self._seq, event))
+            self._seen = {key: at for key, at in self._seen.items() if at >= since}
+            self._since = now
+            if added:
+                self._cond.notify_all()
+        return len(added)
+
+    def _read(self, cursor):
+        epoch, _, seq = (cursor or '').partition(':')
+        if epoch != self.epoch or not seq.isdigit() or int(seq) > self._seq:
+            return None, self.cursor()
+        seq = int(seq)
+        if self._events and seq < self._events[0][0] - 1:
+            # Missed events that are no longer buffered
+            return None, self.cursor()
+        return [event for event_seq, event in self._events if event_seq > seq], self.cursor()
+
+    def _run(self):
+        try:
+            while True:
+                with self._cond:
+                    if time.monotonic() - self._last_watch > IDLE_AFTER:
+                        self._thread = None
+                        # Nothing was recorded while idle: start over from "now" under a new
+                        # epoch so clients still holding old cursors reload their snapshot.
+                        self.epoch = secrets.token_hex(4)
+                        self._events.clear()
+                        self._since = None
+                        return
+                try:
+                    self.poll()
+                except Exception:
+                    logger.exception("Live feed poll failed")
+                    connection.close()
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+        finally:
+            # The poller owns its own connection
+            connection.close()
+
+
+live_feed = LiveFeed()
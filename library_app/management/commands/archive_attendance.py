@@ -0,0 +1,53 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count
+from django.db.models.functions import ExtractYear
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from library_app.archive import archive_attendance, archive_cutoff, archivable, prune_scan_receipts, BATCH_SIZE
+from library_app.dates import local_midnight
+
+
+class Command(BaseCommand):
+    help = ('Moves closed attendance sessions from past academic years into the archive table '
+            'and deletes expired scan receipts')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--before', help='Archive sessions that started before this date (YYYY-MM-DD); '
+                                             'default: start of the current academic year')
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+        parser.add_argument('--dry-run', action='store_true', help='Only report what would be moved')
+
+    def handle(self, *args, **options):
+        if options['before']:
+            day = parse_date(options['before'])
+            if day is None:
+                raise CommandError('--before must be a date in YYYY-MM-DD format')
+            before = local_midnight(day)
+        else:
+            before = archive_cutoff()
+
+        self.stdout.write(f'Archiving closed sessions that started before {timezone.localtime(before):%Y-%m-%d}.')
+
+        if options['dry_run']:
+            years = (
+                archivable(before)
+                .annotate(year=ExtractYear('scan_time', tzinfo=timezone.get_current_timezone()))
+                .values('year').annotate(total=Count('id')).order_by('year')
+            )
+            for row in years:
+                self.stdout.write(f"  {row['year']}: {row['total']} sessions")
+            return
+
+        moved = archive_attendance(
+            before, batch_size=options['batch_size'],
+            progress=lambda done: self.stdout.write(f'  {done} moved...'),
+        )
+        if moved:
+            self.stdout.write(self.style.SUCCESS(f'Moved {moved} sessions to the archive.'))
+        else:
+            self.stdout.write(self.style.WARNING('Nothing to archive.'))
+
+        pruned = prune_scan_receipts()
+        if pruned:
+            self.stdout.write(f'Deleted {pruned} expired scan receipts.')
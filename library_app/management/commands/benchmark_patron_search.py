@@ -0,0 +1,66 @@
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from library_app.models import Patron
+from library_app.search import legacy_search_filter, search_patrons
+
+FIRST_NAMES = ['Juan', 'Maria', 'Jose', 'Ana', 'Mark', 'Angela', 'Paolo', 'Kristine', 'Miguel', 'Bea']
+LAST_NAMES = ['Dela Cruz', 'Santos', 'Reyes', 'Garcia', 'Mendoza', 'Bautista', 'Villanueva', 'Ramos', 'Castro', 'Lim']
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Times the old icontains patron search against the indexed search_text search'
+
+    def add_arguments(self, parser):
+        parser.add_argument('queries', nargs='*', default=['santos', 'maria reyes', '2023-00'])
+        parser.add_argument('--seed', type=int, default=0,
+                            help='Insert this many synthetic patrons first (rolled back afterwards)')
+        parser.add_argument('--runs', type=int, default=20)
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                if options['seed']:
+                    self._seed(options['seed'])
+                self._run(options['queries'], options['runs'])
+                raise _Rollback
+        except _Rollback:
+            pass
+
+    def _seed(self, count):
+        rng = random.Random(count)
+        patrons = [
+            Patron(id_number=f'BENCH-{i:07d}', first_name=rng.choice(FIRST_NAMES), last_name=rng.choice(LAST_NAMES))
+            for i in range(count)
+        ]
+        for patron in patrons:
+            # bulk_create skips save(), so fill the search column here
+            patron.search_text = patron.build_search_text()
+        Patron.objects.bulk_create(patrons, batch_size=1000)
+        self.stdout.write(f'Seeded {count} synthetic patrons.')
+
+    def _run(self, queries, runs):
+        total = Patron.objects.count()
+        self.stdout.write(f'{total} patrons, {runs} runs per query (median ms)')
+
+        for query in queries:
+            legacy = self._time(lambda: list(Patron.objects.filter(legacy_search_filter(query))[:50]), runs)
+            indexed = self._time(lambda: list(search_patrons(Patron.objects.all(), query)[:50]), runs)
+            self.stdout.write(f'  {query!r:<20} legacy {legacy:8.2f}   indexed {indexed:8.2f}')
+
+    @staticmethod
+    def _time(fn, runs):
+        samples = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            fn()
+            samples.append((time.perf_counter() - start) * 1000)
+        return statistics.median(samples)
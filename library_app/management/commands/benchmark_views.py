@@ -0,0 +1,145 @@
+import json
+import shutil
+import statistics
+import tempfile
+import time
+import tracemalloc
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from library_app.models import Patron, AttendanceLog
+
+
+class _Rollback(Exception):
+    pass
+
+
+def _views():
+    """(name, method, url, JSON body) for each view measured."""
+    year = timezone.localdate().year
+    scan_id = Patron.objects.order_by('-pk').values_list('id_number', flat=True).first() or ''
+    return [
+        ('dashboard', 'get', reverse('dashboard'), None),
+        ('patron_list', 'get', reverse('patron_list'), None),
+        ('scan_history', 'get', reverse('scan_history'), None),
+        ('print_pdf', 'get', f"{reverse('print_pdf')}?type=yearly&year={year}", None),
+        ('export_patrons_csv', 'get', reverse('export_patrons_csv'), None),
+        ('process_scan', 'post', reverse('process_scan'), {'qr_code': scan_id}),
+    ]
+
+
+class Command(BaseCommand):
+    help = ('Requests the heavy views through the test client and prints wall time, '
+            'query count and peak Python memory per view as JSON (all writes are rolled back)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=5, help='Requests per view')
+        parser.add_argument('--only', nargs='*', help='Benchmark only these views')
+        parser.add_argument('--output', help='Write the JSON report to this file instead of stdout')
+
+    def handle(self, *args, **options):
+        if options['runs'] < 1:
+            raise CommandError('--runs must be at least 1')
+
+        report_dir = tempfile.mkdtemp(prefix='benchmark-reports-')
+        # Reports render inside the request and audit entries are written
+        # inline, so both happen on this connection and roll back with it.
+        # Outgoing mail stays in memory.
+        benchmark_settings = override_settings(
+            ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver'],
+            EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend',
+            REPORT_RENDER_SYNC=True, REPORT_CACHE_DIR=report_dir, AUDIT_LOG_SYNC=True,
+        )
+        try:
+            with benchmark_settings:
+                try:
+                    with transaction.atomic():
+                        report = self._run(options['runs'], options['only'])
+                        raise _Rollback
+                except _Rollback:
+                    pass
+        finally:
+            shutil.rmtree(report_dir, ignore_errors=True)
+
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as handle:
+                handle.write(output + '\n')
+            self.stderr.write(f"Wrote {options['output']}")
+        else:
+            self.stdout.write(output)
+
+    def _run(self, runs, only):
+        views = _views()
+        if only:
+            unknown = set(only) - {name for name, *_ in views}
+            if unknown:
+                raise CommandError(f"Unknown view(s): {', '.join(sorted(unknown))}")
+            views = [view for view in views if view[0] in only]
+
+        user = get_user_model()(username='__benchmark_views__', is_staff=True, is_superuser=True)
+        user.set_unusable_password()
+        user.save()
+        client = Client()
+        client.force_login(user)
+
+        results = {}
+        for name, method, url, body in views:
+            samples = [self._measure(client, method, url, body) for _ in range(runs)]
+            times = [sample['wall_ms'] for sample in samples]
+            # tracemalloc slows everything down, so memory gets a run of its own
+            traced = self._measure(client, method, url, body, trace_memory=True)
+            results[name] = {
+                'url': url,
+                'status': samples[-1]['status'],
+                'wall_ms_first': times[0],
+                'wall_ms_median': round(statistics.median(times), 2),
+                'wall_ms_min': min(times),
+                'queries': samples[-1]['queries'],
+                'queries_max': max(sample['queries'] for sample in samples),
+                'peak_memory_kib': traced['peak_memory_kib'],
+            }
+
+        return {
+            'generated_at': timezone.now().isoformat(),
+            'database': connection.vendor,
+            'patrons': Patron.objects.count(),
+            'attendance_logs': AttendanceLog.objects.count(),
+            'runs': runs,
+            'views': results,
+        }
+
+    @staticmethod
+    def _measure(client, method, url, body, trace_memory=False):
+        if trace_memory:
+            tracemalloc.start()
+        try:
+            with CaptureQueriesContext(connection) as queries:
+                start = time.perf_counter()
+                if method == 'post':
+                    response = client.post(url, json.dumps(body), content_type='application/json')
+                else:
+                    response = client.get(url)
+                # Streaming responses (CSV, PDF) do their work while being read;
+                # the client closes them once exhausted.
+                if response.streaming:
+                    for _ in response.streaming_content:
+                        pass
+                elapsed = time.perf_counter() - start
+            peak = tracemalloc.get_traced_memory()[1] if trace_memory else 0
+        finally:
+            if trace_memory:
+                tracemalloc.stop()
+        return {
+            'status': response.status_code,
+            'wall_ms': round(elapsed * 1000, 2),
+            'queries': len(queries),
+            'peak_memory_kib': round(peak / 1024),
+        }
@@ -0,0 +1,107 @@
+import datetime
+import random
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import OuterRef, Subquery
+from django.utils import timezone
+
+from library_app.dates import day_range
+from library_app.exports import filter_attendance_logs
+from library_app.models import Patron, AttendanceLog
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Prints query plans for the hot AttendanceLog queries (EXPLAIN ANALYZE on PostgreSQL)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed-patrons', type=int, default=0,
+                            help='Insert this many synthetic patrons first (rolled back afterwards)')
+        parser.add_argument('--seed-days', type=int, default=180,
+                            help='Days of synthetic attendance per seeded patron range')
+        parser.add_argument('--visits-per-day', type=int, default=500)
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                if options['seed_patrons']:
+                    self._seed(options['seed_patrons'], options['seed_days'], options['visits_per_day'])
+                self._explain_all()
+                raise _Rollback
+        except _Rollback:
+            pass
+
+    def _seed(self, patron_count, days, visits_per_day):
+        rng = random.Random(patron_count)
+        patrons = [
+            Patron(id_number=f'PLAN-{i:07d}', first_name='Plan', last_name=f'Patron {i}', role='student')
+            for i in range(patron_count)
+        ]
+        for patron in patrons:
+            patron.search_text = patron.build_search_text()
+        Patron.objects.bulk_create(patrons, batch_size=1000)
+        patron_ids = list(Patron.objects.filter(id_number__startswith='PLAN-').values_list('pk', flat=True))
+
+        today = timezone.localdate()
+        logs = []
+        for offset in range(days, 0, -1):
+            day = today - datetime.timedelta(days=offset)
+            start, _ = day_range(day)
+            for patron_id in rng.sample(patron_ids, min(visits_per_day, len(patron_ids))):
+                scan_time = start + datetime.timedelta(hours=8, seconds=rng.randrange(8 * 3600))
+                logs.append(AttendanceLog(
+                    patron_id=patron_id, scan_time=scan_time,
+                    time_out=scan_time + datetime.timedelta(minutes=rng.randrange(10, 180)), date_only=day,
+                ))
+            if len(logs) >= 10000:
+                AttendanceLog.objects.bulk_create(logs, batch_size=1000)
+                logs = []
+        # A few people inside right now
+        now = timezone.now()
+        logs += [AttendanceLog(patron_id=patron_id, scan_time=now) for patron_id in patron_ids[:50]]
+        AttendanceLog.objects.bulk_create(logs, batch_size=1000)
+
+        with connection.cursor() as cursor:
+            cursor.execute(f'ANALYZE {connection.ops.quote_name(AttendanceLog._meta.db_table)}')
+        self.stdout.write(f'Seeded {patron_count} patrons and {AttendanceLog.objects.count()} attendance rows.')
+
+    def _explain_all(self):
+        today = timezone.localdate()
+        day_start, day_end = day_range(today)
+        patron_id = AttendanceLog.objects.values_list('patron_id', flat=True).first() or 0
+        last_log = AttendanceLog.objects.filter(patron=OuterRef('pk')).order_by('-scan_time')
+
+        queries = [
+            ('Open session for one patron (scan toggle)',
+             AttendanceLog.objects.filter(patron_id=patron_id, time_out__isnull=True)),
+            ('Active sessions count',
+             AttendanceLog.objects.filter(time_out__isnull=True).values('pk')),
+            ('Force checkout candidates',
+             AttendanceLog.objects.filter(time_out__isnull=True).values_list('pk', 'patron_id', 'scan_time')),
+            ("Today's activity feed",
+             AttendanceLog.objects.filter(scan_time__gte=day_start, scan_time__lt=day_end).select_related('patron')),
+            ('Scan history, last 7 days, first page',
+             filter_attendance_logs(
+                 AttendanceLog.objects.select_related('patron').order_by('-scan_time'),
+                 today - datetime.timedelta(days=6), today,
+             )[:50]),
+            ('Attendance export, last 90 days',
+             filter_attendance_logs(
+                 AttendanceLog.objects.order_by('-scan_time', '-pk'),
+                 today - datetime.timedelta(days=89), today,
+             ).values_list('patron__id_number', 'scan_time', 'time_out')),
+            ('Registered Users page with last visit',
+             Patron.objects.annotate(last_scan_time=Subquery(last_log.values('scan_time')[:1]))
+             .order_by('-created_at')[:50]),
+        ]
+
+        analyze = connection.vendor == 'postgresql'
+        for title, queryset in queries:
+            self.stdout.write(self.style.MIGRATE_HEADING(title))
+            plan = queryset.explain(analyze=True, buffers=True) if analyze else queryset.explain()
+            self.stdout.write(plan)
+            self.stdout.write('')
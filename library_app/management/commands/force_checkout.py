@@ -1,7 +1,9 @@
 from django.core.management.base import BaseCommand
+from django.db import transaction
 from django.utils import timezone
 import datetime
 from library_app.models import AttendanceLog
+from library_app.stats import StatDeltas
 
 
 class Command(BaseCommand):
@@ -13,16 +15,28 @@ class Command(BaseCommand):
         # Here we use "Now" so the checkout time is accurate to when you ran the script.
         checkout_time = timezone.now()
 
-        # 2. Find ALL logs where checkout is missing (regardless of date)
-        # REMOVED: scan_time__date=today
-        open_logs = AttendanceLog.objects.filter(time_out__isnull=True)
+        with transaction.atomic():
+            # 2. Find ALL logs where checkout is missing (regardless of date)
+            # REMOVED: scan_time__date=today
+            open_logs = AttendanceLog.objects.select_for_update().filter(time_out__isnull=True)
 
-        count = open_logs.count()
+            # Only the people currently inside, so this stays small
+            sessions = list(open_logs.values_list(
+                'pk', 'patron_id', 'scan_time', 'patron__department', 'patron__program', 'patron__role'
+            ))
+            count = len(sessions)
 
-        if count > 0:
-            # 3. Update them all
-            open_logs.update(time_out=checkout_time)
+            if count > 0:
+                # 3. Update them all
+                AttendanceLog.objects.filter(pk__in=[s[0] for s in sessions]).update(time_out=checkout_time)
+
+                # 4. Keep the dashboard rollups in step
+                deltas = StatDeltas()
+                for _, patron_id, scan_time, department, program, role in sessions:
+                    deltas.add_checkout(patron_id, scan_time, checkout_time, department, program, role)
+                deltas.apply()
 
+        if count > 0:
             self.stdout.write(self.style.SUCCESS(f'Successfully closed {count} stale sessions.'))
         else:
-            self.stdout.write(self.style.WARNING('No active sessions found.'))
\ No newline at end of file
+            self.stdout.write(self.style.WARNING('No active sessions found.'))
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from library_app.stats import rebuild_daily_stats, rebuild_patron_stats, reconcile_occupancy
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the dashboard rollups (daily stats, per-patron stats, occupancy) from all attendance logs'
+
+    def handle(self, *args, **kwargs):
+        rows = rebuild_daily_stats()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt daily attendance stats ({rows} rows).'))
+
+        patrons = rebuild_patron_stats()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt per-patron stats ({patrons} patrons).'))
+
+        inside = reconcile_occupancy()
+        self.stdout.write(self.style.SUCCESS(f'Reset live occupancy ({inside} inside).'))
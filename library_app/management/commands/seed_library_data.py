@@ -0,0 +1,165 @@
+import datetime
+import math
+import random
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from library_app.dates import day_range
+from library_app.importer import SHS_TRACKS
+from library_app.models import Patron, AttendanceLog
+from library_app.reports import SCHOOL_DATA
+from library_app.stats import rebuild_daily_stats, rebuild_patron_stats, reconcile_occupancy
+
+FIRST_NAMES = ['Juan', 'Maria', 'Jose', 'Ana', 'Mark', 'Angela', 'Paolo', 'Kristine', 'Miguel', 'Bea',
+               'John Paul', 'Princess', 'Christian', 'Nicole', 'Joshua', 'Camille', 'Carlo', 'Jasmine']
+LAST_NAMES = ['Dela Cruz', 'Santos', 'Reyes', 'Garcia', 'Mendoza', 'Bautista', 'Villanueva', 'Ramos',
+              'Castro', 'Lim', 'Aquino', 'Navarro', 'Torres', 'Flores', 'Gonzales', 'Rivera', 'Soriano']
+
+# Share of students per department (roughly the campus enrollment)
+DEPARTMENT_WEIGHTS = {'SBS': 35, 'SEAS': 25, 'SHES': 15, 'BES': 20, 'GS': 5}
+ROLE_WEIGHTS = {'student': 88, 'faculty': 8, 'guest': 4}
+COLLEGE_YEARS = ['1st Year', '2nd Year', '3rd Year', '4th Year']
+GRADUATE_YEARS = ['1st Year', '2nd Year']
+
+# Traffic shape: closed on Sundays, a light Saturday, quiet during breaks
+WEEKDAY_FACTOR = [1.0, 1.0, 1.0, 1.0, 0.9, 0.35, 0.0]
+MONTH_FACTOR = {1: 1.0, 2: 1.0, 3: 1.15, 4: 0.6, 5: 0.3, 6: 0.2, 7: 0.4,
+                8: 0.9, 9: 1.0, 10: 1.15, 11: 1.0, 12: 0.6}
+# (first hour, last hour, weight): morning, lunch and afternoon rushes over a steady trickle
+ARRIVAL_WINDOWS = [(7.5, 8.5, 25), (11.5, 13.0, 30), (15.0, 16.0, 15), (8.0, 16.5, 30)]
+OPENING_HOUR = 7.5
+CLOSING_HOUR = 16.75  # force_checkout runs at 16:45
+MEDIAN_SESSION_MINUTES = 50
+
+
+class Command(BaseCommand):
+    help = 'Seeds synthetic patrons and realistic attendance history for load testing and benchmarks'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--patrons', type=int, default=3000)
+        parser.add_argument('--days', type=int, default=365, help='Days of attendance history up to yesterday')
+        parser.add_argument('--visits-per-day', type=int, default=400,
+                            help='Visits on a regular weekday in term time')
+        parser.add_argument('--inside-now', type=int, default=25,
+                            help='Open sessions to leave for today (people currently inside)')
+        parser.add_argument('--prefix', default='SEED-', help='ID number prefix of the generated patrons')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed, for repeatable data sets')
+        parser.add_argument('--replace', action='store_true',
+                            help='Delete patrons (and their logs) from an earlier run with the same prefix first')
+
+    def handle(self, *args, **options):
+        prefix = options['prefix']
+        if not prefix:
+            raise CommandError('--prefix must not be empty')
+
+        existing = Patron.objects.filter(id_number__startswith=prefix)
+        if existing.exists():
+            if not options['replace']:
+                raise CommandError(f'Patrons with the prefix {prefix!r} already exist; pass --replace to reseed them.')
+            deleted, _ = existing.delete()
+            self.stdout.write(f'Deleted {deleted} rows from the previous run.')
+
+        rng = random.Random(options['seed'])
+        patron_ids, activity = self._seed_patrons(rng, prefix, options['patrons'])
+        total = self._seed_logs(rng, patron_ids, activity, options['days'], options['visits_per_day'], options['inside_now'])
+
+        rebuild_daily_stats()
+        rebuild_patron_stats()
+        reconcile_occupancy()
+        self.stdout.write(self.style.SUCCESS(
+            f'Seeded {len(patron_ids)} patrons and {total} attendance logs; rollups rebuilt.'
+        ))
+
+    def _seed_patrons(self, rng, prefix, count):
+        roles, role_weights = zip(*ROLE_WEIGHTS.items())
+        departments, department_weights = zip(*DEPARTMENT_WEIGHTS.items())
+
+        patrons = []
+        for i in range(count):
+            role = rng.choices(roles, role_weights)[0]
+            patron = Patron(
+                id_number=f'{prefix}{i:06d}', role=role,
+                first_name=rng.choice(FIRST_NAMES), last_name=rng.choice(LAST_NAMES),
+                middle_name=rng.choice(LAST_NAMES) if rng.random() < 0.8 else '',
+            )
+            if role != 'guest':
+                patron.department = rng.choices(departments, department_weights)[0]
+            if role == 'student':
+                self._assign_program(rng, patron)
+            # bulk_create skips save(), so fill the search column here
+            patron.search_text = patron.build_search_text()
+            patrons.append(patron)
+
+        Patron.objects.bulk_create(patrons, batch_size=1000)
+        self.stdout.write(f'Created {count} patrons.')
+
+        patron_ids = list(Patron.objects.filter(id_number__startswith=prefix).order_by('pk').values_list('pk', flat=True))
+        # A few regulars account for most visits
+        activity = [rng.paretovariate(1.2) for _ in patron_ids]
+        return patron_ids, activity
+
+    @staticmethod
+    def _assign_program(rng, patron):
+        program = rng.choice(SCHOOL_DATA[patron.department])
+        patron.program = program
+        if patron.department == 'GS':
+            patron.year_level = rng.choice(GRADUATE_YEARS)
+        elif patron.department != 'BES':
+            patron.year_level = rng.choice(COLLEGE_YEARS)
+        elif program in ('Grade 11', 'Grade 12'):
+            patron.year_level = program
+            patron.major = f'Academic Track: {rng.choice(SHS_TRACKS)}'
+
+    def _seed_logs(self, rng, patron_ids, activity, days, visits_per_day, inside_now):
+        today = timezone.localdate()
+        logs = []
+        total = 0
+
+        for offset in range(days, 0, -1):
+            day = today - datetime.timedelta(days=offset)
+            factor = WEEKDAY_FACTOR[day.weekday()] * MONTH_FACTOR[day.month]
+            visits = max(0, round(rng.gauss(visits_per_day * factor, visits_per_day * factor * 0.1)))
+            if not visits:
+                continue
+
+            day_start, _ = day_range(day)
+            for patron_id in self._visitors(rng, patron_ids, activity, visits):
+                scan_time = day_start + datetime.timedelta(hours=self._arrival(rng))
+                closing = day_start + datetime.timedelta(hours=CLOSING_HOUR)
+                session = datetime.timedelta(minutes=max(5.0, rng.lognormvariate(math.log(MEDIAN_SESSION_MINUTES), 0.6)))
+                logs.append(AttendanceLog(
+                    patron_id=patron_id, scan_time=scan_time, time_out=min(scan_time + session, closing), date_only=day,
+                ))
+
+            if len(logs) >= 10000:
+                AttendanceLog.objects.bulk_create(logs, batch_size=1000)
+                total += len(logs)
+                logs = []
+                self.stdout.write(f'  {total} logs...')
+
+        now = timezone.localtime()
+        day_start, _ = day_range(now.date())
+        hours_open = (now - day_start) / datetime.timedelta(hours=1)
+        if inside_now and OPENING_HOUR <= hours_open < CLOSING_HOUR:
+            for patron_id in self._visitors(rng, patron_ids, activity, inside_now):
+                minutes_ago = rng.uniform(1, min(120.0, (hours_open - OPENING_HOUR) * 60))
+                logs.append(AttendanceLog(
+                    patron_id=patron_id, scan_time=now - datetime.timedelta(minutes=minutes_ago), date_only=now.date(),
+                ))
+
+        AttendanceLog.objects.bulk_create(logs, batch_size=1000)
+        return total + len(logs)
+
+    @staticmethod
+    def _visitors(rng, patron_ids, activity, count):
+        """Up to count distinct patrons, favouring the regulars."""
+        count = min(count, len(patron_ids))
+        picked = dict.fromkeys(rng.choices(patron_ids, activity, k=count * 2))
+        return list(picked)[:count]
+
+    @staticmethod
+    def _arrival(rng):
+        """Hours after midnight at which a visitor scans in."""
+        first, last, _ = rng.choices(ARRIVAL_WINDOWS, [weight for _, _, weight in ARRIVAL_WINDOWS])[0]
+        return rng.uniform(first, last)
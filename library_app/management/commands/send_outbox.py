@@ -0,0 +1,36 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from library_app.outbox import drain_outbox, retry_dead
+
+
+class Command(BaseCommand):
+    help = 'Sends queued emails from the outbox (retrying failures with backoff)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help='Keep running, polling every --interval seconds')
+        parser.add_argument('--interval', type=int, default=30)
+        parser.add_argument('--retry-dead', action='store_true', help='Re-queue messages that gave up, then send')
+
+    def handle(self, *args, **options):
+        if options['retry_dead']:
+            count = retry_dead()
+            self.stdout.write(f'Re-queued {count} dead email(s).')
+
+        while True:
+            totals = {'sent': 0, 'failed': 0, 'dead': 0}
+            while True:
+                counts = drain_outbox()
+                for key in totals:
+                    totals[key] += counts[key]
+                if not counts['claimed']:
+                    break
+
+            if any(totals.values()):
+                self.stdout.write(self.style.SUCCESS(
+                    f"Sent {totals['sent']}, will retry {totals['failed']}, gave up on {totals['dead']}."
+                ))
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,175 @@
+import bisect
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+
+from django.db import connection
+
+# Upper bounds (Prometheus "le") of the histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+# The RequestTiming of the request being handled in this thread, if any
+_current = contextvars.ContextVar('request_timing', default=None)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # the last one is +Inf
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def samples(self, labels):
+        """(name suffix, labels, value) for each exposition line, buckets cumulative."""
+        cumulative = 0
+        for bound, count in zip([*self.buckets, '+Inf'], self.counts):
+            cumulative += count
+            yield '_bucket', {**labels, 'le': str(bound)}, cumulative
+        yield '_sum', labels, round(self.sum, 6)
+        yield '_count', labels, self.count
+
+
+class RequestMetrics:
+    """
+    Request counters and histograms for this process, per URL name, plus the
+    timed() phases. Rendered in the Prometheus text format by the metrics
+    view. Waitress serves from one process, so this is the whole picture;
+    with several processes a scraper sees each one's share.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.requests = {}        # (view, method, status) -> count
+            self.latency = {}         # view -> Histogram
+            self.queries = {}         # view -> Histogram
+            self.query_seconds = {}   # view -> total seconds
+            self.response_bytes = {}  # view -> Histogram
+            self.phases = {}          # phase -> Histogram
+
+    def observe_request(self, view, method, status, seconds, queries, query_seconds, size=None):
+        with self._lock:
+            key = (view, method, str(status))
+            self.requests[key] = self.requests.get(key, 0) + 1
+            self.latency.setdefault(view, Histogram(LATENCY_BUCKETS)).observe(seconds)
+            self.queries.setdefault(view, Histogram(QUERY_BUCKETS)).observe(queries)
+            self.query_seconds[view] = self.query_seconds.get(view, 0) + query_seconds
+            if size is not None:
+                self.response_bytes.setdefault(view, Histogram(SIZE_BUCKETS)).observe(size)
+
+    def observe_phase(self, phase, seconds):
+        with self._lock:
+            self.phases.setdefault(phase, Histogram(LATENCY_BUCKETS)).observe(seconds)
+
+    def render(self):
+        with self._lock:
+            families = [
+                ('library_http_requests_total', 'counter', 'Requests handled, by URL name, method and status.', [
+                    ('', {'view': view, 'method': method, 'status': status}, count)
+                    for (view, method, status), count in sorted(self.requests.items())
+                ]),
+                ('library_http_request_duration_seconds', 'histogram',
+                 'Time spent in the middleware chain and view (streamed bodies excluded).',
+                 _histogram_samples(self.latency, 'view')),
+                ('library_db_queries_per_request', 'histogram', 'Database queries run by one request.',
+                 _histogram_samples(self.queries, 'view')),
+                ('library_db_query_duration_seconds_total', 'counter', 'Time spent executing database queries.', [
+                    ('', {'view': view}, round(seconds, 6)) for view, seconds in sorted(self.query_seconds.items())
+                ]),
+                ('library_http_response_size_bytes', 'histogram', 'Response body size (streamed responses excluded).',
+                 _histogram_samples(self.response_bytes, 'view')),
+                ('library_phase_duration_seconds', 'histogram', 'Time spent in instrumented steps, e.g. scan lookup vs write.',
+                 _histogram_samples(self.phases, 'phase')),
+            ]
+
+        lines = []
+        for name, kind, help_text, samples in families:
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            for suffix, labels, value in samples:
+                lines.append(f'{name}{suffix}{_labels(labels)} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+def _histogram_samples(histograms, label):
+    return [
+        sample
+        for key, histogram in sorted(histograms.items())
+        for sample in histogram.samples({label: key})
+    ]
+
+
+def _labels(labels):
+    def escape(value):
+        return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+    return '{' + ','.join(f'{key}="{escape(value)}"' for key, value in labels.items()) + '}'
+
+
+class RequestTiming:
+    """
+    Per-request tallies. Installed as a database execute wrapper it counts
+    queries and their time; timed() adds its phases here for the
+    Server-Timing header.
+    """
+
+    def __init__(self):
+        self.queries = 0
+        self.query_seconds = 0.0
+        self.phases = {}
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.query_seconds += time.perf_counter() - start
+
+    def server_timing(self, seconds):
+        """Server-Timing header value: total, database, then each phase (milliseconds)."""
+        entries = [
+            f'app;dur={seconds * 1000:.1f}',
+            f'db;dur={self.query_seconds * 1000:.1f};desc="{self.queries} queries"',
+        ]
+        entries += [f'{phase};dur={elapsed * 1000:.1f}' for phase, elapsed in self.phases.items()]
+        return ', '.join(entries)
+
+
+@contextmanager
+def track_request():
+    """Collects a RequestTiming for the block: its database queries and timed() phases."""
+    timing = RequestTiming()
+    token = _current.set(timing)
+    try:
+        with connection.execute_wrapper(timing):
+            yield timing
+    finally:
+        _current.reset(token)
+
+
+@contextmanager
+def timed(phase):
+    """Times the block into library_phase_duration_seconds and the current request's Server-Timing."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        request_metrics.observe_phase(phase, elapsed)
+        timing = _current.get()
+        if timing is not None:
+            timing.phases[phase] = timing.phases.get(phase, 0) + elapsed
+
+
+request_metrics = RequestMetrics()
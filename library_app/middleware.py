@@ -0,0 +1,69 @@
+import time
+
+from django.db import connection
+
+from .metrics import request_metrics, track_request
+from .profiling import profiling_config, save_capture, start_capture, stop_capture
+
+
+class RequestMetricsMiddleware:
+    """
+    Records every request in library_app.metrics (count, latency, database
+    queries and time, response size, per URL name) and sends the same
+    timings back in a Server-Timing header, visible in the browser's
+    network panel.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        start = time.perf_counter()
+        with track_request() as timing:
+            response = self.get_response(request)
+        elapsed = time.perf_counter() - start
+
+        match = request.resolver_match
+        view = (match.url_name or match.view_name) if match else 'unmatched'
+        request_metrics.observe_request(
+            view, request.method, response.status_code, elapsed,
+            timing.queries, timing.query_seconds,
+            size=None if response.streaming else len(response.content),
+        )
+        response['Server-Timing'] = timing.server_timing(elapsed)
+        return response
+
+
+class RequestProfilingMiddleware:
+    """
+    When staff switch profiling on (ProfilingSettings in the admin), runs a
+    sample of requests under cProfile and records every request's SQL, then
+    keeps the sampled requests and those slower than the threshold in
+    PROFILING_DIR. Switched off it costs one tuple read per request.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        enabled, sample_rate, slow_ms = profiling_config()
+        if not enabled:
+            return self.get_response(request)
+
+        start = time.perf_counter()
+        capture = start_capture(sample_rate)
+        try:
+            with connection.execute_wrapper(capture):
+                response = self.get_response(request)
+        finally:
+            stop_capture(capture)
+        elapsed = time.perf_counter() - start
+
+        reasons = []
+        if capture.profiler is not None:
+            reasons.append('sampled')
+        if elapsed * 1000 >= slow_ms:
+            reasons.append('slow')
+        if reasons:
+            save_capture(capture, request, response, elapsed, reasons)
+        return response
@@ -0,0 +1,32 @@
+# Generated by Django 6.0 on 2026-10-18 07:16
+
+from django.db import migrations, models
+
+
+def close_duplicate_open_sessions(apps, schema_editor):
+    """Keep only the latest open session per patron so the constraint can be created."""
+    AttendanceLog = apps.get_model('library_app', 'AttendanceLog')
+    latest_open = {}
+
+    for log in AttendanceLog.objects.filter(time_out__isnull=True).order_by('patron_id', '-scan_time'):
+        if log.patron_id not in latest_open:
+            latest_open[log.patron_id] = log
+            continue
+        # Older duplicate: close it when the newer session started.
+        log.time_out = latest_open[log.patron_id].scan_time
+        log.save(update_fields=['time_out'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library_app', '0010_systemlog'),
+    ]
+
+    operations = [
+        migrations.RunPython(close_duplicate_open_sessions, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='attendancelog',
+            constraint=models.UniqueConstraint(condition=models.Q(('time_out__isnull', True)), fields=('patron',), name='unique_open_session_per_patron'),
+        ),
+    ]
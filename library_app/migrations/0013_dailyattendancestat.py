@@ -0,0 +1,62 @@
+# Generated by Django 6.0 on 2026-10-18 07:19
+
+from django.db import migrations, models
+from django.db.models import Count, DurationField, ExpressionWrapper, F, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+
+def backfill_daily_stats(apps, schema_editor):
+    """Builds the rollup from the existing logs, one row per local date x department x program x role."""
+    AttendanceLog = apps.get_model('library_app', 'AttendanceLog')
+    DailyAttendanceStat = apps.get_model('library_app', 'DailyAttendanceStat')
+
+    duration = ExpressionWrapper(F('time_out') - F('scan_time'), output_field=DurationField())
+    grouped = (
+        AttendanceLog.objects
+        .annotate(day=TruncDate('scan_time', tzinfo=timezone.get_current_timezone()))
+        .values('day', 'patron__department', 'patron__program', 'patron__role')
+        .annotate(visits=Count('id'), checkouts=Count('time_out'), duration=Sum(duration))
+        .order_by()
+    )
+
+    rows = {}
+    for entry in grouped.iterator():
+        key = (entry['day'], entry['patron__department'] or '', entry['patron__program'] or '',
+               entry['patron__role'] or '')
+        # NULL and '' departments/programs collapse into the same rollup row
+        row = rows.setdefault(key, DailyAttendanceStat(
+            date=key[0], department=key[1], program=key[2], role=key[3]
+        ))
+        row.visits += entry['visits']
+        row.checkouts += entry['checkouts']
+        row.total_seconds += int(entry['duration'].total_seconds()) if entry['duration'] else 0
+
+    DailyAttendanceStat.objects.bulk_create(rows.values(), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library_app', '0012_scanreceipt'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyAttendanceStat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('department', models.CharField(blank=True, default='', max_length=100)),
+                ('program', models.CharField(blank=True, default='', max_length=100)),
+                ('role', models.CharField(blank=True, default='', max_length=10)),
+                ('visits', models.PositiveIntegerField(default=0)),
+                ('checkouts', models.PositiveIntegerField(default=0)),
+                ('total_seconds', models.BigIntegerField(default=0)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('date', 'department', 'program', 'role'), name='unique_daily_attendance_stat')],
+            },
+        ),
+        migrations.RunPython(backfill_daily_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,80 @@
+# Generated by Django 6.0 on 2026-10-18 07:21
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, DurationField, ExpressionWrapper, F, Max, Sum
+from django.db.models.functions import ExtractMonth, ExtractYear
+from django.utils import timezone
+
+
+def backfill_patron_stats(apps, schema_editor):
+    """Builds each patron's all-time and per-month totals from the existing logs."""
+    AttendanceLog = apps.get_model('library_app', 'AttendanceLog')
+    PatronStat = apps.get_model('library_app', 'PatronStat')
+    PatronMonthlyStat = apps.get_model('library_app', 'PatronMonthlyStat')
+
+    tz = timezone.get_current_timezone()
+    duration = ExpressionWrapper(F('time_out') - F('scan_time'), output_field=DurationField())
+    grouped = (
+        AttendanceLog.objects
+        .annotate(year=ExtractYear('scan_time', tzinfo=tz), month=ExtractMonth('scan_time', tzinfo=tz))
+        .values('patron_id', 'year', 'month')
+        .annotate(visits=Count('id'), duration=Sum(duration), last_visit=Max('scan_time'))
+        .order_by()
+    )
+
+    totals = {}
+    monthly = []
+    for entry in grouped.iterator():
+        seconds = int(entry['duration'].total_seconds()) if entry['duration'] else 0
+        monthly.append(PatronMonthlyStat(
+            patron_id=entry['patron_id'], year=entry['year'], month=entry['month'],
+            visits=entry['visits'], total_seconds=seconds,
+        ))
+
+        total = totals.setdefault(entry['patron_id'], PatronStat(patron_id=entry['patron_id']))
+        total.visits += entry['visits']
+        total.total_seconds += seconds
+        if total.last_visit is None or entry['last_visit'] > total.last_visit:
+            total.last_visit = entry['last_visit']
+
+    PatronStat.objects.bulk_create(totals.values(), batch_size=1000)
+    PatronMonthlyStat.objects.bulk_create(monthly, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library_app', '0013_dailyattendancestat'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PatronStat',
+            fields=[
+                ('patron', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stat', serialize=False, to='library_app.patron')),
+                ('visits', models.PositiveIntegerField(default=0)),
+                ('total_seconds', models.BigIntegerField(default=0)),
+                ('last_visit', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['-visits'], name='patronstat_visits_idx'), models.Index(fields=['-total_seconds'], name='patronstat_seconds_idx')],
+            },
+        ),
+        migrations.CreateModel(
+            name='PatronMonthlyStat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('year', models.PositiveSmallIntegerField()),
+                ('month', models.PositiveSmallIntegerField()),
+                ('visits', models.PositiveIntegerField(default=0)),
+                ('total_seconds', models.BigIntegerField(default=0)),
+                ('patron', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='monthly_stats', to='library_app.patron')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['year', 'month', '-total_seconds'], name='patronmonth_seconds_idx'), models.Index(fields=['year', 'month', '-visits'], name='patronmonth_visits_idx')],
+                'constraints': [models.UniqueConstraint(fields=('patron', 'year', 'month'), name='unique_patron_monthly_stat')],
+            },
+        ),
+        migrations.RunPython(backfill_patron_stats, migrations.RunPython.noop),
+    ]
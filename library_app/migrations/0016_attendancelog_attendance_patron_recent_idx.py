@@ -0,0 +1,17 @@
+# Generated by Django 6.0 on 2026-10-18 07:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library_app', '0015_reportartifact'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='attendancelog',
+            index=models.Index(fields=['patron', '-scan_time'], name='attendance_patron_recent_idx'),
+        ),
+    ]
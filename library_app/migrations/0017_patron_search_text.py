@@ -0,0 +1,59 @@
+# Generated by Django 6.0 on 2026-10-18 07:25
+
+from django.db import migrations, models
+
+
+def backfill_search_text(apps, schema_editor):
+    Patron = apps.get_model('library_app', 'Patron')
+    patrons = list(Patron.objects.only('first_name', 'middle_name', 'last_name', 'id_number'))
+    for patron in patrons:
+        parts = [patron.first_name, patron.middle_name, patron.last_name, patron.id_number]
+        patron.search_text = ' '.join(part for part in parts if part).lower()
+    Patron.objects.bulk_update(patrons, ['search_text'], batch_size=1000)
+
+
+def create_trigram_extension(apps, schema_editor):
+    # Like TrigramExtension(), whose reverse queries pg_extension on any backend
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+
+
+def drop_trigram_extension(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('DROP EXTENSION IF EXISTS pg_trgm')
+
+
+def create_trigram_index(apps, schema_editor):
+    # GIN/pg_trgm only exist on PostgreSQL; other backends keep using LIKE scans.
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(
+        'CREATE INDEX IF NOT EXISTS patron_search_trgm_idx '
+        'ON library_app_patron USING gin (search_text gin_trgm_ops)'
+    )
+
+
+def drop_trigram_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('DROP INDEX IF EXISTS patron_search_trgm_idx')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library_app', '0016_attendancelog_attendance_patron_recent_idx'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_trigram_extension, drop_trigram_extension),
+        migrations.AddField(
+            model_name='patron',
+            name='search_text',
+            field=models.TextField(blank=True, default='', editable=False),
+        ),
+        migrations.RunPython(backfill_search_text, migrations.RunPython.noop),
+        migrations.RunPython(create_trigram_index, drop_trigram_index),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 6.0 on 2026-10-18 07:39
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library_app', '0019_emailcampaign'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='systemlog',
+            name='action_time',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 6.0 on 2026-10-18 07:40
+
+from django.db import migrations, models
+
+
+def create_scan_time_brin(apps, schema_editor):
+    # AttendanceLog is append-only in scan_time order, so a BRIN index stays
+    # tiny and serves wide ranges (monthly/yearly exports). PostgreSQL only.
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(
+        'CREATE INDEX IF NOT EXISTS attendance_scan_time_brin '
+        'ON library_app_attendancelog USING brin (scan_time) WITH (pages_per_range = 32)'
+    )
+
+
+def drop_scan_time_brin(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('DROP INDEX IF EXISTS attendance_scan_time_brin')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library_app', '0020_systemlog_action_time_default'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='attendancelog',
+            index=models.Index(fields=['scan_time'], name='attendance_scan_time_idx'),
+        ),
+        migrations.RunPython(create_scan_time_brin, drop_scan_time_brin),
+    ]
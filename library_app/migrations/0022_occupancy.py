@@ -0,0 +1,32 @@
+# Generated by Django 6.0 on 2026-10-18 07:43
+
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def seed_occupancy(apps, schema_editor):
+    Occupancy = apps.get_model('library_app', 'Occupancy')
+    AttendanceLog = apps.get_model('library_app', 'AttendanceLog')
+    Occupancy.objects.update_or_create(pk=1, defaults={
+        'current': AttendanceLog.objects.filter(time_out__isnull=True).count(),
+        'reconciled_at': timezone.now(),
+    })
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library_app', '0021_attendance_scan_time_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Occupancy',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('current', models.IntegerField(default=0)),
+                ('reconciled_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.RunPython(seed_occupancy, migrations.RunPython.noop),
+    ]
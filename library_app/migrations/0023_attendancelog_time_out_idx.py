@@ -0,0 +1,17 @@
+# Generated by Django 6.0 on 2026-10-18 07:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library_app', '0022_occupancy'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='attendancelog',
+            index=models.Index(fields=['time_out'], name='attendance_time_out_idx'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 6.0 on 2026-10-18 07:48
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library_app', '0023_attendancelog_time_out_idx'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='patron',
+            index=models.Index(fields=['id_number'], name='patron_id_prefix_idx', opclasses=['varchar_pattern_ops']),
+        ),
+        migrations.AddIndex(
+            model_name='systemlog',
+            index=models.Index(fields=['action_time'], name='systemlog_action_time_idx'),
+        ),
+    ]
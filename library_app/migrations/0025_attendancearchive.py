@@ -0,0 +1,28 @@
+# Generated by Django 6.0 on 2026-10-18 07:50
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library_app', '0024_keyset_pagination_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AttendanceArchive',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('scan_time', models.DateTimeField()),
+                ('time_out', models.DateTimeField(blank=True, null=True)),
+                ('date_only', models.DateField()),
+                ('patron', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_logs', to='library_app.patron')),
+            ],
+            options={
+                'ordering': ['-scan_time'],
+                'indexes': [models.Index(fields=['scan_time'], name='archive_scan_time_idx'), models.Index(fields=['patron', '-scan_time'], name='archive_patron_recent_idx')],
+            },
+        ),
+    ]
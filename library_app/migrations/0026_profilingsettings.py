@@ -0,0 +1,28 @@
+# Generated by Django 6.0 on 2026-10-18 08:02
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library_app', '0025_attendancearchive'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProfilingSettings',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('enabled', models.BooleanField(default=False)),
+                ('sample_rate', models.FloatField(default=0.01, help_text='Share of requests run under cProfile (0.01 = one in a hundred).', validators=[django.core.validators.MinValueValidator(0), django.core.validators.MaxValueValidator(1)])),
+                ('slow_ms', models.PositiveIntegerField(default=2000, help_text='Requests slower than this are always logged with their SQL.')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'profiling settings',
+                'verbose_name_plural': 'profiling settings',
+            },
+        ),
+    ]
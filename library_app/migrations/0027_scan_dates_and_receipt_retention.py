@@ -0,0 +1,24 @@
+# Generated by Django 6.0 on 2026-10-18 08:29
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library_app', '0026_profilingsettings'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='attendancelog',
+            name='date_only',
+            field=models.DateField(db_index=True, default=django.utils.timezone.localdate),
+        ),
+        migrations.AlterField(
+            model_name='scanreceipt',
+            name='received_at',
+            field=models.DateTimeField(auto_now_add=True, db_index=True),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 6.0 on 2026-10-18 09:30
+
+from django.db import migrations
+
+
+def drop_scan_time_brin(apps, schema_editor):
+    # attendance_scan_time_idx (btree) already serves every scan_time query,
+    # ranges included, and the planner picks it over the BRIN; keeping both
+    # only cost a second index write per scan. PostgreSQL only.
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('DROP INDEX IF EXISTS attendance_scan_time_brin')
+
+
+def create_scan_time_brin(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(
+        'CREATE INDEX IF NOT EXISTS attendance_scan_time_brin '
+        'ON library_app_attendancelog USING brin (scan_time) WITH (pages_per_range = 32)'
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library_app', '0027_scan_dates_and_receipt_retention'),
+    ]
+
+    operations = [
+        migrations.RunPython(drop_scan_time_brin, create_scan_time_brin),
+    ]
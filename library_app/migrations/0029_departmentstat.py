@@ -0,0 +1,34 @@
+# Generated by Django 6.0 on 2026-10-18 09:40
+
+from django.db import migrations, models
+from django.db.models import Sum
+
+
+def backfill_department_stats(apps, schema_editor):
+    """All-time visits per department, summed from the daily rollup."""
+    DailyAttendanceStat = apps.get_model('library_app', 'DailyAttendanceStat')
+    DepartmentStat = apps.get_model('library_app', 'DepartmentStat')
+
+    totals = DailyAttendanceStat.objects.values('department').annotate(visits=Sum('visits')).order_by()
+    DepartmentStat.objects.bulk_create([
+        DepartmentStat(department=entry['department'], visits=entry['visits'] or 0) for entry in totals
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library_app', '0028_drop_attendance_scan_time_brin'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DepartmentStat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('department', models.CharField(blank=True, default='', max_length=100, unique=True)),
+                ('visits', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(backfill_department_stats, migrations.RunPython.noop),
+    ]
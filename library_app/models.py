@@ -1,4 +1,5 @@
 from django.db import models
+from django.core.validators import MaxValueValidator, MinValueValidator
 from django.utils import timezone
 from django.contrib.auth.models import User
 
@@ -37,9 +38,29 @@ class Patron(models.Model):
     # System Fields
     created_at = models.DateTimeField(auto_now_add=True)
 
+    # Lowercased names + ID for the directory search (trigram-indexed on PostgreSQL)
+    search_text = models.TextField(blank=True, default='', editable=False)
+
+    class Meta:
+        indexes = [
+            # "ID starts with" filters (LIKE 'prefix%'); the unique index can't serve
+            # LIKE under a non-C collation on PostgreSQL. Other databases ignore opclasses.
+            models.Index(fields=['id_number'], name='patron_id_prefix_idx', opclasses=['varchar_pattern_ops']),
+        ]
+
     def __str__(self):
         return f"{self.id_number} - {self.last_name}"
 
+    def build_search_text(self):
+        parts = [self.first_name, self.middle_name, self.last_name, self.id_number]
+        return ' '.join(part for part in parts if part).lower()
+
+    def save(self, *args, **kwargs):
+        self.search_text = self.build_search_text()
+        if kwargs.get('update_fields') is not None:
+            kwargs['update_fields'] = {*kwargs['update_fields'], 'search_text'}
+        super().save(*args, **kwargs)
+
 
 class AttendanceLog(models.Model):
     patron = models.ForeignKey(Patron, on_delete=models.CASCADE, related_name='logs')
@@ -50,21 +71,292 @@ class AttendanceLog(models.Model):
     # Time Out (Blank until they scan out)
     time_out = models.DateTimeField(blank=True, null=True)
 
-    # Helper for filtering stats
-    date_only = models.DateField(auto_now_add=True, db_index=True)
+    # Helper for filtering stats: the local date of scan_time. Set it
+    # explicitly when scan_time isn't now (e.g. offline scans synced later).
+    date_only = models.DateField(default=timezone.localdate, db_index=True)
 
     class Meta:
         ordering = ['-scan_time']
+        constraints = [
+            # A patron can only have one open (not yet checked-out) session.
+            models.UniqueConstraint(
+                fields=['patron'],
+                condition=models.Q(time_out__isnull=True),
+                name='unique_open_session_per_patron',
+            ),
+        ]
+        indexes = [
+            # Latest visit of one patron (patron list "last visit" column)
+            models.Index(fields=['patron', '-scan_time'], name='attendance_patron_recent_idx'),
+            # Date-range queries (today's feed, scan history, exports) as half-open scan_time ranges.
+            # Open sessions (time_out IS NULL) use the partial unique index above.
+            models.Index(fields=['scan_time'], name='attendance_scan_time_idx'),
+            # Latest check-outs (dashboard live activity feed)
+            models.Index(fields=['time_out'], name='attendance_time_out_idx'),
+        ]
 
     def __str__(self):
         return f"{self.patron.last_name} - {self.scan_time}"
 
 
+class AttendanceArchive(models.Model):
+    """
+    Closed sessions from past academic years, moved out of AttendanceLog by
+    `python manage.py archive_attendance` so the live table only holds the
+    current year. Rows keep their original ids. The rollups
+    (DailyAttendanceStat, PatronStat, PatronMonthlyStat) still include them.
+    """
+    id = models.BigIntegerField(primary_key=True)
+    patron = models.ForeignKey(Patron, on_delete=models.CASCADE, related_name='archived_logs')
+    scan_time = models.DateTimeField()
+    time_out = models.DateTimeField(blank=True, null=True)
+    date_only = models.DateField()
+
+    class Meta:
+        ordering = ['-scan_time']
+        indexes = [
+            models.Index(fields=['scan_time'], name='archive_scan_time_idx'),
+            models.Index(fields=['patron', '-scan_time'], name='archive_patron_recent_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.patron.last_name} - {self.scan_time} (archived)"
+
+
 class SystemLog(models.Model):
-    action_time = models.DateTimeField(auto_now_add=True)
+    # Set when the action happens, not when the buffered entry is written
+    action_time = models.DateTimeField(default=timezone.now)
     user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True)
     action = models.CharField(max_length=50)
     details = models.TextField()
 
+    class Meta:
+        indexes = [
+            # Audit log pages (keyset on action_time, id) and date filters
+            models.Index(fields=['action_time'], name='systemlog_action_time_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.action} - {self.user} ({self.action_time})"
+
+class ScanReceipt(models.Model):
+    """Remembers kiosk scans (live and offline) by idempotency key so a replayed scan is not applied twice."""
+    key = models.CharField(max_length=64, unique=True)
+    patron = models.ForeignKey(Patron, on_delete=models.SET_NULL, null=True, blank=True)
+    scan_type = models.CharField(max_length=10)  # 'in', 'out' or 'not_found'
+    scanned_at = models.DateTimeField()
+    # Pruned after SCAN_RECEIPT_DAYS by the nightly archive job
+    received_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def __str__(self):
+        return f"{self.key} ({self.scan_type})"
+
+
+class DailyAttendanceStat(models.Model):
+    """
+    Rollup of AttendanceLog per local date x department x program x role.
+    Kept up to date by every scan/checkout path; rebuild with
+    `python manage.py rebuild_attendance_stats`.
+    Check-outs and seconds are counted on the date the session started.
+    A visit is classified as the patron was at scan time and stays counted
+    if the patron is later moved or deleted; a rebuild reclassifies every
+    visit still in the logs by the patron's current details.
+    """
+    date = models.DateField()
+    department = models.CharField(max_length=100, blank=True, default='')
+    program = models.CharField(max_length=100, blank=True, default='')
+    role = models.CharField(max_length=10, blank=True, default='')
+
+    visits = models.PositiveIntegerField(default=0)
+    checkouts = models.PositiveIntegerField(default=0)
+    total_seconds = models.BigIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['date', 'department', 'program', 'role'],
+                name='unique_daily_attendance_stat',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.date} {self.department} {self.program} ({self.visits})"
+
+
+class DepartmentStat(models.Model):
+    """
+    Running all-time visits per department for the dashboard pie, kept by
+    every scan path alongside DailyAttendanceStat (and classified the same
+    way) so the pie is one small read however many days have been logged.
+    """
+    department = models.CharField(max_length=100, blank=True, default='', unique=True)
+    visits = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.department} ({self.visits})"
+
+
+class PatronStat(models.Model):
+    """Running all-time totals per patron for the dashboard leaderboards."""
+    patron = models.OneToOneField(Patron, on_delete=models.CASCADE, primary_key=True, related_name='stat')
+    visits = models.PositiveIntegerField(default=0)
+    total_seconds = models.BigIntegerField(default=0)
+    last_visit = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-visits'], name='patronstat_visits_idx'),
+            models.Index(fields=['-total_seconds'], name='patronstat_seconds_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.patron_id}: {self.visits} visits"
+
+
+class PatronMonthlyStat(models.Model):
+    """Per patron per month totals, for leaderboards scoped to a year or month."""
+    patron = models.ForeignKey(Patron, on_delete=models.CASCADE, related_name='monthly_stats')
+    year = models.PositiveSmallIntegerField()
+    month = models.PositiveSmallIntegerField()
+    visits = models.PositiveIntegerField(default=0)
+    total_seconds = models.BigIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['patron', 'year', 'month'], name='unique_patron_monthly_stat'),
+        ]
+        indexes = [
+            models.Index(fields=['year', 'month', '-total_seconds'], name='patronmonth_seconds_idx'),
+            models.Index(fields=['year', 'month', '-visits'], name='patronmonth_visits_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.patron_id} {self.year}-{self.month:02d}"
+
+
+class Occupancy(models.Model):
+    """
+    Number of patrons inside right now (open sessions), kept in step by every
+    check-in/check-out path so reading it is a primary-key lookup. One row
+    (pk=1); stats.reconcile_occupancy() resets it from the attendance log.
+    """
+    current = models.IntegerField(default=0)
+    reconciled_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.current} inside"
+
+
+class ReportArtifact(models.Model):
+    """
+    A rendered PDF report, keyed by (type, year, month, data version).
+    The version is a fingerprint of the period's rollup (reports.data_version),
+    so a report is re-rendered whenever the numbers it shows change.
+    """
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('ready', 'Ready'),
+        ('failed', 'Failed'),
+    ]
+
+    report_type = models.CharField(max_length=10)  # 'yearly' or 'monthly'
+    year = models.PositiveSmallIntegerField()
+    month = models.PositiveSmallIntegerField(default=0)  # 0 for yearly reports
+    data_version = models.CharField(max_length=64)
+
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    file_path = models.CharField(max_length=255, blank=True)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['report_type', 'year', 'month', 'data_version'],
+                name='unique_report_artifact',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.report_type} {self.year}-{self.month:02d} ({self.data_version}, {self.status})"
+
+
+class EmailCampaign(models.Model):
+    """
+    A bulk "email QR codes" run for one set of Registered Users filters.
+    Each recipient is an OutboundEmail row, so rerunning the campaign only
+    queues patrons that were never sent one and retries the dead ones.
+    """
+    filters = models.CharField(max_length=500, unique=True)  # normalized querystring
+    label = models.CharField(max_length=255)
+    created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_run_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return self.label
+
+
+class OutboundEmail(models.Model):
+    """
+    Email outbox. Views only enqueue; library_app.outbox.drain_outbox sends
+    due messages over one SMTP connection per batch, retrying failures with
+    exponential backoff until MAX_ATTEMPTS, after which a message is 'dead'.
+    """
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('sent', 'Sent'),
+        ('dead', 'Dead'),  # gave up after too many failures
+    ]
+
+    to = models.EmailField(max_length=254)
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    attachment_name = models.CharField(max_length=255, blank=True)
+    attachment = models.BinaryField(null=True, blank=True)
+    attachment_type = models.CharField(max_length=100, blank=True)
+    patron = models.ForeignKey(Patron, on_delete=models.SET_NULL, null=True, blank=True, related_name='emails')
+    campaign = models.ForeignKey(EmailCampaign, on_delete=models.CASCADE, null=True, blank=True, related_name='emails')
+
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='outbox_due_idx'),
+        ]
+        constraints = [
+            # One email per patron per campaign, however many times it is rerun
+            models.UniqueConstraint(fields=['campaign', 'patron'], name='unique_campaign_recipient'),
+        ]
+
+    def __str__(self):
+        return f"{self.to}: {self.subject} ({self.status})"
+
+
+class ProfilingSettings(models.Model):
+    """
+    Switches for the request profiler (library_app.profiling), edited by
+    staff in the admin, where the captured requests are listed too. One row
+    (pk=1); until it exists profiling is off.
+    """
+    enabled = models.BooleanField(default=False)
+    sample_rate = models.FloatField(
+        default=0.01, validators=[MinValueValidator(0), MaxValueValidator(1)],
+        help_text="Share of requests run under cProfile (0.01 = one in a hundred).",
+    )
+    slow_ms = models.PositiveIntegerField(
+        default=2000, help_text="Requests slower than this are always logged with their SQL.",
+    )
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = verbose_name_plural = 'profiling settings'
+
     def __str__(self):
-        return f"{self.action} - {self.user} ({self.action_time})"
\ No newline at end of file
+        return 'Request profiling ' + ('on' if self.enabled else 'off')
@@ -0,0 +1,242 @@
+import datetime
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import connection, transaction
+from django.db.models import Count
+from django.http import QueryDict
+from django.utils import timezone
+
+from .models import Patron, OutboundEmail, EmailCampaign
+from .qr import qr_cache
+from .search import filter_patrons
+
+logger = logging.getLogger(__name__)
+
+MAX_ATTEMPTS = 6
+BACKOFF_BASE = datetime.timedelta(minutes=1)   # 1, 2, 4, 8, 16 minutes...
+BACKOFF_MAX = datetime.timedelta(hours=6)
+BATCH_SIZE = 50
+
+# A claimed message that is still pending after this is retried (the worker died mid-batch)
+CLAIM_LEASE = datetime.timedelta(minutes=5)
+
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='outbox')
+
+# Shared by every drain in this process so the provider's rate limit holds overall
+_throttle_lock = threading.Lock()
+_next_send_at = 0.0
+
+QR_SUBJECT = "UCC Library - Your QR ID"
+QR_BODY = "Hello {first_name},\n\nAttached is your personal QR Code for the library attendance system."
+
+CAMPAIGN_FILTERS = ('q', 'role', 'department', 'program', 'year_level')
+
+
+def enqueue_email(to, subject, body, attachment_name='', attachment=None, attachment_type='', patron=None):
+    """
+    Queues one email and returns it. Delivery starts in the background once
+    the surrounding transaction commits (see EMAIL_OUTBOX_AUTO_DRAIN); the
+    scheduler's periodic drain picks up anything left over.
+    """
+    email = OutboundEmail.objects.create(
+        to=to, subject=subject, body=body, patron=patron,
+        attachment_name=attachment_name, attachment=attachment, attachment_type=attachment_type,
+    )
+    if getattr(settings, 'EMAIL_OUTBOX_AUTO_DRAIN', True):
+        transaction.on_commit(lambda: _executor.submit(_drain_in_background))
+    return email
+
+
+def enqueue_qr_email(patron, subject=QR_SUBJECT, body=QR_BODY):
+    """Queues the patron's QR code as a PNG attachment. body may use {first_name}."""
+    _, png = qr_cache.get(patron.id_number)
+    return enqueue_email(
+        patron.email, subject, body.format(first_name=patron.first_name),
+        attachment_name=f"QR_{patron.id_number}.png", attachment=png, attachment_type='image/png',
+        patron=patron,
+    )
+
+
+def _drain_in_background():
+    try:
+        while drain_outbox()['claimed']:
+            pass
+    except Exception:
+        logger.exception("Outbox drain failed")
+    finally:
+        # The worker thread owns its own connection; don't leave it open
+        connection.close()
+
+
+def backoff(attempts):
+    """Delay before retry number attempts (1-based): doubles each time, capped at BACKOFF_MAX."""
+    return min(BACKOFF_BASE * (2 ** (attempts - 1)), BACKOFF_MAX)
+
+
+def _claim(batch_size, now):
+    """
+    Takes up to batch_size due messages. They stay 'pending' but are pushed
+    CLAIM_LEASE into the future, so concurrent drains skip them and a crash
+    only delays them.
+    """
+    with transaction.atomic():
+        due = OutboundEmail.objects.filter(status='pending', next_attempt_at__lte=now).order_by('next_attempt_at', 'pk')
+        if connection.features.has_select_for_update_skip_locked:
+            due = due.select_for_update(skip_locked=True)
+        ids = list(due.values_list('pk', flat=True)[:batch_size])
+        OutboundEmail.objects.filter(pk__in=ids).update(next_attempt_at=now + CLAIM_LEASE)
+    return list(OutboundEmail.objects.filter(pk__in=ids).order_by('pk'))
+
+
+def drain_outbox(batch_size=BATCH_SIZE, now=None):
+    """
+    Sends one batch of due messages over a single mail connection.
+    Returns {'claimed': n, 'sent': n, 'failed': n, 'dead': n}.
+    """
+    now = now or timezone.now()
+    rate = getattr(settings, 'EMAIL_RATE_LIMIT', 0)
+    if rate:
+        # A throttled batch must finish well inside its claim lease
+        batch_size = max(1, min(batch_size, int(rate * CLAIM_LEASE.total_seconds() / 60 / 2)))
+    batch = _claim(batch_size, now)
+    counts = {'claimed': len(batch), 'sent': 0, 'failed': 0, 'dead': 0}
+    if not batch:
+        return counts
+
+    mail = get_connection(fail_silently=False)
+    try:
+        mail.open()
+    except Exception as e:
+        # Can't reach the server at all: every message in the batch failed this attempt
+        for email in batch:
+            _record_failure(email, e, now, counts)
+        return counts
+
+    try:
+        for email in batch:
+            message = EmailMessage(email.subject, email.body, settings.DEFAULT_FROM_EMAIL, [email.to])
+            if email.attachment:
+                message.attach(email.attachment_name, bytes(email.attachment), email.attachment_type)
+            _throttle()
+            try:
+                # Same open connection for the whole batch
+                mail.send_messages([message])
+            except Exception as e:
+                _record_failure(email, e, now, counts)
+                continue
+
+            email.status, email.sent_at, email.last_error = 'sent', timezone.now(), ''
+            email.attempts += 1
+            email.save(update_fields=['status', 'sent_at', 'last_error', 'attempts'])
+            counts['sent'] += 1
+    finally:
+        mail.close()
+
+    return counts
+
+
+def _throttle():
+    """Blocks so sends stay under EMAIL_RATE_LIMIT messages per minute (0 = no limit)."""
+    global _next_send_at
+    rate = getattr(settings, 'EMAIL_RATE_LIMIT', 0)
+    if not rate:
+        return
+    with _throttle_lock:
+        now = time.monotonic()
+        wait = _next_send_at - now
+        _next_send_at = max(now, _next_send_at) + 60.0 / rate
+    if wait > 0:
+        time.sleep(wait)
+
+
+def _record_failure(email, error, now, counts):
+    email.attempts += 1
+    email.last_error = f"{type(error).__name__}: {error}"
+    if email.attempts >= MAX_ATTEMPTS:
+        email.status = 'dead'
+        counts['dead'] += 1
+        logger.error("Giving up on email %s to %s: %s", email.pk, email.to, email.last_error)
+    else:
+        email.next_attempt_at = now + backoff(email.attempts)
+        counts['failed'] += 1
+    email.save(update_fields=['attempts', 'last_error', 'status', 'next_attempt_at'])
+
+
+def retry_dead(ids=None):
+    """Puts dead messages (all, or the given ids) back in the queue with a fresh attempt count."""
+    dead = OutboundEmail.objects.filter(status='dead')
+    if ids:
+        dead = dead.filter(pk__in=ids)
+    return dead.update(status='pending', attempts=0, next_attempt_at=timezone.now())
+
+
+def campaign_for(params, user=None):
+    """The EmailCampaign for these Registered Users filters, created on first use."""
+    filters = {key: params.get(key, '').strip() for key in CAMPAIGN_FILTERS if params.get(key, '').strip()}
+    label = ' / '.join(filters.values()) or 'All patrons'
+    campaign, _ = EmailCampaign.objects.get_or_create(
+        filters=urlencode(sorted(filters.items())), defaults={'label': label[:255], 'created_by': user},
+    )
+    return campaign
+
+
+def queue_qr_campaign(campaign):
+    """
+    Queues a QR email for every patron in the campaign's filter who hasn't
+    got one yet, and re-queues the ones that died. Patrons already sent (or
+    waiting) are skipped, so rerunning a campaign only retries failures and
+    picks up newly added patrons. QR attachments come from the render
+    cache, with a large batch of misses rendered across its process pool.
+    Returns {'queued': n, 'retried': n}.
+    """
+    retried = campaign.emails.filter(status='dead').update(
+        status='pending', attempts=0, next_attempt_at=timezone.now(),
+    )
+
+    patrons = filter_patrons(Patron.objects.all(), QueryDict(campaign.filters))
+    recipients = list(
+        patrons.exclude(email__isnull=True).exclude(email='')
+        .exclude(emails__campaign=campaign)
+        .order_by('pk').values_list('pk', 'id_number', 'first_name', 'email')
+    )
+
+    pngs = dict(qr_cache.get_many([id_number for _, id_number, _, _ in recipients]))
+    OutboundEmail.objects.bulk_create([
+        OutboundEmail(
+            to=email, subject=QR_SUBJECT, body=QR_BODY.format(first_name=first_name),
+            attachment_name=f"QR_{id_number}.png", attachment=pngs[id_number], attachment_type='image/png',
+            patron_id=pk, campaign=campaign,
+        )
+        for pk, id_number, first_name, email in recipients
+    ], batch_size=500, ignore_conflicts=True)
+
+    campaign.last_run_at = timezone.now()
+    campaign.save(update_fields=['last_run_at'])
+    return {'queued': len(recipients), 'retried': retried}
+
+
+def start_campaign(campaign):
+    """Queues the campaign and starts sending, both in the outbox worker thread."""
+    def run():
+        try:
+            queue_qr_campaign(campaign)
+        except Exception:
+            logger.exception("Queueing campaign %s failed", campaign.pk)
+        _drain_in_background()
+
+    transaction.on_commit(lambda: _executor.submit(run))
+
+
+def campaign_progress(campaign):
+    """Recipient counts by status for the campaign page."""
+    counts = dict.fromkeys(['pending', 'sent', 'dead'], 0)
+    for row in campaign.emails.values('status').annotate(total=Count('id')).order_by():
+        counts[row['status']] = row['total']
+    counts['total'] = sum(counts.values())
+    return counts
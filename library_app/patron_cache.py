@@ -0,0 +1,130 @@
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+
+from .models import Patron
+
+
+# Only the fields the scanner needs to answer a scan and update the rollups.
+IDENTITY_FIELDS = ('id', 'id_number', 'first_name', 'last_name', 'role', 'department', 'program')
+
+
+class PatronIdentityCache:
+    """
+    Maps a scanned id_number to the patron's identity (pk, name, role, department, program).
+
+    By default this is a bounded in-process LRU. If PATRON_CACHE_ALIAS names a
+    Django cache (e.g. a shared Redis/Memcached/database cache), that cache is
+    used instead so several waitress processes see the same invalidations.
+    Entries are dropped by the Patron post_save/post_delete signals and by
+    bulk_import.
+    """
+
+    key_prefix = 'patron-identity:'
+
+    def __init__(self, max_size=5000, alias=None, timeout=None):
+        self.max_size = max_size
+        self.alias = alias
+        self.timeout = timeout
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def backend(self):
+        return caches[self.alias] if self.alias else None
+
+    def get(self, id_number):
+        """Returns the identity dict for id_number, or None if no such patron."""
+        identity = self._get_cached(id_number)
+        if identity is not None:
+            with self._lock:
+                self.hits += 1
+            return identity
+
+        with self._lock:
+            self.misses += 1
+
+        identity = Patron.objects.filter(id_number=id_number).values(*IDENTITY_FIELDS).first()
+        if identity is not None:
+            self._set_cached(id_number, identity)
+        return identity
+
+    def get_many(self, id_numbers):
+        """Like get() for several IDs, with one query for all the misses."""
+        found = {}
+        missing = []
+        for id_number in set(id_numbers):
+            identity = self._get_cached(id_number)
+            if identity is None:
+                missing.append(id_number)
+            else:
+                found[id_number] = identity
+
+        with self._lock:
+            self.hits += len(found)
+            self.misses += len(missing)
+
+        if missing:
+            for identity in Patron.objects.filter(id_number__in=missing).values(*IDENTITY_FIELDS):
+                found[identity['id_number']] = identity
+                self._set_cached(identity['id_number'], identity)
+        return found
+
+    def invalidate(self, *id_numbers):
+        id_numbers = [i for i in id_numbers if i]
+        if not id_numbers:
+            return
+        if self.backend is not None:
+            self.backend.delete_many([self.key_prefix + i for i in id_numbers])
+            return
+        with self._lock:
+            for id_number in id_numbers:
+                self._entries.pop(id_number, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+        # A shared backend may hold other data, so it is not flushed here;
+        # callers that change many patrons should use invalidate() with their IDs.
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'backend': self.alias or 'local-lru',
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+    def _get_cached(self, id_number):
+        if self.backend is not None:
+            return self.backend.get(self.key_prefix + id_number)
+        with self._lock:
+            identity = self._entries.get(id_number)
+            if identity is not None:
+                self._entries.move_to_end(id_number)
+            return identity
+
+    def _set_cached(self, id_number, identity):
+        if self.backend is not None:
+            self.backend.set(self.key_prefix + id_number, identity, self.timeout)
+            return
+        with self._lock:
+            self._entries[id_number] = identity
+            self._entries.move_to_end(id_number)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+
+patron_cache = PatronIdentityCache(
+    max_size=getattr(settings, 'PATRON_CACHE_SIZE', 5000),
+    alias=getattr(settings, 'PATRON_CACHE_ALIAS', None),
+    timeout=getattr(settings, 'PATRON_CACHE_TIMEOUT', 3600),
+)
@@ -0,0 +1,220 @@
+import cProfile
+import io
+import json
+import logging
+import os
+import pstats
+import random
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+from django.utils.text import slugify
+
+from .models import ProfilingSettings
+
+logger = logging.getLogger(__name__)
+
+# The switches are re-read from the database this often, in the background
+CONFIG_TTL = 30.0
+# Per captured request: SQL statements kept, and functions in the summary
+MAX_STATEMENTS = 500
+TOP_FUNCTIONS = 40
+CAPTURE_NAME = re.compile(r'^[\w.-]+$')
+
+OFF = (False, 0.0, 0)
+
+_config = {'value': OFF, 'read_at': None, 'refreshing': False, 'generation': 0}
+_config_lock = threading.Lock()
+# Only one cProfile profiler can be active at a time (per interpreter on
+# Python 3.12+); requests sampled while it is busy just aren't profiled.
+_profiler_lock = threading.Lock()
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='profile-writer')
+
+
+def profiling_config():
+    """
+    (enabled, sample_rate, slow_ms) from ProfilingSettings. Requests never
+    wait for the database: a stale value is used while the background
+    worker re-reads it, and saving the settings updates it straight away.
+    """
+    with _config_lock:
+        read_at = _config['read_at']
+        stale = read_at is None or time.monotonic() - read_at > CONFIG_TTL
+        if stale and not _config['refreshing']:
+            _config['refreshing'] = True
+            _executor.submit(_refresh_config, _config['generation'])
+        return _config['value']
+
+
+def set_config(row):
+    """Applies a saved ProfilingSettings row (or None: profiling off) to this process."""
+    with _config_lock:
+        _apply(row)
+
+
+def _apply(row):
+    _config['value'] = (row.enabled, row.sample_rate, row.slow_ms) if row else OFF
+    _config['read_at'] = time.monotonic()
+    _config['generation'] += 1
+
+
+def _refresh_config(generation):
+    try:
+        row = ProfilingSettings.objects.filter(pk=1).first()
+        with _config_lock:
+            # A save in this process while we were reading is newer
+            if _config['generation'] == generation:
+                _apply(row)
+    except Exception:
+        logger.warning("Could not read the profiling settings", exc_info=True)
+    finally:
+        with _config_lock:
+            _config['refreshing'] = False
+        connection.close()
+
+
+class RequestCapture:
+    """
+    What the profiler records about one request: its SQL statements (as a
+    database execute wrapper) and, when sampled, a cProfile profile.
+
+    Only the parameterised SQL is kept, never the parameter values: they
+    hold session keys, usernames, patron IDs and names, and the captures
+    sit on disk for anyone with access to PROFILING_DIR.
+    """
+
+    def __init__(self, sampled):
+        self.profiler = cProfile.Profile() if sampled else None
+        self.statements = []
+        self.query_count = 0
+        self.query_seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - start
+            self.query_count += 1
+            self.query_seconds += elapsed
+            if len(self.statements) < MAX_STATEMENTS:
+                self.statements.append({'sql': sql, 'ms': round(elapsed * 1000, 2)})
+
+
+def start_capture(sample_rate):
+    """A RequestCapture, profiled for sample_rate of requests when the profiler is free."""
+    sampled = random.random() < sample_rate and _profiler_lock.acquire(blocking=False)
+    capture = RequestCapture(sampled)
+    if sampled:
+        capture.profiler.enable()
+    return capture
+
+
+def stop_capture(capture):
+    if capture.profiler is not None:
+        capture.profiler.disable()
+        _profiler_lock.release()
+
+
+def save_capture(capture, request, response, seconds, reasons):
+    """
+    Writes the capture to PROFILING_DIR as <name>.json, plus <name>.prof when
+    it was profiled (in the background unless PROFILING_WRITE_SYNC). Only the
+    newest PROFILING_KEEP captures are kept; each write deletes the older ones.
+    The query string is reduced to its parameter names, like the SQL.
+    """
+    match = request.resolver_match
+    view = (match.url_name or match.view_name) if match else 'unmatched'
+    captured_at = timezone.localtime()
+    name = f"{captured_at:%Y%m%d-%H%M%S-%f}-{slugify(view) or 'view'}"
+    meta = {
+        'name': name,
+        'captured_at': captured_at.isoformat(),
+        'method': request.method,
+        'path': request.path[:500],
+        'query_params': sorted(request.GET)[:50],
+        'view': view,
+        'status': response.status_code,
+        'duration_ms': round(seconds * 1000, 1),
+        'reasons': reasons,
+        'query_count': capture.query_count,
+        'query_ms': round(capture.query_seconds * 1000, 1),
+    }
+    logger.info("Captured %s request %s (%s ms, %s)", meta['method'], meta['path'], meta['duration_ms'], ', '.join(reasons))
+    if getattr(settings, 'PROFILING_WRITE_SYNC', False):
+        _write(name, meta, capture)
+    else:
+        _executor.submit(_write, name, meta, capture)
+
+
+def _write(name, meta, capture):
+    directory = settings.PROFILING_DIR
+    try:
+        os.makedirs(directory, exist_ok=True)
+        meta['profile'] = None
+        meta['top_functions'] = ''
+        if capture.profiler is not None:
+            meta['profile'] = f'{name}.prof'
+            capture.profiler.dump_stats(os.path.join(directory, meta['profile']))
+            summary = io.StringIO()
+            pstats.Stats(capture.profiler, stream=summary).sort_stats('cumulative').print_stats(TOP_FUNCTIONS)
+            meta['top_functions'] = summary.getvalue()
+        meta['queries'] = capture.statements
+        meta['queries_truncated'] = capture.query_count > len(capture.statements)
+
+        with open(os.path.join(directory, f'{name}.json'), 'w') as handle:
+            json.dump(meta, handle)
+        _rotate(directory, settings.PROFILING_KEEP)
+    except OSError:
+        logger.exception("Could not write request capture %s", name)
+
+
+def _rotate(directory, keep):
+    """Deletes all but the newest keep captures (names sort by capture time)."""
+    names = sorted(entry[:-5] for entry in os.listdir(directory) if entry.endswith('.json'))
+    for name in names[:-keep] if keep else names:
+        for suffix in ('.json', '.prof'):
+            try:
+                os.remove(os.path.join(directory, name + suffix))
+            except FileNotFoundError:
+                pass
+
+
+def list_captures(limit=None):
+    """Summaries of the captured requests, newest first."""
+    directory = settings.PROFILING_DIR
+    if not os.path.isdir(directory):
+        return []
+    names = sorted((entry[:-5] for entry in os.listdir(directory) if entry.endswith('.json')), reverse=True)
+    captures = []
+    for name in names[:limit]:
+        capture = read_capture(name)
+        if capture:
+            capture.pop('queries', None)
+            capture.pop('top_functions', None)
+            captures.append(capture)
+    return captures
+
+
+def read_capture(name):
+    """One capture's metadata, SQL and profile summary, or None."""
+    if not CAPTURE_NAME.match(name or ''):
+        return None
+    try:
+        with open(os.path.join(settings.PROFILING_DIR, f'{name}.json')) as handle:
+            return json.load(handle)
+    except (OSError, ValueError):
+        return None
+
+
+def profile_path(name):
+    """Path of a capture's .prof file, or None."""
+    if not CAPTURE_NAME.match(name or ''):
+        return None
+    path = os.path.join(settings.PROFILING_DIR, f'{name}.prof')
+    return path if os.path.isfile(path) else None
@@ -0,0 +1,210 @@
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+import zipfile
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO
+
+import qrcode
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Bump when the rendering below changes, so cached PNGs and ETags roll over
+RENDER_VERSION = 1
+BOX_SIZE = 10
+BORDER = 4
+
+# Fewer misses than this are rendered in-process; a pool isn't worth starting
+POOL_THRESHOLD = 50
+
+
+def qr_key(data):
+    """Content address of the PNG for data: same input and renderer, same key."""
+    return hashlib.sha256(f"{RENDER_VERSION}:{BOX_SIZE}:{BORDER}:{data}".encode()).hexdigest()[:32]
+
+
+def _build_qr(data):
+    qr = qrcode.QRCode(version=1, box_size=BOX_SIZE, border=BORDER)
+    qr.add_data(data)
+    qr.make(fit=True)
+    return qr
+
+
+def qr_matrix(data):
+    """The QR modules for data (border included) as rows of booleans, for vector drawing."""
+    return _build_qr(data).get_matrix()
+
+
+def render_qr_png(data):
+    """Renders data as a QR code PNG. Module-level so process pools can pickle it."""
+    img = _build_qr(data).make_image(fill_color="black", back_color="white")
+    buffer = BytesIO()
+    img.save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+def pool_map(fn, items, workers=None, chunksize=1):
+    """
+    Yields fn(item) for each of items, in order, computed across up to
+    QR_RENDER_WORKERS processes (default: one per CPU). With a single CPU or
+    item it all runs in this process, and if the pool can't start or breaks
+    (e.g. a host without working process support) whatever is left is
+    finished here instead.
+    """
+    items = list(items)
+    workers = min(workers or getattr(settings, 'QR_RENDER_WORKERS', None) or os.cpu_count() or 1, len(items))
+    done = 0
+    if workers > 1:
+        try:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                for result in pool.map(fn, items, chunksize=chunksize):
+                    yield result
+                    done += 1
+        except (OSError, NotImplementedError, BrokenProcessPool):
+            logger.warning("Render pool unavailable; finishing %d items in-process", len(items) - done, exc_info=True)
+    for item in items[done:]:
+        yield fn(item)
+
+
+class QRRenderCache:
+    """
+    PNG bytes by qr_key: an in-memory LRU, backed by a directory of
+    <key>.png files when QR_CACHE_DIR is set (shared by all workers and
+    kept across restarts).
+    """
+
+    def __init__(self, max_size=2000, directory=None):
+        self.max_size = max_size
+        self.directory = directory
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, data):
+        """Returns (key, png) for data, rendering it on a miss."""
+        key = qr_key(data)
+        png = self._lookup(key)
+        if png is None:
+            png = render_qr_png(data)
+            self.put(key, png)
+        return key, png
+
+    def get_many(self, items, workers=None):
+        """
+        Yields (data, png) for each of items, in order. When there are enough
+        misses they are rendered across a process pool (see pool_map), and
+        each is yielded as soon as it and the ones before it are done.
+        """
+        items = list(items)
+        found = {}
+        for data in items:
+            png = self._lookup(qr_key(data))
+            if png is not None:
+                found[data] = png
+        missing = list(dict.fromkeys(data for data in items if data not in found))
+
+        if len(missing) < POOL_THRESHOLD:
+            rendered = map(render_qr_png, missing)
+        else:
+            rendered = pool_map(render_qr_png, missing, workers, chunksize=16)
+        yield from self._merge(items, found, missing, rendered)
+
+    def _merge(self, items, found, missing, rendered):
+        # Everything rendered so far, in the order items asks for it
+        rendered = iter(rendered)
+        position = {data: i for i, data in enumerate(missing)}
+        done = 0
+        for data in items:
+            if data not in found:
+                while done <= position[data]:
+                    png = next(rendered)
+                    found[missing[done]] = png
+                    self.put(qr_key(missing[done]), png)
+                    done += 1
+            yield data, found[data]
+
+    def put(self, key, png):
+        with self._lock:
+            self._entries[key] = png
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+        if self.directory:
+            # Write then rename, so another worker never reads half a file
+            os.makedirs(self.directory, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.part')
+            with os.fdopen(fd, 'wb') as png_file:
+                png_file.write(png)
+            os.replace(tmp_path, os.path.join(self.directory, f"{key}.png"))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = 0
+
+    def _lookup(self, key):
+        with self._lock:
+            png = self._entries.get(key)
+            if png is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return png
+
+        if self.directory:
+            try:
+                with open(os.path.join(self.directory, f"{key}.png"), 'rb') as png_file:
+                    png = png_file.read()
+            except OSError:
+                png = None
+            if png is not None:
+                with self._lock:
+                    self._entries[key] = png
+                    self.hits += 1
+                return png
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+
+qr_cache = QRRenderCache(
+    max_size=getattr(settings, 'QR_CACHE_SIZE', 2000),
+    directory=getattr(settings, 'QR_CACHE_DIR', None),
+)
+
+
+class _ZipStream:
+    """Write-only sink for ZipFile that hands back what was written since the last drain()."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def stream_qr_zip(id_numbers):
+    """Yields a ZIP of QR_<id>.png for each ID, one file at a time."""
+    sink = _ZipStream()
+    # PNGs are already compressed; storing them is as small and much faster
+    with zipfile.ZipFile(sink, mode='w', compression=zipfile.ZIP_STORED) as archive:
+        for id_number, png in qr_cache.get_many(id_numbers):
+            archive.writestr(f"QR_{id_number.replace('/', '_')}.png", png)
+            yield sink.drain()
+    yield sink.drain()
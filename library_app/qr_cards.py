@@ -0,0 +1,167 @@
+from functools import partial
+from io import BytesIO
+
+from PIL import Image
+from pypdf import PdfWriter
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.units import mm
+from reportlab.lib.utils import ImageReader
+from reportlab.pdfgen import canvas
+
+from .qr import pool_map, qr_matrix
+
+# ID-1 (CR80) cards, 2 x 5 per A4 sheet, with cutting guides
+CARD_WIDTH = 85.6 * mm
+CARD_HEIGHT = 54 * mm
+COLUMNS = 2
+ROWS = 5
+CARDS_PER_PAGE = COLUMNS * ROWS
+MARGIN_X = (A4[0] - COLUMNS * CARD_WIDTH) / 2
+MARGIN_Y = (A4[1] - ROWS * CARD_HEIGHT) / 2
+
+# Pages per worker task; each task returns a standalone PDF that gets merged
+PAGES_PER_TASK = 20
+
+GREEN = (0.06, 0.36, 0.2)
+
+# The logo prints 9 mm wide; ~400 dpi is plenty
+LOGO_PIXELS = 144
+
+
+def build_card_sheets(cards, logo_path=None, workers=None):
+    """
+    Lays out QR ID cards (logo, name, ID number, program) on A4 sheets and
+    returns the PDF bytes. Cards are (first_name, last_name, id_number,
+    program) tuples. Large sets are split into PAGES_PER_TASK-page chunks
+    rendered in a process pool (see qr.pool_map) and merged.
+    """
+    per_task = PAGES_PER_TASK * CARDS_PER_PAGE
+    chunks = [cards[i:i + per_task] for i in range(0, len(cards), per_task)] or [[]]
+
+    if len(chunks) == 1:
+        return render_sheet_chunk(chunks[0], logo_path)
+
+    writer = PdfWriter()
+    for part in pool_map(partial(render_sheet_chunk, logo_path=logo_path), chunks, workers):
+        writer.append(BytesIO(part))
+    output = BytesIO()
+    writer.write(output)
+    return output.getvalue()
+
+
+def render_sheet_chunk(cards, logo_path=None):
+    """Renders cards onto as many A4 pages as needed. Runs inside pool workers."""
+    output = BytesIO()
+    pdf = canvas.Canvas(output, pagesize=A4, pageCompression=1)
+    pdf.setTitle("UCC Library QR ID Cards")
+
+    logo = None
+    if logo_path:
+        # Embedded once and referenced by every card
+        logo = 'ucc_logo'
+        pdf.beginForm(logo)
+        image = Image.open(logo_path)
+        image.thumbnail((LOGO_PIXELS, LOGO_PIXELS))
+        pdf.drawImage(ImageReader(image), 0, 0, 9 * mm, 9 * mm, mask='auto')
+        pdf.endForm()
+
+    for start in range(0, len(cards), CARDS_PER_PAGE):
+        _draw_guides(pdf)
+        for slot, card in enumerate(cards[start:start + CARDS_PER_PAGE]):
+            column, row = slot % COLUMNS, slot // COLUMNS
+            x = MARGIN_X + column * CARD_WIDTH
+            y = A4[1] - MARGIN_Y - (row + 1) * CARD_HEIGHT
+            _draw_card(pdf, x, y, card, logo)
+        pdf.showPage()
+
+    pdf.save()
+    return output.getvalue()
+
+
+def _draw_guides(pdf):
+    pdf.setStrokeColorRGB(0.75, 0.75, 0.75)
+    pdf.setLineWidth(0.3)
+    pdf.setDash(2, 2)
+    for column in range(COLUMNS + 1):
+        x = MARGIN_X + column * CARD_WIDTH
+        pdf.line(x, MARGIN_Y, x, A4[1] - MARGIN_Y)
+    for row in range(ROWS + 1):
+        y = MARGIN_Y + row * CARD_HEIGHT
+        pdf.line(MARGIN_X, y, A4[0] - MARGIN_X, y)
+    pdf.setDash()
+
+
+def _draw_card(pdf, x, y, card, logo):
+    first_name, last_name, id_number, program = card
+    padding = 4 * mm
+
+    # Header band: logo + library name
+    band = 11 * mm
+    pdf.setFillColorRGB(*GREEN)
+    pdf.rect(x, y + CARD_HEIGHT - band, CARD_WIDTH, band, stroke=0, fill=1)
+    if logo:
+        pdf.saveState()
+        pdf.translate(x + 2 * mm, y + CARD_HEIGHT - band + 1 * mm)
+        pdf.doForm(logo)
+        pdf.restoreState()
+    pdf.setFillColorRGB(1, 1, 1)
+    pdf.setFont('Helvetica-Bold', 8)
+    pdf.drawString(x + 13 * mm, y + CARD_HEIGHT - 5 * mm, "UNIVERSITY OF CALOOCAN CITY")
+    pdf.setFont('Helvetica', 7)
+    pdf.drawString(x + 13 * mm, y + CARD_HEIGHT - 8.5 * mm, "Library Attendance ID")
+
+    # QR code on the right, details on the left
+    qr_size = CARD_HEIGHT - band - 2 * mm
+    _draw_qr(pdf, id_number, x + CARD_WIDTH - qr_size - 1 * mm, y + 1 * mm, qr_size)
+
+    text_width = CARD_WIDTH - qr_size - padding - 2 * mm
+    pdf.setFillColorRGB(0, 0, 0)
+    pdf.setFont('Helvetica-Bold', 10)
+    pdf.drawString(x + padding, y + 28 * mm, _fit(pdf, last_name.upper() + ',', 'Helvetica-Bold', 10, text_width))
+    pdf.setFont('Helvetica', 9)
+    pdf.drawString(x + padding, y + 23.5 * mm, _fit(pdf, first_name, 'Helvetica', 9, text_width))
+
+    pdf.setFont('Courier-Bold', 11)
+    pdf.drawString(x + padding, y + 15 * mm, id_number)
+
+    if program:
+        pdf.setFont('Helvetica', 6.5)
+        pdf.setFillColorRGB(0.3, 0.3, 0.3)
+        pdf.drawString(x + padding, y + 6 * mm, _fit(pdf, program, 'Helvetica', 6.5, text_width))
+
+
+def _draw_qr(pdf, data, x, y, size):
+    """
+    Draws the QR code as vector rectangles, one per run of dark modules, in
+    module units so the coordinates stay small integers: sharp at any print
+    size and a few hundred bytes per card.
+    """
+    matrix = qr_matrix(data)
+    count = len(matrix)
+    pdf.saveState()
+    pdf.translate(x, y)
+    pdf.scale(size / count, size / count)
+    path = pdf.beginPath()
+    for r, row in enumerate(matrix):
+        c = 0
+        while c < count:
+            if row[c]:
+                start = c
+                while c < count and row[c]:
+                    c += 1
+                path.rect(start, count - r - 1, c - start, 1)
+            else:
+                c += 1
+    pdf.setFillColorRGB(0, 0, 0)
+    pdf.drawPath(path, stroke=0, fill=1)
+    pdf.restoreState()
+
+
+def _fit(pdf, text, font, size, width):
+    """Trims text with an ellipsis so it fits in width points."""
+    text = text or ''
+    if pdf.stringWidth(text, font, size) <= width:
+        return text
+    while text and pdf.stringWidth(text + '…', font, size) > width:
+        text = text[:-1]
+    return text + '…'
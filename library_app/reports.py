@@ -0,0 +1,272 @@
+import calendar
+import datetime
+import logging
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.staticfiles import finders
+from django.db import IntegrityError, connection
+from django.db.models import Count, F, Sum
+from django.db.models.functions import ExtractMonth
+from django.template.loader import get_template
+from django.utils import timezone
+
+from xhtml2pdf import pisa
+
+from .models import Patron, DailyAttendanceStat, ReportArtifact
+
+logger = logging.getLogger(__name__)
+
+
+SCHOOL_DATA = {
+    "SBS": [
+        "Bachelor of Science in Computer Science",
+        "Bachelor of Science in Information Systems",
+        "Bachelor of Science in Accountancy",
+        "Bachelor of Science in Business Administration",
+        "Bachelor of Science in Real Estate Management"
+    ],
+    "SHES": [
+        "Bachelor of Science in Nursing"
+    ],
+    "SEAS": [
+        "Bachelor of Arts in English",
+        "Bachelor of Arts in History",
+        "Bachelor of Arts in Political Science",
+        "Bachelor of Early Childhood Education",
+        "Bachelor of Elementary Education",
+        "Bachelor of Secondary Education"
+    ],
+    "GS": [
+        "Master of Arts in Education",
+        "Master of Arts in Nursing"
+    ],
+    "BES": [
+        "Nursery", "Kinder 1", "Kinder 2",
+        "Grade 1", "Grade 2", "Grade 3", "Grade 4", "Grade 5", "Grade 6",
+        "Grade 7", "Grade 8", "Grade 9", "Grade 10",
+        "Grade 11", "Grade 12"
+    ]
+}
+
+# A render that has been 'pending' this long is assumed lost (e.g. server restart).
+STALE_PENDING = datetime.timedelta(minutes=10)
+# A failed render is tried again once it is this old, so a transient error
+# doesn't leave a closed period's report unavailable for good.
+FAILED_RETRY = datetime.timedelta(minutes=1)
+# A superseded PDF is kept this long after its replacement is ready, so a
+# download that started just before the switch can finish.
+SUPERSEDED_GRACE = datetime.timedelta(minutes=10)
+
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='report-render')
+
+
+def link_callback(uri, rel):
+    if settings.STATIC_URL and uri.startswith(settings.STATIC_URL):
+        path = os.path.join(settings.BASE_DIR, 'library_app', 'static', uri.replace(settings.STATIC_URL, ""))
+        if not os.path.isfile(path):
+            result = finders.find(uri)
+            if result:
+                path = result[0] if isinstance(result, (list, tuple)) else result
+    elif settings.MEDIA_URL and uri.startswith(settings.MEDIA_URL):
+        path = os.path.join(settings.MEDIA_ROOT, uri.replace(settings.MEDIA_URL, ""))
+    else:
+        return uri
+
+    if not os.path.isfile(path):
+        return uri
+    return path
+
+
+def build_report_data(year, months):
+    """
+    Attendance per department/program/month for the report tables.
+    One grouped query over the daily rollup, pivoted in memory into
+    {dept: {'programs': {prog: [month counts..., total]}, 'totals': [...] or None}}.
+
+    Being read from the rollup, each visit counts under the department and
+    program the patron had when they scanned, including patrons deleted
+    since. That is deliberate: a past month's report doesn't shift when
+    students change program or are removed. It differs from counting the
+    raw logs by current patron details until the rollup is rebuilt.
+    """
+    counts = {}
+    grouped = DailyAttendanceStat.objects.filter(
+        date__year=year,
+        date__month__in=months,
+        department__in=list(SCHOOL_DATA),
+    ).annotate(month=ExtractMonth('date')).values('department', 'program', 'month').annotate(
+        count=Sum('visits')).order_by()
+    for entry in grouped:
+        counts[(entry['department'], entry['program'], entry['month'])] = entry['count']
+
+    report_data = {}
+
+    for dept_code, programs_list in SCHOOL_DATA.items():
+        dept_data = {}
+        # Initialize totals: 1 per month + 1 for the row total
+        totals = [0] * (len(months) + 1)
+
+        for prog in programs_list:
+            monthly_counts = [counts.get((dept_code, prog, month_num), 0) for month_num in months]
+            for i, count in enumerate(monthly_counts):
+                totals[i] += count  # Add to column total
+
+            total_prog = sum(monthly_counts)
+            monthly_counts.append(total_prog)
+            totals[-1] += total_prog  # Add to grand total
+            dept_data[prog] = monthly_counts
+
+        # Only show totals if there is more than 1 program (Excludes SHES)
+        report_data[dept_code] = {
+            'programs': dept_data,
+            'totals': totals if len(programs_list) > 1 else None
+        }
+
+    return report_data
+
+
+def report_period(report_type, year, month):
+    """Returns (months, display_name, month_names) for a report request."""
+    if report_type == 'monthly':
+        month_name = calendar.month_name[month]
+        return [month], f"Monthly Attendance Report - {month_name} {year}", [month_name]
+
+    # Use abbreviated months (Jan, Feb) to fit in PDF
+    return (
+        list(range(1, 13)),
+        f"Annual Attendance Report - {year}",
+        [calendar.month_abbr[i] for i in range(1, 13)],
+    )
+
+
+def data_version(year, months):
+    """
+    A fingerprint of the rollup rows the report reads: row count, visits,
+    and visits weighted by row id. Any scan, a late offline sync into a
+    past month or a stats rebuild changes it, so no period's report is
+    treated as final. One aggregate over the period's rows.
+    """
+    period = DailyAttendanceStat.objects.filter(
+        date__year=year, date__month__in=months, department__in=list(SCHOOL_DATA),
+    ).aggregate(rows=Count('id'), total=Sum('visits'), weighted=Sum(F('visits') * F('id')))
+    return f"{period['rows']}-{period['total'] or 0}-{period['weighted'] or 0}"
+
+
+def get_report(report_type, year, month=0):
+    """
+    Returns the ReportArtifact for this report and its current data version,
+    scheduling a background render if there is none yet (or the last one was
+    lost, or failed more than FAILED_RETRY ago). With REPORT_RENDER_SYNC the
+    render happens before returning.
+    """
+    months, _, _ = report_period(report_type, year, month)
+    version = data_version(year, months)
+    key = {'report_type': report_type, 'year': year, 'month': month, 'data_version': version}
+
+    artifact = ReportArtifact.objects.filter(**key).first()
+    if artifact is not None:
+        lost = artifact.status == 'pending' and timezone.now() - artifact.created_at > STALE_PENDING
+        missing = artifact.status == 'ready' and not os.path.isfile(artifact.file_path)
+        retry = artifact.status == 'failed' and (
+            artifact.finished_at is None or timezone.now() - artifact.finished_at > FAILED_RETRY
+        )
+        if not (lost or missing or retry):
+            return artifact
+        artifact.status, artifact.error, artifact.created_at = 'pending', '', timezone.now()
+        artifact.save(update_fields=['status', 'error', 'created_at'])
+    else:
+        try:
+            artifact = ReportArtifact.objects.create(**key)
+        except IntegrityError:
+            # Another request scheduled the same render first.
+            return ReportArtifact.objects.get(**key)
+
+    if getattr(settings, 'REPORT_RENDER_SYNC', False):
+        render_report(artifact.pk)
+        artifact.refresh_from_db()
+    else:
+        _executor.submit(_render_in_background, artifact.pk)
+    return artifact
+
+
+def _render_in_background(artifact_id):
+    try:
+        render_report(artifact_id)
+    finally:
+        # The worker thread owns its own connection; don't leave it open
+        connection.close()
+
+
+def render_report(artifact_id):
+    """Renders one artifact to REPORT_CACHE_DIR."""
+    try:
+        artifact = ReportArtifact.objects.get(pk=artifact_id)
+        months, display_name, month_names = report_period(artifact.report_type, artifact.year, artifact.month)
+
+        context = {
+            'display_name': display_name,
+            'month_names': month_names,
+            'report_data': build_report_data(artifact.year, months),
+            'departments': dict(Patron.DEPARTMENT_CHOICES),
+        }
+        html = get_template('library_app/print_pdf.html').render(context)
+
+        cache_dir = settings.REPORT_CACHE_DIR
+        os.makedirs(cache_dir, exist_ok=True)
+        path = os.path.join(
+            cache_dir,
+            f"{artifact.report_type}-{artifact.year}-{artifact.month:02d}-{artifact.data_version}.pdf",
+        )
+
+        # Write to a temp file first so a half-written PDF is never served
+        fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix='.part')
+        with os.fdopen(fd, 'wb') as pdf_file:
+            pisa_status = pisa.CreatePDF(html, dest=pdf_file, link_callback=link_callback)
+
+        if pisa_status.err:
+            os.remove(tmp_path)
+            artifact.status, artifact.error = 'failed', html
+        else:
+            os.replace(tmp_path, path)
+            artifact.status, artifact.file_path = 'ready', path
+        artifact.finished_at = timezone.now()
+        artifact.save(update_fields=['status', 'file_path', 'error', 'finished_at'])
+
+        if artifact.status == 'ready':
+            _discard_old_versions(artifact)
+    except Exception:
+        logger.exception("Report render %s failed", artifact_id)
+        ReportArtifact.objects.filter(pk=artifact_id).update(status='failed', finished_at=timezone.now())
+
+
+def _discard_old_versions(artifact):
+    """
+    Drops the files of versions superseded more than SUPERSEDED_GRACE ago,
+    i.e. older than a ready version that finished before then. A file that
+    can't be removed yet (still open, on Windows) keeps its row for the next
+    render to try again.
+    """
+    versions = ReportArtifact.objects.filter(
+        report_type=artifact.report_type, year=artifact.year, month=artifact.month,
+    )
+    settled = versions.filter(
+        status='ready', finished_at__lt=timezone.now() - SUPERSEDED_GRACE,
+    ).order_by('-finished_at').first()
+    if settled is None:
+        return
+
+    old = versions.filter(finished_at__lt=settled.finished_at).exclude(status='pending')
+    discarded = []
+    for pk, path in old.values_list('pk', 'file_path'):
+        if path:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            except OSError:
+                continue
+        discarded.append(pk)
+    ReportArtifact.objects.filter(pk__in=discarded).delete()
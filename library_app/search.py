@@ -0,0 +1,79 @@
+from django.db import connection
+from django.db.models import Q
+
+
+def legacy_search_filter(query):
+    """
+    The original directory search: every term must appear (icontains) in one
+    of the name fields or the ID. Kept for the search benchmark.
+    """
+    search_filter = Q()
+    for term in query.split():
+        search_filter &= (
+            Q(first_name__icontains=term) |
+            Q(middle_name__icontains=term) |
+            Q(last_name__icontains=term) |
+            Q(id_number__icontains=term)
+        )
+    return search_filter
+
+
+def search_patrons(queryset, query, ranked=True):
+    """
+    Filters patrons so every term of query appears in their name or ID.
+
+    Matching runs against Patron.search_text, which on PostgreSQL has a
+    pg_trgm GIN index, so LIKE '%term%' is an index scan instead of a
+    sequential scan of four columns. With ranked=True results are ordered by
+    trigram word similarity (best match first); other databases keep the
+    queryset's ordering.
+    """
+    terms = query.lower().split()
+    for term in terms:
+        queryset = queryset.filter(search_text__contains=term)
+
+    if terms and ranked and connection.vendor == 'postgresql':
+        from django.contrib.postgres.search import TrigramWordSimilarity
+        queryset = queryset.annotate(
+            rank=TrigramWordSimilarity(query.lower(), 'search_text')
+        ).order_by('-rank', *queryset.query.order_by)
+
+    return queryset
+
+
+def filter_patrons(patrons, params):
+    """Applies the Registered Users filters (q, role, department, program, year_level)."""
+    query = params.get('q', '').strip()
+    role_filter = params.get('role')
+    dept_filter = params.get('department')
+    program_filter = params.get('program')
+    year_filter = params.get('year_level')
+
+    if query:
+        # Every term must match a name or the ID; best matches first (indexed on PostgreSQL)
+        patrons = search_patrons(patrons, query)
+
+    if role_filter:
+        patrons = patrons.filter(role=role_filter)
+
+    if dept_filter:
+        patrons = patrons.filter(department=dept_filter)
+
+    if dept_filter == 'BES':
+        # BES Logic: UI 'Year Level' -> DB 'Program', UI 'Program' -> DB 'Major'
+        if year_filter:
+            patrons = patrons.filter(program=year_filter)
+        if program_filter:
+            patrons = patrons.filter(major=program_filter)
+    else:
+        # Standard College Logic
+        if program_filter:
+            if " - " in program_filter and "Grade" in program_filter:
+                prog_part, major_part = program_filter.split(" - ", 1)
+                patrons = patrons.filter(program=prog_part, major__icontains=major_part)
+            else:
+                patrons = patrons.filter(program=program_filter)
+        if year_filter:
+            patrons = patrons.filter(year_level=year_filter)
+
+    return patrons
@@ -0,0 +1,34 @@
+from django.db.models.signals import post_init, post_save, post_delete
+from django.dispatch import receiver
+
+from .models import Patron, ProfilingSettings
+from .patron_cache import patron_cache
+from .profiling import set_config
+
+
+@receiver(post_init, sender=Patron)
+def remember_loaded_id_number(sender, instance, **kwargs):
+    # update_patron can change id_number, so the old key must be dropped too.
+    instance._loaded_id_number = instance.id_number
+
+
+@receiver(post_save, sender=Patron)
+def invalidate_patron_on_save(sender, instance, **kwargs):
+    patron_cache.invalidate(instance.id_number, getattr(instance, '_loaded_id_number', None))
+    instance._loaded_id_number = instance.id_number
+
+
+@receiver(post_delete, sender=Patron)
+def invalidate_patron_on_delete(sender, instance, **kwargs):
+    patron_cache.invalidate(instance.id_number, getattr(instance, '_loaded_id_number', None))
+
+
+@receiver(post_save, sender=ProfilingSettings)
+def apply_profiling_settings(sender, instance, **kwargs):
+    # Takes effect in this process at once; others pick it up within profiling.CONFIG_TTL.
+    set_config(instance)
+
+
+@receiver(post_delete, sender=ProfilingSettings)
+def disable_profiling(sender, instance, **kwargs):
+    set_config(None)
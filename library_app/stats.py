@@ -0,0 +1,307 @@
+import operator
+from collections import defaultdict
+from functools import reduce
+
+from django.db import IntegrityError, transaction
+from django.db.models import Case, Count, DurationField, ExpressionWrapper, F, Max, Q, Sum, Value, When
+from django.db.models.functions import Coalesce, ExtractMonth, ExtractYear, Greatest, TruncDate
+from django.utils import timezone
+
+from .models import (
+    AttendanceLog, AttendanceArchive, DailyAttendanceStat, DepartmentStat, PatronStat, PatronMonthlyStat, Occupancy,
+)
+
+# Rows per batched rollup UPDATE (each one is a CASE branch)
+INCREMENT_CHUNK = 200
+
+
+class StatDeltas:
+    """
+    Collects rollup changes from one or more check-ins/check-outs and writes
+    them with one UPDATE (plus an INSERT for new rows) per rollup table:
+
+    * DailyAttendanceStat per (date, department, program, role)
+    * DepartmentStat per department (all-time visits)
+    * PatronStat per patron (all-time visits, seconds, last visit)
+    * PatronMonthlyStat per (patron, year, month)
+    * Occupancy (people inside right now)
+
+    Visits count on check-in; seconds are added on check-out and attributed
+    to the date/month the session started.
+    """
+
+    def __init__(self):
+        self.daily = defaultdict(lambda: [0, 0, 0])     # visits, checkouts, seconds
+        self.department = defaultdict(int)               # visits
+        self.patron = defaultdict(lambda: [0, 0, None])  # visits, seconds, last visit
+        self.monthly = defaultdict(lambda: [0, 0])       # visits, seconds
+        self.occupancy = 0
+
+    def add_visit(self, patron_id, scan_time, department, program, role):
+        local = timezone.localtime(scan_time)
+        self.daily[(local.date(), department or '', program or '', role or '')][0] += 1
+        self.department[department or ''] += 1
+
+        patron = self.patron[patron_id]
+        patron[0] += 1
+        patron[2] = max(patron[2], scan_time) if patron[2] else scan_time
+
+        self.monthly[(patron_id, local.year, local.month)][0] += 1
+        self.occupancy += 1
+
+    def add_checkout(self, patron_id, scan_time, time_out, department, program, role):
+        local = timezone.localtime(scan_time)
+        seconds = max(0, int((time_out - scan_time).total_seconds()))
+
+        daily = self.daily[(local.date(), department or '', program or '', role or '')]
+        daily[1] += 1
+        daily[2] += seconds
+
+        self.patron[patron_id][1] += seconds
+        self.monthly[(patron_id, local.year, local.month)][1] += seconds
+        self.occupancy -= 1
+
+    def apply(self):
+        with transaction.atomic():
+            _increment_many(
+                DailyAttendanceStat, ('date', 'department', 'program', 'role'),
+                {key: {'visits': visits, 'checkouts': checkouts, 'total_seconds': seconds}
+                 for key, (visits, checkouts, seconds) in self.daily.items()},
+            )
+            _increment_many(
+                DepartmentStat, ('department',),
+                {(department,): {'visits': visits} for department, visits in self.department.items()},
+            )
+            _increment_many(
+                PatronStat, ('patron_id',),
+                {(patron_id,): {'visits': visits, 'total_seconds': seconds}
+                 for patron_id, (visits, seconds, _) in self.patron.items()},
+                last_visits={(patron_id,): last_visit for patron_id, (_, _, last_visit) in self.patron.items() if last_visit},
+            )
+            _increment_many(
+                PatronMonthlyStat, ('patron_id', 'year', 'month'),
+                {key: {'visits': visits, 'total_seconds': seconds}
+                 for key, (visits, seconds) in self.monthly.items()},
+            )
+
+            if self.occupancy:
+                _increment(Occupancy, {'pk': 1}, {'current': self.occupancy})
+
+
+def _increment(model, lookup, counters, last_visit=None):
+    """UPDATE ... SET field = field + n for the row matching lookup, creating it if missing."""
+    row = model.objects.filter(**lookup)
+    changes = {field: F(field) + amount for field, amount in counters.items()}
+    if last_visit is not None:
+        # last_visit only ever moves forward
+        changes['last_visit'] = Greatest(Coalesce('last_visit', Value(last_visit)), Value(last_visit))
+
+    if row.update(**changes):
+        return
+    try:
+        with transaction.atomic():
+            model.objects.create(**lookup, **counters, **({'last_visit': last_visit} if last_visit else {}))
+    except IntegrityError:
+        # Created concurrently by another scan; add to it instead.
+        row.update(**changes)
+
+
+def _increment_many(model, key_fields, increments, last_visits=None):
+    """
+    _increment for many rows: increments maps a key (values of key_fields)
+    to its counters. Each chunk is one UPDATE that picks every row's amounts
+    with a CASE on its key, plus one SELECT and one INSERT for the rows that
+    did not exist yet, so a force checkout of the whole library does not
+    cost a query per person.
+    """
+    last_visits = last_visits or {}
+    if len(increments) == 1:
+        (key, counters), = increments.items()
+        _increment(model, dict(zip(key_fields, key)), counters, last_visit=last_visits.get(key))
+        return
+
+    items = list(increments.items())
+    for start in range(0, len(items), INCREMENT_CHUNK):
+        chunk = items[start:start + INCREMENT_CHUNK]
+        match = {key: Q(**dict(zip(key_fields, key))) for key, _ in chunk}
+
+        changes = {
+            field: F(field) + Case(
+                *[When(match[key], then=Value(counters[field])) for key, counters in chunk],
+                default=Value(0),
+            )
+            for field in chunk[0][1]
+        }
+        chunk_visits = [(key, last_visits[key]) for key, _ in chunk if key in last_visits]
+        if chunk_visits:
+            latest = Case(*[When(match[key], then=Value(at)) for key, at in chunk_visits], default=F('last_visit'))
+            # last_visit only ever moves forward
+            changes['last_visit'] = Greatest(Coalesce('last_visit', latest), latest)
+
+        rows = model.objects.filter(reduce(operator.or_, match.values()))
+        if rows.update(**changes) == len(chunk):
+            continue
+
+        existing = set(rows.values_list(*key_fields))
+        missing = [(key, counters) for key, counters in chunk if key not in existing]
+        try:
+            with transaction.atomic():
+                model.objects.bulk_create([
+                    model(**dict(zip(key_fields, key)), **counters,
+                          **({'last_visit': last_visits[key]} if key in last_visits else {}))
+                    for key, counters in missing
+                ])
+        except IntegrityError:
+            # Some were created concurrently by scans; fall back to one row at a time.
+            for key, counters in missing:
+                _increment(model, dict(zip(key_fields, key)), counters, last_visit=last_visits.get(key))
+
+
+def current_occupancy():
+    """People inside right now, from the Occupancy counter (one primary-key read)."""
+    current = Occupancy.objects.filter(pk=1).values_list('current', flat=True).first()
+    if current is None:
+        return reconcile_occupancy()
+    return max(current, 0)
+
+
+def today_totals(today=None):
+    """Today's visits and check-outs from the daily rollup: {'visits': n, 'checkouts': n}."""
+    totals = DailyAttendanceStat.objects.filter(date=today or timezone.localdate()).aggregate(
+        visits=Sum('visits'), checkouts=Sum('checkouts')
+    )
+    return {'visits': totals['visits'] or 0, 'checkouts': totals['checkouts'] or 0}
+
+
+def reconcile_occupancy():
+    """
+    Resets the Occupancy counter to the real number of open sessions and
+    returns it. Corrects drift from paths that bypass the counter (deleting
+    a patron who is inside, edits in the admin). Run periodically by the
+    scheduler.
+    """
+    with transaction.atomic():
+        # Lock the counter first: scans that commit after the count below
+        # wait for it and then apply their own +1/-1 on top.
+        counter, _ = Occupancy.objects.select_for_update().get_or_create(pk=1)
+        counter.current = AttendanceLog.objects.filter(time_out__isnull=True).count()
+        counter.reconciled_at = timezone.now()
+        counter.save(update_fields=['current', 'reconciled_at'])
+    return counter.current
+
+
+def leaderboard(order_by='visits', year=None, month=None, department=None, limit=5):
+    """
+    Top patrons by 'visits' or 'total_seconds', read from the running stats.
+    All-time boards are an index scan of PatronStat; year/month boards read
+    PatronMonthlyStat for that period only.
+    Rows: patron__first_name, patron__last_name, patron__department, visit_count, total_seconds.
+    """
+    fields = ('patron__first_name', 'patron__last_name', 'patron__department')
+
+    if year:
+        board = PatronMonthlyStat.objects.filter(year=year)
+        if month:
+            board = board.filter(month=month)
+        board = board.values('patron_id', *fields).annotate(
+            visit_count=Sum('visits'), seconds=Sum('total_seconds')
+        )
+    else:
+        board = PatronStat.objects.values('patron_id', *fields).annotate(
+            visit_count=F('visits'), seconds=F('total_seconds')
+        )
+
+    if department:
+        board = board.filter(patron__department=department)
+
+    order = '-visit_count' if order_by == 'visits' else '-seconds'
+    rows = list(board.order_by(order, 'patron_id')[:limit])
+    for row in rows:
+        row['total_seconds'] = row.pop('seconds')
+    return rows
+
+
+def rebuild_daily_stats(log_model=AttendanceLog, stat_model=DailyAttendanceStat, archive_model=AttendanceArchive,
+                        department_model=DepartmentStat):
+    """
+    Recomputes the whole rollup, and the per-department totals from it, from
+    the attendance logs (live and archived) with one grouped query per table.
+    Returns the number of rollup rows written.
+    """
+    duration = ExpressionWrapper(F('time_out') - F('scan_time'), output_field=DurationField())
+    rows = {}
+    for source in (log_model, archive_model):
+        grouped = (
+            source.objects
+            .annotate(day=TruncDate('scan_time', tzinfo=timezone.get_current_timezone()))
+            .values('day', 'patron__department', 'patron__program', 'patron__role')
+            .annotate(visits=Count('id'), checkouts=Count('time_out'), duration=Sum(duration))
+            .order_by()
+        )
+
+        for entry in grouped.iterator():
+            key = (entry['day'], entry['patron__department'] or '', entry['patron__program'] or '',
+                   entry['patron__role'] or '')
+            # NULL and '' departments/programs collapse into the same rollup row
+            row = rows.setdefault(key, stat_model(
+                date=key[0], department=key[1], program=key[2], role=key[3]
+            ))
+            row.visits += entry['visits']
+            row.checkouts += entry['checkouts']
+            row.total_seconds += int(entry['duration'].total_seconds()) if entry['duration'] else 0
+
+    departments = defaultdict(int)
+    for row in rows.values():
+        departments[row.department] += row.visits
+
+    with transaction.atomic():
+        stat_model.objects.all().delete()
+        stat_model.objects.bulk_create(rows.values(), batch_size=1000)
+        department_model.objects.all().delete()
+        department_model.objects.bulk_create(
+            [department_model(department=department, visits=visits) for department, visits in departments.items()]
+        )
+    return len(rows)
+
+
+def rebuild_patron_stats(log_model=AttendanceLog, stat_model=PatronStat, monthly_model=PatronMonthlyStat,
+                         archive_model=AttendanceArchive):
+    """
+    Recomputes PatronStat and PatronMonthlyStat from the attendance logs
+    (live and archived) with one grouped query per table. Returns the
+    number of patrons with stats.
+    """
+    tz = timezone.get_current_timezone()
+    duration = ExpressionWrapper(F('time_out') - F('scan_time'), output_field=DurationField())
+
+    totals = {}
+    monthly = {}
+    for source in (log_model, archive_model):
+        grouped = (
+            source.objects
+            .annotate(year=ExtractYear('scan_time', tzinfo=tz), month=ExtractMonth('scan_time', tzinfo=tz))
+            .values('patron_id', 'year', 'month')
+            .annotate(visits=Count('id'), duration=Sum(duration), last_visit=Max('scan_time'))
+            .order_by()
+        )
+
+        for entry in grouped.iterator():
+            seconds = int(entry['duration'].total_seconds()) if entry['duration'] else 0
+            month = monthly.setdefault((entry['patron_id'], entry['year'], entry['month']), monthly_model(
+                patron_id=entry['patron_id'], year=entry['year'], month=entry['month'],
+            ))
+            month.visits += entry['visits']
+            month.total_seconds += seconds
+
+            total = totals.setdefault(entry['patron_id'], stat_model(patron_id=entry['patron_id']))
+            total.visits += entry['visits']
+            total.total_seconds += seconds
+            if total.last_visit is None or entry['last_visit'] > total.last_visit:
+                total.last_visit = entry['last_visit']
+
+    with transaction.atomic():
+        monthly_model.objects.all().delete()
+        stat_model.objects.all().delete()
+        stat_model.objects.bulk_create(totals.values(), batch_size=1000)
+        monthly_model.objects.bulk_create(monthly.values(), batch_size=1000)
+    return len(totals)
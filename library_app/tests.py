@@ -1,3 +1,1557 @@
-from django.test import TestCase
+import csv
+import datetime
+import json
+import os
+import smtplib
+import tempfile
+import threading
+import time
+import zipfile
+from io import BytesIO, StringIO
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import IntegrityError, connection, transaction
+from django.db.migrations.executor import MigrationExecutor
+from django.db.models import Sum
+from django.http import QueryDict
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from pypdf import PdfReader
+
+from . import attendance, qr
+from .archive import archive_attendance, archive_cutoff, prune_scan_receipts
+from .attendance import BatchScan, apply_scan_batch, toggle_attendance
+from .audit import AuditBuffer
+from .exports import filter_attendance_logs
+from .importer import import_patrons
+from .live import LiveFeed, live_feed, recent_activity
+from .metrics import request_metrics
+from .models import (
+    AttendanceArchive, AttendanceLog, DailyAttendanceStat, DepartmentStat, EmailCampaign, Occupancy,
+    OutboundEmail, Patron, PatronMonthlyStat, PatronStat, ProfilingSettings, ReportArtifact, ScanReceipt,
+    SystemLog,
+)
+from .outbox import (
+    MAX_ATTEMPTS, backoff, campaign_for, campaign_progress, drain_outbox, enqueue_email, queue_qr_campaign,
+)
+from .pagination import keyset_page
+from .patron_cache import PatronIdentityCache, patron_cache
+from .profiling import list_captures, profile_path, read_capture, set_config
+from .qr import POOL_THRESHOLD, QRRenderCache, render_qr_png
+from .qr_cards import PAGES_PER_TASK, build_card_sheets
+from .reports import (
+    FAILED_RETRY, SCHOOL_DATA, SUPERSEDED_GRACE, _discard_old_versions, build_report_data, data_version,
+    get_report,
+)
+from .stats import current_occupancy, rebuild_daily_stats, rebuild_patron_stats, reconcile_occupancy
+
+
+class AttendanceToggleTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.ana = Patron.objects.create(id_number='2024-0001', first_name='Ana', last_name='Go', department='SBS')
+
+    def test_check_in_then_out(self):
+        first = toggle_attendance('2024-0001')
+        self.assertEqual((first.scan_type, first.changed), ('in', True))
+        log = AttendanceLog.objects.get(patron=self.ana)
+        self.assertIsNone(log.time_out)
+
+        second = toggle_attendance('2024-0001', now=timezone.now() + datetime.timedelta(minutes=45))
+        self.assertEqual((second.scan_type, second.changed), ('out', True))
+        log.refresh_from_db()
+        self.assertEqual(log.time_out, second.time)
+        self.assertEqual(self.ana.stat.visits, 1)
+
+    def test_double_scan_opens_one_session(self):
+        toggle_attendance('2024-0001')
+        patron_cache.get('2024-0001')
+        # A second kiosk that didn't see the open session yet
+        with mock.patch('django.db.models.query.QuerySet.first', return_value=None):
+            result = toggle_attendance('2024-0001')
+
+        self.assertEqual((result.scan_type, result.changed), ('in', False))
+        self.assertEqual(AttendanceLog.objects.filter(patron=self.ana, time_out__isnull=True).count(), 1)
+        self.assertEqual(self.ana.stat.visits, 1)
+
+    def test_replayed_key_is_answered_from_its_receipt(self):
+        first = toggle_attendance('2024-0001', key='k1')
+        self.assertEqual((first.scan_type, first.changed), ('in', True))
+        # Replayed once the library has filled up: still the original check-in
+        Occupancy.objects.filter(pk=1).update(current=5)
+        replay = toggle_attendance('2024-0001', now=timezone.now() + datetime.timedelta(minutes=5), capacity=5, key='k1')
+
+        self.assertEqual((replay.scan_type, replay.changed, replay.time), ('in', False, first.time))
+        self.assertEqual(AttendanceLog.objects.filter(patron=self.ana).count(), 1)
+        self.assertIsNone(AttendanceLog.objects.get(patron=self.ana).time_out)
+
+        # A new key toggles as usual
+        self.assertEqual(toggle_attendance('2024-0001', key='k2').scan_type, 'out')
+
+    def test_unknown_id(self):
+        self.assertIsNone(toggle_attendance('2024-9999'))
+        self.assertFalse(AttendanceLog.objects.exists())
+
+    def test_patron_deleted_after_it_was_cached(self):
+        # Deleted behind the cache's back (e.g. by another process)
+        patron_cache.get('2024-0001')
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {Patron._meta.db_table} WHERE id = %s', [self.ana.pk])
+
+        self.assertIsNone(toggle_attendance('2024-0001'))
+        self.assertFalse(AttendanceLog.objects.exists())
+        # The stale entry was dropped, so the next lookup goes to the database
+        with self.assertNumQueries(1):
+            self.assertIsNone(patron_cache.get('2024-0001'))
+
+    def test_stale_identity_with_a_missing_patron(self):
+        stale = {'id': self.ana.pk + 100, 'id_number': '2024-0002', 'first_name': 'Gone', 'last_name': 'Away',
+                 'role': 'student', 'department': '', 'program': ''}
+        with mock.patch.object(patron_cache, 'get', return_value=stale), \
+                mock.patch.object(patron_cache, 'invalidate') as invalidate:
+            self.assertIsNone(toggle_attendance('2024-0002'))
+        invalidate.assert_called_once_with('2024-0002')
+        self.assertFalse(AttendanceLog.objects.exists())
+
+
+class PatronCacheTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.ana = Patron.objects.create(id_number='2024-0001', first_name='Ana', last_name='Go', department='SBS')
+
+    def setUp(self):
+        patron_cache.clear()
+
+    def test_hits_and_misses_are_counted(self):
+        cache = PatronIdentityCache()
+        self.assertEqual(cache.get('2024-0001')['id'], self.ana.pk)
+        self.assertEqual(cache.get('2024-0001')['first_name'], 'Ana')
+        self.assertIsNone(cache.get('2024-9999'))
+        self.assertEqual(set(cache.get_many(['2024-0001', '2024-9999'])), {'2024-0001'})
+
+        stats = cache.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['size']), (2, 3, 1))
+        self.assertEqual(stats['hit_rate'], 0.4)
+
+    def test_save_and_delete_invalidate(self):
+        patron_cache.get('2024-0001')
+        self.ana.first_name = 'Anna'
+        self.ana.save()
+        with self.assertNumQueries(1):
+            self.assertEqual(patron_cache.get('2024-0001')['first_name'], 'Anna')
+
+        self.ana.delete()
+        self.assertIsNone(patron_cache.get('2024-0001'))
+
+    def test_changed_id_number_misses_under_the_old_key(self):
+        patron_cache.get('2024-0001')
+        patron = Patron.objects.get(pk=self.ana.pk)
+        patron.id_number = '2024-0009'
+        patron.save()
+
+        self.assertIsNone(patron_cache.get('2024-0001'))
+        self.assertEqual(patron_cache.get('2024-0009')['id'], self.ana.pk)
+
+    def test_bulk_import_invalidates(self):
+        patron_cache.get('2024-0001')
+        csv_file = BytesIO(b"Code,Last Name,First Name,Middle Name,Course,Year,Email\n2024-0001,Go,Anita,,BSA,1,\n")
+        # bulk_update doesn't send post_save; the import invalidates on commit
+        with self.captureOnCommitCallbacks(execute=True):
+            import_patrons(csv_file, 'SBS')
+
+        self.assertEqual(patron_cache.get('2024-0001')['first_name'], 'Anita')
+
+
+class RollupDeltaTests(TestCase):
+    """The rollups kept up at scan time must match a rebuild from the logs."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.ana = Patron.objects.create(id_number='2024-0001', first_name='Ana', last_name='Go', department='SBS',
+                                        program='Bachelor of Science in Accountancy')
+        cls.ben = Patron.objects.create(id_number='2024-0002', first_name='Ben', last_name='Co', department='SEAS',
+                                        program='Bachelor of Arts in English', role='faculty')
+        cls.cy = Patron.objects.create(id_number='2024-0003', first_name='Cy', last_name='Lo')
+
+    @staticmethod
+    def snapshot():
+        return {
+            'daily': sorted(DailyAttendanceStat.objects.values_list(
+                'date', 'department', 'program', 'role', 'visits', 'checkouts', 'total_seconds')),
+            'department': sorted(DepartmentStat.objects.filter(visits__gt=0).values_list('department', 'visits')),
+            'patron': sorted(PatronStat.objects.values_list('patron_id', 'visits', 'total_seconds', 'last_visit')),
+            'monthly': sorted(PatronMonthlyStat.objects.values_list('patron_id', 'year', 'month', 'visits', 'total_seconds')),
+            'occupancy': Occupancy.objects.get(pk=1).current,
+        }
+
+    def test_scan_time_deltas_match_a_rebuild(self):
+        now = timezone.now()
+        earlier = now - datetime.timedelta(days=40)
+        toggle_attendance('2024-0001', now=now - datetime.timedelta(hours=3))
+        toggle_attendance('2024-0001', now=now - datetime.timedelta(hours=1))
+        toggle_attendance('2024-0002', now=now - datetime.timedelta(hours=2))
+        apply_scan_batch([
+            BatchScan('a', '2024-0003', earlier),
+            BatchScan('b', '2024-0003', earlier + datetime.timedelta(minutes=50)),
+            BatchScan('c', '2024-0001', earlier + datetime.timedelta(hours=1)),
+        ])
+        # Closes Ben's session today and Ana's from 40 days ago
+        call_command('force_checkout', stdout=StringIO())
+        toggle_attendance('2024-0003', now=timezone.now())
+        toggle_attendance('2024-0002', now=timezone.now())
+
+        kept = self.snapshot()
+        self.assertEqual(kept['department'], [('', 2), ('SBS', 2), ('SEAS', 2)])
+        self.assertEqual(kept['occupancy'], 2)
+
+        rebuild_daily_stats()
+        rebuild_patron_stats()
+        reconcile_occupancy()
+        self.assertEqual(self.snapshot(), kept)
+
+    def test_dashboard_pie_reads_the_running_totals(self):
+        for id_number in ('2024-0001', '2024-0002', '2024-0001'):
+            toggle_attendance(id_number)
+        self.client.force_login(User.objects.create_user('librarian', password='pass'))
+        response = self.client.get(reverse('dashboard'))
+
+        self.assertEqual(response.context['pie_labels'], ['SBS', 'SEAS'])
+        self.assertEqual(response.context['pie_data'], [1, 1])
+
+
+class RollupBackfillMigrationTests(TransactionTestCase):
+    """Migrations 0013 and 0014 build the rollups from logs that already exist."""
+
+    before = [('library_app', '0012_scanreceipt')]
+    after = [('library_app', '0014_patronstat_patronmonthlystat')]
+
+    def setUp(self):
+        self.executor = MigrationExecutor(connection)
+        self.executor.migrate(self.before)
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes())
+
+    def test_backfill_matches_the_existing_logs(self):
+        apps = self.executor.loader.project_state(self.before).apps
+        OldPatron = apps.get_model('library_app', 'Patron')
+        OldLog = apps.get_model('library_app', 'AttendanceLog')
+
+        tz = timezone.get_current_timezone()
+        ana = OldPatron.objects.create(id_number='2024-0001', first_name='Ana', last_name='Go', department='SBS',
+                                       program='Bachelor of Science in Accountancy', role='student')
+        ben = OldPatron.objects.create(id_number='2024-0002', first_name='Ben', last_name='Co', role='faculty')
+        for patron, scan_time, minutes in [
+            (ana, datetime.datetime(2025, 1, 31, 23, 30, tzinfo=tz), 20),  # local date, not UTC
+            (ana, datetime.datetime(2025, 2, 3, 9, 0, tzinfo=tz), 90),
+            (ben, datetime.datetime(2025, 2, 3, 10, 0, tzinfo=tz), 60),
+            (ben, datetime.datetime(2025, 2, 4, 8, 0, tzinfo=tz), None),  # still open
+        ]:
+            OldLog.objects.create(
+                patron=patron, scan_time=scan_time,
+                time_out=scan_time + datetime.timedelta(minutes=minutes) if minutes else None,
+            )
+
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.after)
+        apps = executor.loader.project_state(self.after).apps
+        Daily = apps.get_model('library_app', 'DailyAttendanceStat')
+        Total = apps.get_model('library_app', 'PatronStat')
+        Monthly = apps.get_model('library_app', 'PatronMonthlyStat')
+
+        self.assertEqual(sorted(Daily.objects.values_list(
+            'date', 'department', 'program', 'role', 'visits', 'checkouts', 'total_seconds',
+        )), [
+            (datetime.date(2025, 1, 31), 'SBS', 'Bachelor of Science in Accountancy', 'student', 1, 1, 20 * 60),
+            (datetime.date(2025, 2, 3), '', '', 'faculty', 1, 1, 60 * 60),
+            (datetime.date(2025, 2, 3), 'SBS', 'Bachelor of Science in Accountancy', 'student', 1, 1, 90 * 60),
+            (datetime.date(2025, 2, 4), '', '', 'faculty', 1, 0, 0),
+        ])
+        self.assertEqual(sorted(Total.objects.values_list('patron_id', 'visits', 'total_seconds', 'last_visit')), [
+            (ana.pk, 2, 110 * 60, datetime.datetime(2025, 2, 3, 9, 0, tzinfo=tz)),
+            (ben.pk, 2, 60 * 60, datetime.datetime(2025, 2, 4, 8, 0, tzinfo=tz)),
+        ])
+        self.assertEqual(sorted(Monthly.objects.values_list('patron_id', 'year', 'month', 'visits', 'total_seconds')), [
+            (ana.pk, 2025, 1, 1, 20 * 60),
+            (ana.pk, 2025, 2, 1, 90 * 60),
+            (ben.pk, 2025, 2, 2, 60 * 60),
+        ])
+
+
+@skipUnless(connection.vendor == 'postgresql', 'TOGGLE_SQL only runs on PostgreSQL')
+class PostgreSQLToggleTests(TransactionTestCase):
+    """The single-statement toggle, with real commits so two connections can race."""
+
+    def setUp(self):
+        patron_cache.clear()
+        self.ana = Patron.objects.create(id_number='2024-0001', first_name='Ana', last_name='Go', department='SBS')
+        self.ben = Patron.objects.create(id_number='2024-0002', first_name='Ben', last_name='Co', department='SBS')
+
+    def test_in_out_in(self):
+        start = timezone.now()
+        results = [
+            toggle_attendance('2024-0001', now=start + datetime.timedelta(minutes=minutes))
+            for minutes in (0, 30, 60)
+        ]
+
+        self.assertEqual([(r.scan_type, r.changed) for r in results], [('in', True), ('out', True), ('in', True)])
+        self.assertEqual(AttendanceLog.objects.filter(patron=self.ana).count(), 2)
+        self.assertEqual(AttendanceLog.objects.filter(patron=self.ana, time_out__isnull=True).count(), 1)
+        self.assertEqual(Occupancy.objects.get(pk=1).current, 1)
+        stat = PatronStat.objects.get(patron=self.ana)
+        self.assertEqual((stat.visits, stat.total_seconds), (2, 30 * 60))
+        self.assertEqual(sum(DailyAttendanceStat.objects.values_list('visits', flat=True)), 2)
+
+    def test_check_in_is_refused_when_full(self):
+        toggle_attendance('2024-0001', capacity=1)
+        refused = toggle_attendance('2024-0002', capacity=1)
+
+        self.assertEqual((refused.scan_type, refused.changed), ('full', False))
+        self.assertFalse(AttendanceLog.objects.filter(patron=self.ben).exists())
+        # Check-outs always go through, and free the place
+        self.assertEqual(toggle_attendance('2024-0001', capacity=1).scan_type, 'out')
+        self.assertEqual(toggle_attendance('2024-0002', capacity=1).scan_type, 'in')
+        self.assertEqual(Occupancy.objects.get(pk=1).current, 1)
+
+    def _race(self, first_key=None, second_key=None):
+        """
+        Two kiosks scan Ana at once: the second statement starts before the
+        first commits, so both see her outside. Returns both ScanResults.
+        """
+        results = {}
+        written = threading.Event()
+
+        def first():
+            try:
+                with transaction.atomic():
+                    results['first'] = toggle_attendance('2024-0001', key=first_key)
+                    written.set()
+                    time.sleep(0.5)  # hold the open row uncommitted while the second scan runs
+            finally:
+                written.set()
+                connection.close()
+
+        def second():
+            try:
+                written.wait(5)
+                results['second'] = toggle_attendance('2024-0001', key=second_key)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=first), threading.Thread(target=second)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(10)
+        return results['first'], results['second']
+
+    def test_concurrent_check_ins_open_one_session(self):
+        first, second = self._race()
+
+        self.assertEqual((first.scan_type, first.changed), ('in', True))
+        # The partial unique index turned the second check-in into a no-op
+        self.assertEqual((second.scan_type, second.changed), ('in', False))
+        self.assertEqual(AttendanceLog.objects.filter(patron=self.ana).count(), 1)
+        self.assertEqual(PatronStat.objects.get(patron=self.ana).visits, 1)
+        self.assertEqual(Occupancy.objects.get(pk=1).current, 1)
+
+    def test_concurrent_replay_of_one_key_is_applied_once(self):
+        first, second = self._race(first_key='k1', second_key='k1')
+
+        self.assertEqual((first.scan_type, first.changed), ('in', True))
+        self.assertEqual((second.scan_type, second.changed, second.time), ('in', False, first.time))
+        self.assertEqual(AttendanceLog.objects.filter(patron=self.ana).count(), 1)
+        self.assertEqual(ScanReceipt.objects.get().scan_type, 'in')
+
+
+class ScanBatchTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.ana = Patron.objects.create(id_number='2024-0001', first_name='Ana', last_name='Go')
+        cls.ben = Patron.objects.create(id_number='2024-0002', first_name='Ben', last_name='Co')
+
+    def _scan(self, key, id_number, minutes_ago):
+        return BatchScan(key, id_number, timezone.now() - datetime.timedelta(minutes=minutes_ago))
+
+    def test_scans_are_applied_in_client_time_order(self):
+        # Sent out of order: the check-in happened first
+        results = apply_scan_batch([self._scan('b', '2024-0001', 10), self._scan('a', '2024-0001', 40)])
+
+        self.assertEqual([r['type'] for r in results], ['out', 'in'])
+        log = AttendanceLog.objects.get(patron=self.ana)
+        self.assertEqual(round((log.time_out - log.scan_time).total_seconds()), 30 * 60)
+
+    def test_key_repeated_in_a_batch_is_applied_once(self):
+        results = apply_scan_batch([self._scan('a', '2024-0001', 5), self._scan('a', '2024-0001', 5)])
+        self.assertEqual([r['type'] for r in results], ['in', 'in'])
+        self.assertEqual(AttendanceLog.objects.filter(patron=self.ana).count(), 1)
+        self.assertIsNone(AttendanceLog.objects.get(patron=self.ana).time_out)
+
+    def test_replayed_key_is_answered_from_its_receipt(self):
+        apply_scan_batch([self._scan('a', '2024-0002', 5)])
+        results = apply_scan_batch([self._scan('a', '2024-0002', 5), self._scan('b', '2024-0001', 1)])
+
+        self.assertEqual([(r['type'], r['duplicate']) for r in results], [('in', True), ('in', False)])
+        self.assertIsNone(AttendanceLog.objects.get(patron=self.ben).time_out)
+
+    def test_live_scan_is_not_applied_again_by_its_offline_replay(self):
+        # The live request got through, but the kiosk queued the scan anyway
+        response = self.client.post(reverse('process_scan'), {'qr_code': '2024-0001', 'key': 'k1'}, content_type='application/json')
+        self.assertEqual(response.json()['type'], 'in')
+
+        [result] = apply_scan_batch([self._scan('k1', '2024-0001', 0)])
+        self.assertEqual((result['type'], result['duplicate']), ('in', True))
+        self.assertIsNone(AttendanceLog.objects.get(patron=self.ana).time_out)
+
+        # And a live retry of the same key is answered, not toggled
+        response = self.client.post(reverse('process_scan'), {'qr_code': '2024-0001', 'key': 'k1'}, content_type='application/json')
+        self.assertEqual(response.json()['type'], 'in')
+        self.assertEqual(AttendanceLog.objects.filter(patron=self.ana).count(), 1)
+
+    def test_earlier_day_batch_is_dated_and_counted_on_that_day(self):
+        # A kiosk that was offline yesterday syncs today
+        tz = timezone.get_current_timezone()
+        yesterday = timezone.localdate() - datetime.timedelta(days=1)
+        at = datetime.datetime.combine(yesterday, datetime.time(10, 0), tzinfo=tz)
+        epoch = live_feed.epoch
+        with self.captureOnCommitCallbacks(execute=True):
+            results = apply_scan_batch([
+                BatchScan('a', '2024-0001', at), BatchScan('b', '2024-0001', at + datetime.timedelta(hours=1)),
+            ])
+
+        self.assertEqual([r['type'] for r in results], ['in', 'out'])
+        self.assertEqual(AttendanceLog.objects.get(patron=self.ana).date_only, yesterday)
+        stat = DailyAttendanceStat.objects.get()
+        self.assertEqual((stat.date, stat.visits, stat.checkouts, stat.total_seconds), (yesterday, 1, 1, 3600))
+        # Dashboards are told to reload: the poller's overlap window won't reach yesterday
+        self.assertNotEqual(live_feed.epoch, epoch)
+
+    def test_unknown_id_is_final_and_does_not_block_the_batch(self):
+        scans = [
+            {'key': 'a', 'qr_code': '2024-9999', 'scanned_at': timezone.now().isoformat()},
+            {'key': 'b', 'qr_code': '2024-0001', 'scanned_at': timezone.now().isoformat()},
+            {'key': 'c', 'qr_code': '', 'scanned_at': timezone.now().isoformat()},
+        ]
+        response = self.client.post(reverse('process_scan_batch'), {'scans': scans}, content_type='application/json')
+
+        self.assertEqual(response.status_code, 200)
+        results = response.json()['results']
+        self.assertEqual([r['status'] for r in results], ['error', 'success', 'error'])
+        self.assertFalse(any(r.get('retry') for r in results))
+        self.assertTrue(AttendanceLog.objects.filter(patron=self.ana, time_out__isnull=True).exists())
+
+    def test_conflicting_scan_is_left_for_retry(self):
+        real = attendance._apply_scans
+
+        def conflict_on_ben(scans):
+            if any(scan.id_number == '2024-0002' for scan in scans):
+                raise IntegrityError('duplicate key value violates unique constraint')
+            return real(scans)
+
+        with mock.patch.object(attendance, '_apply_scans', conflict_on_ben):
+            results = attendance.apply_scan_batch([self._scan('a', '2024-0001', 2), self._scan('b', '2024-0002', 1)])
+
+        self.assertEqual(results[0]['status'], 'success')
+        self.assertEqual((results[1]['status'], results[1]['retry']), ('error', True))
+        self.assertFalse(AttendanceLog.objects.filter(patron=self.ben).exists())
+
+
+class PrintPdfReportTests(TestCase):
+    """The report must be one grouped query, no matter how many programs/months it covers."""
+
+    @classmethod
+    def setUpTestData(cls):
+        tz = timezone.get_current_timezone()
+        cs = Patron.objects.create(
+            id_number='2024-0001', first_name='Ana', last_name='Cruz', department='SBS',
+            program='Bachelor of Science in Computer Science',
+        )
+        nurse = Patron.objects.create(
+            id_number='2024-0002', first_name='Ben', last_name='Reyes', department='SHES',
+            program='Bachelor of Science in Nursing',
+        )
+        visits = [
+            (cs, datetime.datetime(2025, 1, 15, 9, 0, tzinfo=tz)),
+            (cs, datetime.datetime(2025, 1, 16, 9, 0, tzinfo=tz)),
+            (cs, datetime.datetime(2025, 3, 3, 13, 0, tzinfo=tz)),
+            (nurse, datetime.datetime(2025, 3, 4, 10, 0, tzinfo=tz)),
+            # Early on Jan 1st local time is still Dec 31st in UTC
+            (nurse, datetime.datetime(2025, 1, 1, 7, 0, tzinfo=tz)),
+            # Other year: must not be counted
+            (cs, datetime.datetime(2024, 12, 31, 23, 0, tzinfo=tz)),
+        ]
+        for patron, scan_time in visits:
+            AttendanceLog.objects.create(patron=patron, scan_time=scan_time, time_out=scan_time + datetime.timedelta(hours=1))
+        rebuild_daily_stats()
+
+    def test_annual_report_data(self):
+        report = build_report_data(2025, list(range(1, 13)))
+
+        cs_row = report['SBS']['programs']['Bachelor of Science in Computer Science']
+        self.assertEqual(cs_row[0], 2)
+        self.assertEqual(cs_row[2], 1)
+        self.assertEqual(cs_row[-1], 3)
+        self.assertEqual(report['SBS']['totals'][-1], 3)
+
+        nursing_row = report['SHES']['programs']['Bachelor of Science in Nursing']
+        self.assertEqual(nursing_row[0], 1)
+        self.assertEqual(nursing_row[-1], 2)
+        self.assertIsNone(report['SHES']['totals'])
+
+    def test_monthly_report_data(self):
+        report = build_report_data(2025, [3])
+        self.assertEqual(report['SBS']['programs']['Bachelor of Science in Computer Science'], [1, 1])
+        self.assertEqual(report['SHES']['programs']['Bachelor of Science in Nursing'], [1, 1])
+
+    def test_report_data_is_one_query(self):
+        with self.assertNumQueries(1):
+            build_report_data(2025, list(range(1, 13)))
+
+    def test_visits_count_as_classified_at_scan_time(self):
+        tz = timezone.get_current_timezone()
+        mover = Patron.objects.create(
+            id_number='2024-0005', first_name='Mia', last_name='Sy', department='SBS',
+            program='Bachelor of Science in Accountancy',
+        )
+        leaver = Patron.objects.create(
+            id_number='2024-0006', first_name='Leo', last_name='Ty', department='SBS',
+            program='Bachelor of Science in Accountancy',
+        )
+        at = datetime.datetime(2025, 6, 2, 9, 0, tzinfo=tz)
+        for id_number in ('2024-0005', '2024-0006'):
+            toggle_attendance(id_number, now=at)
+            toggle_attendance(id_number, now=at + datetime.timedelta(hours=1))
+
+        # Later the first one changes program and role, and the second is removed
+        mover.program, mover.role = 'Bachelor of Science in Computer Science', 'faculty'
+        mover.save()
+        leaver.delete()
+
+        report = build_report_data(2025, [6])
+        self.assertEqual(report['SBS']['programs']['Bachelor of Science in Accountancy'][-1], 2)
+        self.assertEqual(report['SBS']['programs']['Bachelor of Science in Computer Science'][-1], 0)
+        # Deliberately not the raw-log count by current details...
+        raw = AttendanceLog.objects.filter(scan_time__year=2025, scan_time__month=6)
+        self.assertEqual(raw.filter(patron__program='Bachelor of Science in Accountancy').count(), 0)
+        self.assertEqual(raw.filter(patron__program='Bachelor of Science in Computer Science').count(), 1)
+
+        # ...until a rebuild reclassifies what is left in the logs
+        rebuild_daily_stats()
+        report = build_report_data(2025, [6])
+        self.assertEqual(report['SBS']['programs']['Bachelor of Science in Accountancy'][-1], 0)
+        self.assertEqual(report['SBS']['programs']['Bachelor of Science in Computer Science'][-1], 1)
+
+
+@override_settings(REPORT_RENDER_SYNC=True, REPORT_CACHE_DIR=tempfile.mkdtemp())
+class ReportCacheTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.patron = Patron.objects.create(
+            id_number='2024-0003', first_name='Cara', last_name='Santos', department='SBS',
+            program='Bachelor of Science in Accountancy',
+        )
+
+    def test_past_report_is_rendered_once_and_reused(self):
+        url = reverse('print_pdf')
+        response = self.client.get(url, {'type': 'yearly', 'year': 2020})
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        self.assertEqual(ReportArtifact.objects.get().data_version, data_version(2020, list(range(1, 13))))
+
+        # Cached: the version, a lookup and a file read, no render
+        with self.assertNumQueries(2):
+            response = self.client.get(url, {'type': 'yearly', 'year': 2020})
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        self.assertEqual(ReportArtifact.objects.count(), 1)
+
+    def test_current_period_version_changes_with_new_scans(self):
+        today = timezone.localdate()
+        before = data_version(today.year, [today.month])
+
+        self.client.post(reverse('process_scan'), {'qr_code': self.patron.id_number}, content_type='application/json')
+
+        self.assertNotEqual(data_version(today.year, [today.month]), before)
+
+    def test_late_scans_into_a_past_period_change_its_version(self):
+        year = timezone.localdate().year - 1
+        before = data_version(year, [3])
+
+        AttendanceLog.objects.create(
+            patron=self.patron, scan_time=datetime.datetime(year, 3, 2, 9, 0, tzinfo=timezone.get_current_timezone()),
+            date_only=datetime.date(year, 3, 2),
+        )
+        rebuild_daily_stats()
+
+        self.assertNotEqual(data_version(year, [3]), before)
+
+    def test_superseded_files_are_kept_for_a_grace_period(self):
+        now = timezone.now()
+        with tempfile.TemporaryDirectory() as cache_dir:
+            def artifact(version, finished_at):
+                path = f'{cache_dir}/{version}.pdf'
+                with open(path, 'wb') as pdf_file:
+                    pdf_file.write(b'%PDF')
+                return ReportArtifact.objects.create(
+                    report_type='monthly', year=2021, month=5, data_version=version,
+                    status='ready', file_path=path, finished_at=finished_at,
+                )
+
+            first = artifact('v1', now - datetime.timedelta(hours=1))
+            second = artifact('v2', now - datetime.timedelta(minutes=1))
+            # v1 was superseded a minute ago: a download may still be reading it
+            _discard_old_versions(second)
+            self.assertEqual(ReportArtifact.objects.count(), 2)
+
+            ReportArtifact.objects.filter(pk=second.pk).update(finished_at=now - SUPERSEDED_GRACE * 2)
+            third = artifact('v3', now)
+            _discard_old_versions(third)
+            self.assertEqual(set(ReportArtifact.objects.values_list('data_version', flat=True)), {'v2', 'v3'})
+            self.assertFalse(os.path.exists(first.file_path))
+            self.assertTrue(os.path.exists(second.file_path))
+
+    def test_failed_report_is_rendered_again_after_a_backoff(self):
+        failed = ReportArtifact.objects.create(
+            report_type='yearly', year=2018, month=0, data_version=data_version(2018, list(range(1, 13))),
+            status='failed', finished_at=timezone.now(),
+        )
+        # Just failed: not retried straight away
+        self.assertEqual(get_report('yearly', 2018).status, 'failed')
+
+        ReportArtifact.objects.filter(pk=failed.pk).update(finished_at=timezone.now() - FAILED_RETRY * 2)
+        artifact = get_report('yearly', 2018)
+        self.assertEqual(artifact.pk, failed.pk)
+        self.assertEqual(artifact.status, 'ready')
+
+    def test_pending_report_shows_progress_page(self):
+        with override_settings(REPORT_RENDER_SYNC=False):
+            ReportArtifact.objects.create(
+                report_type='yearly', year=2019, month=0, data_version=data_version(2019, list(range(1, 13))),
+            )
+            response = self.client.get(reverse('print_pdf'), {'type': 'yearly', 'year': 2019})
+        self.assertTemplateUsed(response, 'library_app/report_pending.html')
+
+
+class PatronListLastVisitTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('librarian', password='pass')
+        cls.regular = Patron.objects.create(id_number='2024-0010', first_name='Dan', last_name='Lim')
+        cls.newcomer = Patron.objects.create(id_number='2024-0011', first_name='Eve', last_name='Tan')
+
+        start = timezone.now() - datetime.timedelta(days=30)
+        for day in range(30):
+            scan_time = start + datetime.timedelta(days=day)
+            AttendanceLog.objects.create(patron=cls.regular, scan_time=scan_time, time_out=scan_time + datetime.timedelta(hours=2))
+        cls.open_visit = AttendanceLog.objects.create(patron=cls.regular, scan_time=timezone.now())
+
+    def test_last_visit_is_annotated(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('patron_list'))
+
+        patrons = {p.id_number: p for p in response.context['patrons']}
+        self.assertEqual(patrons['2024-0010'].last_scan_time, self.open_visit.scan_time)
+        self.assertIsNone(patrons['2024-0010'].last_time_out)
+        self.assertIsNone(patrons['2024-0011'].last_scan_time)
+        self.assertContains(response, 'Active')
+
+
+class PatronSearchTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('librarian', password='pass')
+        Patron.objects.create(id_number='2024-0020', first_name='Maria', middle_name='Luz', last_name='Santos')
+        Patron.objects.create(id_number='2024-0021', first_name='Mario', last_name='Reyes')
+
+    def test_search_text_follows_edits(self):
+        patron = Patron.objects.get(id_number='2024-0021')
+        patron.last_name = 'Garcia'
+        patron.save(update_fields=['last_name'])
+        self.assertEqual(Patron.objects.get(pk=patron.pk).search_text, 'mario garcia 2024-0021')
+
+    def test_all_terms_must_match(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('patron_search'), {'q': 'MAR santos'})
+        self.assertEqual([r['id_number'] for r in response.json()['results']], ['2024-0020'])
+
+        response = self.client.get(reverse('patron_search'), {'q': '2024-002'})
+        self.assertEqual(len(response.json()['results']), 2)
+
+
+@override_settings(AUDIT_LOG_SYNC=True)
+class BulkImportTests(TestCase):
+
+    HEADER = "Code,Last Name,First Name,Middle Name,Course,Year,Email\n"
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('librarian', password='pass')
+        Patron.objects.create(
+            id_number='2024-0100', first_name='Gia', last_name='Lopez', middle_name='',
+            program='Bachelor of Science in Accountancy', major='', year_level='1st Year', department='SBS',
+        )
+        Patron.objects.create(
+            id_number='2024-0101', first_name='Hans', last_name='Uy', middle_name='',
+            program='Bachelor of Science in Accountancy', major='', year_level='1st Year', department='SBS',
+        )
+
+    def upload(self, body, **extra):
+        self.client.force_login(self.user)
+        csv_file = SimpleUploadedFile('students.csv', (self.HEADER + body).encode('utf-8-sig'))
+        return self.client.post(reverse('bulk_import'), {'csv_file': csv_file, 'department': 'SBS', **extra})
+
+    ROWS = (
+        "2024-0100,Lopez,Gia,,BSA,1,\n"          # unchanged
+        "2024-0101,Uy,Hans,,BSA,2,hans@ucc.edu\n"  # updated
+        "2024-0102,Ong,Ivy,,BSCS,1,\n"           # new
+        ",Nobody,No,,BSCS,1,\n"                  # invalid: no code
+        "2024-0102,Ong,Ivy,,BSCS,1,\n"           # invalid: duplicate
+    )
+
+    def test_dry_run_reports_diff_without_saving(self):
+        response = self.upload(self.ROWS, dry_run='on')
+
+        result = response.context['result']
+        self.assertEqual((result.created, result.updated, result.unchanged, result.invalid), (1, 1, 1, 2))
+        self.assertEqual(result.changed_rows[0].changes['year_level'], ('1st Year', '2nd Year'))
+        self.assertFalse(Patron.objects.filter(id_number='2024-0102').exists())
+        self.assertEqual(Patron.objects.get(id_number='2024-0101').year_level, '1st Year')
+
+    def test_import_applies_changes(self):
+        self.upload(self.ROWS)
+
+        created = Patron.objects.get(id_number='2024-0102')
+        self.assertEqual(created.program, 'Bachelor of Science in Computer Science')
+        self.assertEqual(created.search_text, 'ivy ong 2024-0102')
+        updated = Patron.objects.get(id_number='2024-0101')
+        self.assertEqual((updated.year_level, updated.email), ('2nd Year', 'hans@ucc.edu'))
+
+    def test_each_rejection_reason(self):
+        rows = (
+            "2024-0200,Ok,Row,,BSA,1,ok@ucc.edu\n"
+            ",Nobody,No,,BSA,1,\n"
+            "2024-0201,,Nofirst,,BSA,1,\n"
+            "2024-0202,Nolast,,,BSA,1,\n"
+            "2024-0203,Bad,Mail,,BSA,1,not-an-email\n"
+            "2024-0200,Again,Row,,BSA,1,\n"
+            f"2024-0204,{'L' * 101},Long,,BSA,1,\n"
+        )
+        result = import_patrons(SimpleUploadedFile('s.csv', (self.HEADER + rows).encode()), 'SBS')
+
+        self.assertEqual(result.created, 1)
+        self.assertEqual([(row.line, row.id_number, row.reason) for row in result.invalid_rows], [
+            (3, '', 'Missing Code'),
+            (4, '2024-0201', 'Missing First Name or Last Name'),
+            (5, '2024-0202', 'Missing First Name or Last Name'),
+            (6, '2024-0203', "Invalid Email 'not-an-email'"),
+            (7, '2024-0200', 'Duplicate Code in file'),
+            (8, '2024-0204', 'Last Name is longer than 100 characters'),
+        ])
+        self.assertEqual(set(Patron.objects.filter(id_number__startswith='2024-02').values_list('id_number', flat=True)), {'2024-0200'})
+
+    def test_file_missing_a_required_column_is_rejected(self):
+        self.client.force_login(self.user)
+        csv_file = SimpleUploadedFile('students.csv', b"Code,Last Name,First Name,Course\n2024-0300,Go,Al,BSA\n")
+        response = self.client.post(reverse('bulk_import'), {'csv_file': csv_file, 'department': 'SBS'}, follow=True)
+
+        self.assertContains(response, 'Missing column(s): Year')
+        self.assertFalse(Patron.objects.filter(id_number='2024-0300').exists())
+
+    def test_queries_do_not_grow_with_rows(self):
+        def run(count):
+            rows = ''.join(f"2025-{i:04d},Last,First,,BSA,1,\n" for i in range(count))
+            return SimpleUploadedFile('s.csv', (self.HEADER + rows).encode())
+
+        # savepoint + existing-ID lookup + insert + release
+        # (kept under SQLite's per-statement variable limit, which splits big inserts)
+        with self.assertNumQueries(4):
+            import_patrons(run(60), 'SBS')
+
+
+class CsvExportTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('librarian', password='pass')
+        tz = timezone.get_current_timezone()
+        cls.ana = Patron.objects.create(id_number='2024-0200', first_name='Ana', last_name='Diaz', department='SBS')
+        cls.ben = Patron.objects.create(id_number='2024-0201', first_name='Ben', last_name='Sy', role='faculty')
+        start = datetime.datetime(2025, 2, 3, 8, 30, tzinfo=tz)
+        AttendanceLog.objects.create(patron=cls.ana, scan_time=start, time_out=start + datetime.timedelta(minutes=95))
+        AttendanceLog.objects.create(patron=cls.ben, scan_time=start + datetime.timedelta(days=1))
+        AttendanceLog.objects.create(patron=cls.ana, scan_time=start + datetime.timedelta(days=10))
+
+    def export(self, name, **params):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse(name), params)
+        self.assertTrue(response.streaming)
+        return list(csv.reader(line.decode() for line in response.streaming_content))
+
+    def test_patron_export(self):
+        rows = self.export('export_patrons_csv')
+        self.assertEqual(rows[0][0], 'ID Number')
+        self.assertEqual(rows[1][:7], ['2024-0200', 'Ana', '', 'Diaz', '', 'Student', 'School of Business Sciences (SBS)'])
+        self.assertEqual(rows[2][5], 'Faculty')
+
+    def test_attendance_export_uses_history_filters(self):
+        rows = self.export('export_attendance_csv', date_start='2025-02-01', date_end='2025-02-05')
+        self.assertEqual(len(rows), 3)
+        self.assertEqual(rows[2][6:], ['2025-02-03', '08:30:00', '10:05:00', '95'])
+        self.assertEqual(rows[1][8:], ['', ''])
+
+        rows = self.export('export_attendance_csv', q_id='2024-0200')
+        self.assertEqual({row[0] for row in rows[1:]}, {'2024-0200'})
+        # "ID starts with", so the filter can use an index
+        self.assertEqual(len(self.export('export_attendance_csv', q_id='0200')), 1)
+
+    def test_date_filter_uses_local_day_bounds(self):
+        tz = timezone.get_current_timezone()
+        late = AttendanceLog.objects.create(patron=self.ben, scan_time=datetime.datetime(2025, 3, 1, 23, 59, 59, tzinfo=tz), time_out=datetime.datetime(2025, 3, 2, 0, 0, tzinfo=tz))
+        AttendanceLog.objects.create(patron=self.ana, scan_time=datetime.datetime(2025, 3, 2, 0, 0, tzinfo=tz), time_out=datetime.datetime(2025, 3, 2, 1, 0, tzinfo=tz))
+
+        logs = filter_attendance_logs(AttendanceLog.objects.all(), '2025-03-01', '2025-03-01')
+        self.assertEqual(list(logs), [late])
+        # An unparseable bound is ignored rather than raising
+        self.assertEqual(filter_attendance_logs(AttendanceLog.objects.all(), 'garbage', None).count(), 5)
+
+
+@override_settings(AUDIT_LOG_SYNC=True)
+class QRCodeTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('librarian', password='pass')
+        Patron.objects.create(id_number='2024-0300', first_name='Ira', last_name='Go', department='SBS')
+        Patron.objects.create(id_number='2024-0301', first_name='Jo', last_name='Ko', department='SBS')
+        Patron.objects.create(id_number='2024-0302', first_name='Lu', last_name='Mo', department='GS')
+
+    def test_qr_is_cacheable_and_revalidates(self):
+        url = reverse('generate_qr', args=['2024-0300'])
+        response = self.client.get(url)
+        self.assertEqual(response['Content-Type'], 'image/png')
+        self.assertIn('immutable', response['Cache-Control'])
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_bulk_zip_uses_list_filters(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('qr_bulk_zip'), {'department': 'SBS'})
+        archive = zipfile.ZipFile(BytesIO(b''.join(response.streaming_content)))
+
+        self.assertEqual(archive.namelist(), ['QR_2024-0300.png', 'QR_2024-0301.png'])
+        self.assertEqual(archive.read('QR_2024-0301.png'), render_qr_png('2024-0301'))
+
+    def test_bulk_misses_are_rendered_in_a_pool_in_order(self):
+        cache = QRRenderCache()
+        cache.get('2024-0001')
+        items = [f'2024-{i:04d}' for i in range(POOL_THRESHOLD + 10)]
+        pngs = list(cache.get_many(items, workers=2))
+
+        self.assertEqual([data for data, _ in pngs], items)
+        self.assertEqual(pngs[1][1], render_qr_png('2024-0001'))
+        self.assertEqual(pngs[-1][1], render_qr_png(items[-1]))
+        # The misses are cached for next time
+        self.assertEqual(cache.hits, 1)
+        list(cache.get_many(items[:5]))
+        self.assertEqual(cache.hits, 6)
+
+    def test_card_sheets_pdf(self):
+        for i in range(12):
+            Patron.objects.create(id_number=f'2024-04{i:02d}', first_name='Kim', last_name=f'Card{i}', department='SEAS')
+
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('qr_cards_pdf'), {'department': 'SEAS'})
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+
+        reader = PdfReader(BytesIO(response.content))
+        self.assertEqual(len(reader.pages), 2)  # 10 cards per sheet
+        self.assertIn('2024-0400', reader.pages[0].extract_text())
+
+
+    def test_large_card_sheets_are_rendered_in_chunks_and_merged(self):
+        cards = [('Kim', f'Card{i}', f'2024-{i:04d}', '') for i in range(PAGES_PER_TASK * 10 * 2 + 1)]
+        pdf = build_card_sheets(cards, workers=2)
+        reader = PdfReader(BytesIO(pdf))
+        self.assertEqual(len(reader.pages), PAGES_PER_TASK * 2 + 1)
+        self.assertIn('2024-0400', reader.pages[-1].extract_text())
+
+        # A host where the pool can't start gets the same sheets, rendered here
+        with mock.patch('library_app.qr.ProcessPoolExecutor', side_effect=OSError('no processes')), \
+                self.assertLogs('library_app.qr', 'WARNING'):
+            fallback = build_card_sheets(cards, workers=2)
+        self.assertEqual(len(PdfReader(BytesIO(fallback)).pages), PAGES_PER_TASK * 2 + 1)
+
+class FailingEmailBackend:
+    """Mail backend whose server is always down."""
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def open(self):
+        raise smtplib.SMTPConnectError(421, 'Service not available')
+
+    def close(self):
+        pass
+
+
+@override_settings(EMAIL_RATE_LIMIT=0, AUDIT_LOG_SYNC=True)
+class EmailOutboxTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('librarian', password='pass')
+        cls.patron = Patron.objects.create(id_number='2024-0500', first_name='Lea', last_name='Pe', email='lea@ucc.edu')
+
+    def test_resend_only_enqueues(self):
+        self.client.force_login(self.user)
+        self.client.get(reverse('resend_qr', args=[self.patron.id_number]))
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(OutboundEmail.objects.get().status, 'pending')
+
+        self.assertEqual(drain_outbox()['sent'], 1)
+        self.assertEqual(mail.outbox[0].to, ['lea@ucc.edu'])
+        self.assertEqual(mail.outbox[0].attachments[0][0], 'QR_2024-0500.png')
+        self.assertEqual(OutboundEmail.objects.get().status, 'sent')
+
+    @override_settings(EMAIL_BACKEND='library_app.tests.FailingEmailBackend')
+    def test_failures_back_off_then_dead_letter(self):
+        email = enqueue_email('lea@ucc.edu', 'Hi', 'Body')
+        now = timezone.now()
+        for attempt in range(1, MAX_ATTEMPTS):
+            self.assertEqual(drain_outbox(now=now)['failed'], 1)
+            email.refresh_from_db()
+            self.assertEqual(email.next_attempt_at, now + backoff(attempt))
+            # Not due again until the backoff has passed
+            self.assertEqual(drain_outbox(now=now)['claimed'], 0)
+            now = email.next_attempt_at
+
+        with self.assertLogs('library_app.outbox', 'ERROR') as logs:
+            self.assertEqual(drain_outbox(now=now)['dead'], 1)
+        self.assertEqual(len(logs.records), 1)
+        self.assertIn(f'Giving up on email {email.pk} to lea@ucc.edu', logs.output[0])
+        email.refresh_from_db()
+        self.assertEqual((email.status, email.attempts), ('dead', MAX_ATTEMPTS))
+        self.assertIn('SMTPConnectError', email.last_error)
+
+
+@override_settings(EMAIL_RATE_LIMIT=0, AUDIT_LOG_SYNC=True)
+class EmailCampaignTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('librarian', password='pass')
+        for i in range(3):
+            Patron.objects.create(id_number=f'2024-060{i}', first_name='Max', last_name=f'Ng{i}', department='SBS', email=f'max{i}@ucc.edu')
+        Patron.objects.create(id_number='2024-0609', first_name='No', last_name='Mail', department='SBS')
+        Patron.objects.create(id_number='2024-0610', first_name='Other', last_name='Dept', department='GS', email='o@ucc.edu')
+
+    def test_rerun_only_sends_to_failures_and_new_patrons(self):
+        campaign = campaign_for(QueryDict('department=SBS'))
+        self.assertEqual(queue_qr_campaign(campaign), {'queued': 3, 'retried': 0})
+        drain_outbox()
+        self.assertEqual(sorted(m.to[0] for m in mail.outbox), ['max0@ucc.edu', 'max1@ucc.edu', 'max2@ucc.edu'])
+
+        # One failure, one newcomer: a rerun touches only those two
+        campaign.emails.filter(patron__id_number='2024-0601').update(status='dead')
+        Patron.objects.create(id_number='2024-0603', first_name='New', last_name='Kid', department='SBS', email='new@ucc.edu')
+        self.assertEqual(campaign_for(QueryDict('department=SBS')), campaign)
+        self.assertEqual(queue_qr_campaign(campaign), {'queued': 1, 'retried': 1})
+
+        mail.outbox = []
+        drain_outbox()
+        self.assertEqual(sorted(m.to[0] for m in mail.outbox), ['max1@ucc.edu', 'new@ucc.edu'])
+        self.assertEqual(campaign_progress(campaign), {'pending': 0, 'sent': 4, 'dead': 0, 'total': 4})
+
+    @override_settings(QR_RENDER_WORKERS=2)
+    def test_large_campaign_renders_attachments_in_the_pool(self):
+        Patron.objects.bulk_create([
+            Patron(id_number=f'2024-07{i:02d}', first_name='Bulk', last_name=f'Mail{i}', department='SEAS', email=f'b{i}@ucc.edu')
+            for i in range(60)
+        ])
+        campaign = campaign_for(QueryDict('department=SEAS'))
+        with mock.patch.object(qr, 'pool_map', wraps=qr.pool_map) as pool_map:
+            self.assertEqual(queue_qr_campaign(campaign), {'queued': 60, 'retried': 0})
+        pool_map.assert_called_once()
+        email = campaign.emails.get(patron__id_number='2024-0759')
+        self.assertEqual(bytes(email.attachment), render_qr_png('2024-0759'))
+
+    def test_campaign_view(self):
+        self.client.force_login(self.user)
+        response = self.client.post(reverse('email_qr_campaign'), {'filters': 'department=GS&page=2'})
+        campaign = EmailCampaign.objects.get()
+        self.assertRedirects(response, reverse('email_campaign', args=[campaign.pk]))
+        self.assertEqual(campaign.filters, 'department=GS')
+        self.assertContains(self.client.get(response.url), 'Emailing QR Codes')
+
+
+@override_settings(AUDIT_LOG_SYNC=True)
+class AuditLogTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('librarian', password='pass')
+
+    @override_settings(AUDIT_LOG_SYNC=False)
+    def test_buffered_entries_cost_no_queries_until_flushed(self):
+        buffer = AuditBuffer(flush_size=100, flush_interval=3600)
+        with self.assertNumQueries(0):
+            for i in range(3):
+                buffer.record(self.user.pk, 'Manual Check-In', f'entry {i}')
+        recorded_at = timezone.now()
+
+        with self.assertNumQueries(1):
+            self.assertEqual(buffer.flush(), 3)
+        entries = list(SystemLog.objects.order_by('pk'))
+        self.assertEqual([e.details for e in entries], ['entry 0', 'entry 1', 'entry 2'])
+        self.assertLessEqual(entries[-1].action_time, recorded_at)
+
+    def test_sync_mode_writes_immediately(self):
+        self.client.force_login(self.user)
+        self.client.post(reverse('manual_checkin'), {'id_number': 'nobody'})
+        Patron.objects.create(id_number='2024-0700', first_name='Ned', last_name='Ro')
+        self.client.post(reverse('manual_checkin'), {'id_number': '2024-0700'})
+        self.assertEqual(SystemLog.objects.get().action, 'Manual Check-In')
+
+
+class OccupancyTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('librarian', password='pass')
+        for i in range(3):
+            Patron.objects.create(id_number=f'2024-080{i}', first_name='Pat', last_name=f'No{i}')
+
+    def scan(self, id_number):
+        return self.client.post(reverse('process_scan'), {'qr_code': id_number}, content_type='application/json')
+
+    def occupancy(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('check_active_sessions'))
+        self.assertIn('max-age=5', response['Cache-Control'])
+        return response.json()['count']
+
+    def test_counter_follows_scans_and_force_checkout(self):
+        self.scan('2024-0800')
+        self.scan('2024-0801')
+        self.scan('2024-0800')
+        self.assertEqual(self.occupancy(), 1)
+
+        call_command('force_checkout', stdout=StringIO())
+        self.assertEqual(self.occupancy(), 0)
+
+    def test_counter_read_does_not_scan_the_log(self):
+        with self.assertNumQueries(1):
+            current_occupancy()
+
+    @override_settings(LIBRARY_CAPACITY=1)
+    def test_capacity_refuses_check_ins_but_not_check_outs(self):
+        self.assertEqual(self.scan('2024-0800').json()['type'], 'in')
+
+        response = self.scan('2024-0801')
+        self.assertEqual(response.status_code, 409)
+        self.assertTrue(response.json()['full'])
+        self.assertFalse(AttendanceLog.objects.filter(patron__id_number='2024-0801').exists())
+
+        self.assertEqual(self.scan('2024-0800').json()['type'], 'out')
+        self.assertEqual(self.scan('2024-0801').json()['type'], 'in')
+
+    def test_reconcile_corrects_drift(self):
+        self.scan('2024-0800')
+        # Deleting a patron who is inside bypasses the counter
+        Patron.objects.get(id_number='2024-0800').delete()
+        self.assertEqual(self.occupancy(), 1)
+        self.assertEqual(reconcile_occupancy(), 0)
+
+
+class LiveActivityTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('librarian', password='pass')
+        cls.ana = Patron.objects.create(id_number='2024-0900', first_name='Ana', last_name='Go')
+        cls.ben = Patron.objects.create(id_number='2024-0901', first_name='Ben', last_name='Co')
+
+    def test_recent_activity_merges_latest_ins_and_outs(self):
+        now = timezone.now()
+        AttendanceLog.objects.create(patron=self.ana, scan_time=now - datetime.timedelta(days=1, hours=1), time_out=now - datetime.timedelta(days=1))
+        AttendanceLog.objects.create(patron=self.ana, scan_time=now - datetime.timedelta(minutes=30), time_out=now - datetime.timedelta(minutes=10))
+        AttendanceLog.objects.create(patron=self.ben, scan_time=now - datetime.timedelta(minutes=20))
+
+        with self.assertNumQueries(2):
+            events = recent_activity(limit=2, today=timezone.localdate(now))
+        self.assertEqual([(e['type'], e['name']) for e in events], [('out', 'Ana Go'), ('in', 'Ben Co')])
+
+    def test_feed_buffers_new_scans_once(self):
+        feed = LiveFeed()
+        cursor = feed.cursor()
+        toggle_attendance('2024-0900')
+        feed.poll()
+        events, cursor = feed.read(cursor)
+        self.assertEqual([e['type'] for e in events], ['in', 'counts'])
+        self.assertEqual(events[1]['occupancy'], 1)
+
+        # The overlap window re-reads the same scan; it must not be repeated
+        feed.poll()
+        self.assertEqual(feed.read(cursor), ([], cursor))
+
+        toggle_attendance('2024-0900')
+        feed.poll()
+        events, _ = feed.read(cursor)
+        self.assertEqual([e['type'] for e in events], ['out', 'counts'])
+
+        self.assertIsNone(feed.read('another-process:3')[0])
+
+    def test_poll_without_cursor_returns_snapshot(self):
+        AttendanceLog.objects.create(patron=self.ben, scan_time=timezone.now())
+        self.client.force_login(self.user)
+        data = self.client.get(reverse('live_activity_poll')).json()
+        self.assertTrue(data['reset'])
+        self.assertEqual(data['events'][0]['name'], 'Ben Co')
+        self.assertIn('occupancy', data['counts'])
+
+
+class KeysetPaginationTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('librarian', password='pass')
+        patron = Patron.objects.create(id_number='2024-1000', first_name='Kai', last_name='Lee')
+        start = timezone.now() - datetime.timedelta(days=30)
+        # Pairs of identical scan_times make sure ties are broken by id
+        cls.logs = [
+            AttendanceLog.objects.create(
+                patron=patron, scan_time=start + datetime.timedelta(hours=i // 2),
+                time_out=start + datetime.timedelta(hours=i // 2, minutes=30),
+            )
+            for i in range(7)
+        ]
+
+    def test_pages_cover_every_row_once_in_both_directions(self):
+        logs = AttendanceLog.objects.all()
+        newest_first = sorted(self.logs, key=lambda log: (log.scan_time, log.pk), reverse=True)
+
+        pages, params = [], QueryDict()
+        while True:
+            page = keyset_page(logs, 'scan_time', params, per_page=3)
+            pages.append(page)
+            if not page.has_next:
+                break
+            params = QueryDict(f'after={page.next_cursor}')
+        self.assertEqual([log for page in pages for log in page], newest_first)
+        self.assertEqual([len(page) for page in pages], [3, 3, 1])
+        self.assertFalse(pages[0].has_previous)
+
+        back = keyset_page(logs, 'scan_time', QueryDict(f'before={pages[2].previous_cursor}'), per_page=3)
+        self.assertEqual(back.object_list, pages[1].object_list)
+        self.assertTrue(back.has_previous and back.has_next)
+
+        oldest = keyset_page(logs, 'scan_time', QueryDict('last=1'), per_page=3)
+        self.assertEqual(oldest.object_list, newest_first[-3:])
+
+    def test_history_page_cost_does_not_depend_on_depth(self):
+        self.client.force_login(self.user)
+        first = self.client.get(reverse('scan_history'))
+        self.assertEqual(first.context['logs'].count, 7)
+
+        cursor = first.context['logs'].previous_cursor
+        with self.assertNumQueries(4):  # session, user, count, page
+            deep = self.client.get(reverse('scan_history'), {'after': cursor})
+        self.assertEqual(len(deep.context['logs']), 6)
+
+
+@override_settings(ACADEMIC_YEAR_START_MONTH=8)
+class ArchiveTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('librarian', password='pass')
+        tz = timezone.get_current_timezone()
+        program = 'Bachelor of Science in Accountancy'
+        cls.old_timer = Patron.objects.create(id_number='2020-0001', first_name='Old', last_name='Timer', department='SBS', program=program)
+        cls.regular = Patron.objects.create(id_number='2024-1100', first_name='Reg', last_name='Ular', department='SBS', program=program)
+        for patron, scan_time in [
+            (cls.old_timer, datetime.datetime(2024, 3, 4, 9, 0, tzinfo=tz)),
+            (cls.regular, datetime.datetime(2025, 7, 31, 15, 0, tzinfo=tz)),
+            (cls.regular, datetime.datetime(2025, 8, 1, 8, 0, tzinfo=tz)),
+        ]:
+            AttendanceLog.objects.create(patron=patron, scan_time=scan_time, time_out=scan_time + datetime.timedelta(hours=1))
+        # Still open from last year: never archived
+        cls.open_log = AttendanceLog.objects.create(patron=cls.old_timer, scan_time=datetime.datetime(2025, 7, 1, 9, 0, tzinfo=tz))
+        rebuild_daily_stats()
+        rebuild_patron_stats()
+
+    @override_settings(SCAN_RECEIPT_DAYS=14)
+    def test_expired_scan_receipts_are_pruned(self):
+        now = timezone.now()
+        for key, age in [('old', 15), ('recent', 13)]:
+            receipt = ScanReceipt.objects.create(key=key, patron=self.regular, scan_type='in', scanned_at=now)
+            ScanReceipt.objects.filter(pk=receipt.pk).update(received_at=now - datetime.timedelta(days=age))
+
+        self.assertEqual(prune_scan_receipts(now), 1)
+        self.assertEqual(list(ScanReceipt.objects.values_list('key', flat=True)), ['recent'])
+
+    def test_closed_past_years_move_and_stats_survive_a_rebuild(self):
+        cutoff = archive_cutoff(datetime.date(2025, 10, 1))
+        self.assertEqual(timezone.localtime(cutoff).date(), datetime.date(2025, 8, 1))
+
+        self.assertEqual(archive_attendance(cutoff, batch_size=1), 2)
+        self.assertEqual(archive_attendance(cutoff), 0)
+        self.assertEqual(set(AttendanceLog.objects.values_list('pk', flat=True)), {
+            self.open_log.pk, AttendanceLog.objects.get(scan_time__gte=cutoff).pk,
+        })
+        self.assertEqual(AttendanceArchive.objects.count(), 2)
+
+        # Reports read the rollups, and rebuilding them still counts archived sessions
+        before = build_report_data(2024, [3])
+        rebuild_daily_stats()
+        rebuild_patron_stats()
+        self.assertEqual(build_report_data(2024, [3]), before)
+        self.assertEqual(before['SBS']['totals'], [1, 1])
+        self.assertEqual(PatronStat.objects.get(patron=self.regular).visits, 2)
+
+    def test_history_and_patron_list_read_the_archive(self):
+        archive_attendance(archive_cutoff(datetime.date(2025, 10, 1)))
+        self.client.force_login(self.user)
+
+        current = self.client.get(reverse('scan_history'))
+        self.assertEqual(current.context['logs'].count, 2)
+        archived = self.client.get(reverse('scan_history'), {'archived': '1'})
+        self.assertEqual([log.patron.id_number for log in archived.context['logs']], ['2024-1100', '2020-0001'])
+
+        patrons = {p.id_number: p for p in self.client.get(reverse('patron_list')).context['patrons']}
+        # Open session this year wins over the archive
+        self.assertIsNone(patrons['2020-0001'].last_time_out)
+        self.assertEqual(patrons['2024-1100'].last_scan_time.date(), datetime.date(2025, 8, 1))
+
+
+class SeedAndBenchmarkTests(TestCase):
+
+    def test_seeded_history_matches_the_rollups(self):
+        call_command('seed_library_data', patrons=40, days=21, visits_per_day=15, inside_now=0, stdout=StringIO())
+
+        self.assertEqual(Patron.objects.filter(id_number__startswith='SEED-').count(), 40)
+        self.assertFalse(Patron.objects.filter(role='student', program__isnull=True).exists())
+        logs = list(AttendanceLog.objects.all())
+        self.assertTrue(logs)
+        for log in logs:
+            local = timezone.localtime(log.scan_time)
+            self.assertEqual(log.date_only, local.date())
+            self.assertNotEqual(local.weekday(), 6)
+            self.assertLessEqual(timezone.localtime(log.time_out).time(), datetime.time(16, 45))
+        self.assertEqual(DailyAttendanceStat.objects.aggregate(total=Sum('visits'))['total'], len(logs))
+
+    def test_benchmark_reports_each_view_and_rolls_back(self):
+        Patron.objects.create(id_number='2024-0009', first_name='Ana', last_name='Cruz')
+        out = StringIO()
+        call_command('benchmark_views', runs=1, only=['dashboard', 'process_scan'], stdout=out)
+
+        report = json.loads(out.getvalue())
+        self.assertEqual(set(report['views']), {'dashboard', 'process_scan'})
+        for result in report['views'].values():
+            self.assertEqual(result['status'], 200)
+            self.assertGreater(result['queries'], 0)
+        self.assertFalse(AttendanceLog.objects.exists())
+
+
+@override_settings(REPORT_RENDER_SYNC=True, REPORT_CACHE_DIR=tempfile.mkdtemp(), EMAIL_RATE_LIMIT=0, AUDIT_LOG_SYNC=True)
+class QueryBudgetTests(TestCase):
+    """
+    Every view in urls.py is requested against a small data set, then again
+    after the data set has grown; it must run the same number of queries
+    both times (nothing per row) and stay within its budget. Budgets include
+    the session and user lookups of a logged-in request and are the SQLite
+    counts; PostgreSQL's single-statement scan path runs fewer.
+    live_activity_stream is left out: it never finishes, and its queries are
+    the shared live feed poller's, not the request's.
+    """
+    BUDGETS = {
+        'landing_page': 0,
+        'dashboard': 10,
+        'process_scan': 30,
+        'process_scan_batch': 16,
+        'patron_cache_stats': 2,
+        'live_activity_poll': 6,
+        'patron_list': 4,
+        'patron_search': 3,
+        'add_patron': 2,
+        'bulk_import': 5,
+        'bulk_import_progress': 2,
+        'export_patrons_csv': 3,
+        'export_attendance_csv': 3,
+        'patron_detail': 3,
+        'update_patron': 5,
+        'delete_patron': 11,
+        'generate_qr': 0,
+        'qr_bulk_zip': 4,
+        'qr_cards_pdf': 4,
+        'email_qr_campaign': 7,
+        'email_campaign': 5,
+        'email_campaign_status': 4,
+        'resend_qr': 5,
+        'manual_checkin': 22,
+        'scan_history': 4,
+        'system_logs': 4,
+        'report_selection': 0,
+        'print_pdf': 12,
+        'report_status': 1,
+        'login': 0,
+        'logout': 5,
+        'check_active_sessions': 3,
+        'metrics': 2,
+        'logout_and_checkout': 16,
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('librarian', password='pass', is_staff=True)
+        cls.campaign = EmailCampaign.objects.create(filters='department=SBS', label='SBS')
+        cls.artifact = ReportArtifact.objects.create(report_type='yearly', year=2025, data_version='final', status='pending')
+
+    def _populate(self, start, count):
+        """count more patrons across the departments, each with visits, an archived visit, emails and audit entries."""
+        tz = timezone.get_current_timezone()
+        today = timezone.localdate()
+        departments = list(SCHOOL_DATA)
+        for i in range(start, start + count):
+            department = departments[i % len(departments)]
+            patron = Patron.objects.create(
+                id_number=f'2024-{i:04d}', first_name=f'First{i}', last_name=f'Last{i}', email=f'p{i}@ucc.edu',
+                department=department, program=SCHOOL_DATA[department][0], year_level='1st Year',
+            )
+            for days_ago in (1, 2, 40):
+                scan_time = datetime.datetime.combine(today - datetime.timedelta(days=days_ago), datetime.time(9, i % 60), tz)
+                AttendanceLog.objects.create(patron=patron, scan_time=scan_time, time_out=scan_time + datetime.timedelta(hours=1))
+            AttendanceLog.objects.create(patron=patron, scan_time=timezone.now() - datetime.timedelta(minutes=5))
+            AttendanceArchive.objects.create(
+                id=10_000 + i, patron=patron, date_only=datetime.date(2023, 3, 1),
+                scan_time=datetime.datetime(2023, 3, 1, 10, 0, tzinfo=tz), time_out=datetime.datetime(2023, 3, 1, 11, 0, tzinfo=tz),
+            )
+            OutboundEmail.objects.create(to=patron.email, subject='QR', body='', patron=patron, campaign=self.campaign, status='dead')
+            SystemLog.objects.create(user=self.user, action='Add User', details=f'Added {patron.id_number}')
+        rebuild_daily_stats()
+        rebuild_patron_stats()
+        reconcile_occupancy()
+
+    def _requests(self, spare):
+        """(view name, method, path, data); spare is a patron the request may check in, edit or delete."""
+        csv_file = SimpleUploadedFile('students.csv', (
+            'Code,Last Name,First Name,Middle Name,Course,Year,Email\n'
+            + ''.join(f'{spare}-{n},Last,First,,BSCS,1,\n' for n in range(3))
+        ).encode())
+        scans = [{'key': f'{spare}-{n}', 'qr_code': spare, 'scanned_at': timezone.now().isoformat()} for n in range(3)]
+        return [
+            ('landing_page', 'get', reverse('landing_page'), None),
+            ('dashboard', 'get', reverse('dashboard'), None),
+            ('process_scan', 'json', reverse('process_scan'), {'qr_code': spare, 'key': f'live-{spare}'}),
+            ('process_scan_batch', 'json', reverse('process_scan_batch'), {'scans': scans}),
+            ('patron_cache_stats', 'get', reverse('patron_cache_stats'), None),
+            ('live_activity_poll', 'get', reverse('live_activity_poll'), None),
+            ('patron_list', 'get', reverse('patron_list'), None),
+            ('patron_search', 'get', reverse('patron_search'), {'q': 'last1'}),
+            ('add_patron', 'get', reverse('add_patron'), None),
+            ('bulk_import', 'post', reverse('bulk_import'), {'csv_file': csv_file, 'department': 'SBS', 'dry_run': 'on'}),
+            ('bulk_import_progress', 'get', reverse('bulk_import_progress', args=['abc']), None),
+            ('export_patrons_csv', 'get', reverse('export_patrons_csv'), None),
+            ('export_attendance_csv', 'get', reverse('export_attendance_csv'), None),
+            ('patron_detail', 'get', reverse('patron_detail', args=[spare]), None),
+            ('update_patron', 'post', reverse('update_patron', args=[spare]), {
+                'id_number': spare, 'first_name': 'Renamed', 'last_name': 'Patron', 'email': 'spare@ucc.edu',
+                'role': 'student', 'department': 'SBS', 'program': 'Bachelor of Science in Accountancy'}),
+            ('generate_qr', 'get', reverse('generate_qr', args=[spare]), None),
+            ('qr_bulk_zip', 'get', reverse('qr_bulk_zip'), None),
+            ('qr_cards_pdf', 'get', reverse('qr_cards_pdf'), None),
+            ('email_qr_campaign', 'post', reverse('email_qr_campaign'), {'filters': f'q={spare}'}),
+            ('email_campaign', 'get', reverse('email_campaign', args=[self.campaign.pk]), None),
+            ('email_campaign_status', 'get', reverse('email_campaign_status', args=[self.campaign.pk]), None),
+            ('resend_qr', 'get', reverse('resend_qr', args=[spare]), None),
+            ('manual_checkin', 'post', reverse('manual_checkin'), {'id_number': spare}),
+            ('scan_history', 'get', reverse('scan_history'), None),
+            ('system_logs', 'get', reverse('system_logs'), None),
+            ('report_selection', 'get', reverse('report_selection'), None),
+            ('print_pdf', 'get', reverse('print_pdf'), None),
+            ('report_status', 'get', reverse('report_status', args=[self.artifact.pk]), None),
+            ('check_active_sessions', 'get', reverse('check_active_sessions'), None),
+            ('metrics', 'get', reverse('metrics'), None),
+            ('delete_patron', 'get', reverse('delete_patron', args=[spare]), None),
+            ('login', 'get', reverse('login'), None),
+            ('logout_and_checkout', 'get', reverse('logout_and_checkout'), None),
+            ('logout', 'get', reverse('logout'), None),
+        ]
+
+    def _query_counts(self, spare):
+        Patron.objects.create(id_number=spare, first_name='Spare', last_name='Patron', email='spare@ucc.edu')
+        counts = {}
+        for name, method, path, data in self._requests(spare):
+            self.client.force_login(self.user)
+            patron_cache.clear()
+            with CaptureQueriesContext(connection) as queries:
+                if method == 'json':
+                    response = self.client.post(path, json.dumps(data), content_type='application/json')
+                elif method == 'post':
+                    response = self.client.post(path, data)
+                else:
+                    response = self.client.get(path, data)
+                if response.streaming:
+                    b''.join(response.streaming_content)
+            self.assertLess(response.status_code, 400, name)
+            counts[name] = len(queries)
+        return counts
+
+    def test_views_stay_within_budget_as_data_grows(self):
+        self._populate(0, 5)
+        small = self._query_counts('SPARE-1')
+        self._populate(5, 20)
+        large = self._query_counts('SPARE-2')
+
+        self.assertEqual(set(small), set(self.BUDGETS))
+        for name, budget in self.BUDGETS.items():
+            with self.subTest(view=name):
+                self.assertEqual(large[name], small[name], 'query count grows with the data')
+                self.assertLessEqual(large[name], budget)
+
+    def test_batched_rollups_match_a_rebuild(self):
+        # One force checkout updates existing rollup rows and creates missing ones in batches
+        self._populate(0, 6)
+        # Inside right now but without any per-patron rollup rows yet
+        for i in range(3):
+            patron = Patron.objects.create(id_number=f'2025-{i:04d}', first_name='New', last_name=f'Comer{i}')
+            AttendanceLog.objects.create(patron=patron, scan_time=timezone.now() - datetime.timedelta(hours=2))
+        rebuild_daily_stats()
+        call_command('force_checkout', stdout=StringIO())
+
+        def snapshot():
+            return (
+                sorted(DailyAttendanceStat.objects.values_list('date', 'program', 'visits', 'checkouts', 'total_seconds')),
+                sorted(PatronStat.objects.values_list('patron_id', 'total_seconds')),
+                sorted(PatronMonthlyStat.objects.values_list('patron_id', 'year', 'month', 'total_seconds')),
+            )
+
+        incremental = snapshot()
+        rebuild_daily_stats()
+        rebuild_patron_stats()
+        self.assertEqual(snapshot(), incremental)
+
+
+class RequestMetricsTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = User.objects.create_user('head', password='pass', is_staff=True)
+        cls.librarian = User.objects.create_user('librarian', password='pass')
+        Patron.objects.create(id_number='2024-0700', first_name='Mia', last_name='Sy')
+
+    def setUp(self):
+        request_metrics.reset()
+
+    def test_requests_are_counted_and_timed(self):
+        self.client.force_login(self.librarian)
+        response = self.client.get(reverse('dashboard'))
+        self.assertRegex(response['Server-Timing'], r'^app;dur=[\d.]+, db;dur=[\d.]+;desc="\d+ queries"$')
+
+        scan = self.client.post(reverse('process_scan'), json.dumps({'qr_code': '2024-0700'}), content_type='application/json')
+        self.assertIn('scan_lookup;dur=', scan['Server-Timing'])
+        self.assertIn('scan_write;dur=', scan['Server-Timing'])
+
+        self.client.force_login(self.staff)
+        body = self.client.get(reverse('metrics')).content.decode()
+        self.assertIn('library_http_requests_total{view="dashboard",method="GET",status="200"} 1', body)
+        self.assertIn('library_http_request_duration_seconds_count{view="process_scan"} 1', body)
+        self.assertIn('library_http_request_duration_seconds_bucket{view="process_scan",le="+Inf"} 1', body)
+        self.assertIn('library_phase_duration_seconds_count{phase="scan_write"} 1', body)
+        self.assertRegex(body, r'library_http_response_size_bytes_sum\{view="dashboard"\} [1-9]')
+
+    @override_settings(METRICS_TOKEN='s3cret')
+    def test_staff_or_token_only(self):
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 302)
+        self.client.force_login(self.librarian)
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+        self.assertEqual(self.client.get(reverse('metrics'), headers={'Authorization': 'Bearer wrong'}).status_code, 403)
+        self.client.logout()
+        response = self.client.get(reverse('metrics'), headers={'Authorization': 'Bearer s3cret'})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('# TYPE library_http_requests_total counter', response.content.decode())
+
+
+@override_settings(PROFILING_WRITE_SYNC=True, PROFILING_KEEP=3)
+class RequestProfilingTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser('admin', password='pass')
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.settings_override = override_settings(PROFILING_DIR=directory)
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+        # Rolling back the test transaction doesn't send post_delete
+        self.addCleanup(set_config, None)
+        self.client.force_login(self.admin)
+
+    def _switch(self, **fields):
+        ProfilingSettings.objects.update_or_create(pk=1, defaults={'enabled': True, **fields})
+
+    def test_off_by_default(self):
+        self.client.get(reverse('dashboard'))
+        self.assertEqual(list_captures(), [])
+
+    def test_sampled_requests_keep_profile_and_sql(self):
+        self._switch(sample_rate=1.0, slow_ms=60_000)
+        self.client.get(reverse('dashboard'))
+
+        summary, = list_captures()
+        self.assertEqual((summary['view'], summary['reasons']), ('dashboard', ['sampled']))
+        capture = read_capture(summary['name'])
+        self.assertEqual(len(capture['queries']), capture['query_count'])
+        self.assertTrue(any('library_app_dailyattendancestat' in query['sql'] for query in capture['queries']))
+        self.assertIn('cumulative', capture['top_functions'])
+        self.assertIsNotNone(profile_path(summary['name']))
+
+    def test_captures_leave_out_parameter_values(self):
+        Patron.objects.create(id_number='2024-5150', first_name='Priya', last_name='Quintos')
+        self._switch(sample_rate=1.0, slow_ms=60_000)
+        self.client.get(reverse('patron_search'), {'q': 'Quintos'})
+
+        capture = read_capture(list_captures()[0]['name'])
+        self.assertEqual((capture['path'], capture['query_params']), (reverse('patron_search'), ['q']))
+        self.assertTrue(capture['queries'])
+        stored = json.dumps(capture)
+        for value in ('Quintos', 'quintos', self.client.session.session_key):
+            self.assertNotIn(value, stored)
+
+    def test_slow_requests_are_logged_and_the_directory_rotates(self):
+        self._switch(sample_rate=0, slow_ms=0)
+        for _ in range(5):
+            self.client.get(reverse('check_active_sessions'))
+
+        captures = list_captures()
+        self.assertEqual(len(captures), 3)
+        self.assertEqual({tuple(c['reasons']) for c in captures}, {('slow',)})
+        self.assertEqual({c['profile'] for c in captures}, {None})
+
+    def test_admin_lists_and_shows_captures(self):
+        self._switch(sample_rate=1.0, slow_ms=60_000)
+        self.client.get(reverse('patron_list'))
+        name = list_captures()[0]['name']
+        self._switch(enabled=False)
+
+        changelist = self.client.get(reverse('admin:library_app_profilingsettings_changelist'))
+        page = self.client.get(changelist['Location'])
+        self.assertContains(page, name)
+        detail = self.client.get(reverse('admin:library_app_profiling_capture', args=[name]))
+        self.assertContains(detail, 'library_app_patron')
+        download = self.client.get(reverse('admin:library_app_profiling_download', args=[name]))
+        self.assertEqual(download.status_code, 200)
+        self.assertEqual(self.client.get(reverse('admin:library_app_profiling_capture', args=['..'])).status_code, 404)
@@ -7,16 +7,28 @@ urlpatterns = [
     path('', views.landing_page, name='landing_page'),
     path('dashboard/', views.dashboard, name='dashboard'),
     path('scan/', views.process_scan, name='process_scan'),
+    path('scan/batch/', views.process_scan_batch, name='process_scan_batch'),
+    path('scan/cache-stats/', views.patron_cache_stats, name='patron_cache_stats'),
+    path('live-activity/poll/', views.live_activity_poll, name='live_activity_poll'),
+    path('live-activity/stream/', views.live_activity_stream, name='live_activity_stream'),
 
     # --- Patron Management ---
     path('patrons/', views.patron_list, name='patron_list'),
+    path('patron-search/', views.patron_search, name='patron_search'),
     path('add-patron/', views.add_patron, name='add_patron'),
     path('bulk-import/', views.bulk_import, name='bulk_import'),
+    path('bulk-import/progress/<slug:token>/', views.bulk_import_progress, name='bulk_import_progress'),
     path('export-patrons/', views.export_patrons_csv, name='export_patrons_csv'),
+    path('export-attendance/', views.export_attendance_csv, name='export_attendance_csv'),
     path('patrons/<str:id_number>/', views.patron_detail, name='patron_detail'),
     path('update-patron/<str:id_number>/', views.update_patron, name='update_patron'),
     path('delete-patron/<str:id_number>/', views.delete_patron, name='delete_patron'),
     path('generate-qr/<str:id_number>/', views.generate_qr, name='generate_qr'),
+    path('qr-bulk/', views.qr_bulk_zip, name='qr_bulk_zip'),
+    path('qr-cards/', views.qr_cards_pdf, name='qr_cards_pdf'),
+    path('qr-email/', views.email_qr_campaign, name='email_qr_campaign'),
+    path('qr-email/<int:campaign_id>/', views.email_campaign, name='email_campaign'),
+    path('qr-email/<int:campaign_id>/status/', views.email_campaign_status, name='email_campaign_status'),
     path('resend-qr/<str:id_number>/', views.resend_qr, name='resend_qr'),
 
     # --- Attendance & History ---
@@ -27,6 +39,7 @@ urlpatterns = [
     # --- Reports ---
     path('reports/', views.report_selection, name='report_selection'),
     path('print_pdf/', views.print_pdf, name='print_pdf'),
+    path('print_pdf/status/<int:artifact_id>/', views.report_status, name='report_status'),
 
     # --- Authentication ---
     path('login/', views.CustomLoginView.as_view(), name='login'),
@@ -34,6 +47,9 @@ urlpatterns = [
     # FIX IS HERE: Use views.logout_view instead of auth_views.LogoutView
     path('logout/', views.logout_view, name='logout'),
 
+    # --- Monitoring ---
+    path('metrics/', views.metrics, name='metrics'),
+
     # --- Smart Logout ---
     path('check-active-sessions/', views.check_active_sessions, name='check_active_sessions'),
     path('logout-checkout/', views.logout_and_checkout, name='logout_and_checkout'),
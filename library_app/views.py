@@ -1,41 +1,61 @@
+import asyncio
 import json
-import qrcode
 import uuid
 import calendar
-import datetime
-from io import BytesIO
-import os
-import csv
-from datetime import timedelta
 
 # Django Imports
-from django.db.models import Count, Sum, F, Q, Prefetch
-from django.db.models.functions import ExtractMonth, ExtractDay
-from django.template.loader import get_template
+from django.db.models import Case, Sum, OuterRef, Subquery, When
+from django.db.models.functions import Coalesce, ExtractMonth, ExtractDay
 from django.shortcuts import render, redirect, get_object_or_404
-from django.http import HttpResponse, JsonResponse, HttpResponseRedirect
-from django.core.mail import EmailMessage
+from django.http import QueryDict, HttpResponse, JsonResponse, HttpResponseRedirect, FileResponse, StreamingHttpResponse
 from django.conf import settings
+from django.contrib.staticfiles import finders
+from django.core.cache import cache
+from django.core.handlers.asgi import ASGIRequest
+from django.core.serializers.json import DjangoJSONEncoder
 from django.contrib import messages
 from django.contrib.auth import logout
 from django.contrib.auth.views import LoginView
 from django.contrib.auth.decorators import login_required
+from asgiref.sync import sync_to_async
+from django.views.decorators.cache import cache_control
 from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import condition
+from django.urls import reverse
+from django.utils.http import urlencode
 from django.utils import timezone
-from django.contrib.staticfiles import finders
+from django.utils.html import escape
+from django.utils.text import slugify
+from django.utils.dateparse import parse_datetime
 from django.core.paginator import Paginator
-
-# Third-party
-from xhtml2pdf import pisa
+from django.core.exceptions import PermissionDenied
+from django.contrib.auth.views import redirect_to_login
+from django.utils.crypto import constant_time_compare
 
 # Local Imports
-from .models import Patron, AttendanceLog, SystemLog
+from .models import Patron, AttendanceLog, AttendanceArchive, SystemLog, DailyAttendanceStat, DepartmentStat, ReportArtifact, EmailCampaign
+from .attendance import toggle_attendance, apply_scan_batch, BatchScan
+from .patron_cache import patron_cache
+from .stats import leaderboard, current_occupancy, today_totals
+from .reports import get_report, report_period
+from .search import search_patrons, filter_patrons
+from .importer import import_patrons
+from .qr import qr_cache, qr_key, stream_qr_zip
+from .qr_cards import build_card_sheets
+from .outbox import enqueue_qr_email, campaign_for, start_campaign, campaign_progress
+from .audit import audit_log
+from .archive import archive_cutoff
+from .dates import filter_local_dates
+from .live import live_feed, live_counts, recent_activity
+from .pagination import keyset_page, estimated_count, PAGE_PARAMS
+from .exports import csv_response, export_attendance, filter_attendance_logs, patron_rows, PATRON_HEADER
+from .metrics import request_metrics
 
 
 def log_action(request, action, details):
-    """Helper to record system logs."""
+    """Helper to record system logs (buffered; written in the background)."""
     if request.user.is_authenticated:
-        SystemLog.objects.create(user=request.user, action=action, details=details)
+        audit_log.record(request.user.pk, action, details)
 
 
 # ==========================================
@@ -58,107 +78,84 @@ def dashboard(request):
     # ... [Keep your existing Stats, Filters, and Chart Logic here] ...
     # (Lines 1-60 remain the same, I will focus on the Top 5 Logic below)
 
-    # 1. Basic Stats
-    daily_count = AttendanceLog.objects.filter(scan_time__date=today).count()
-    checked_in_count = AttendanceLog.objects.filter(scan_time__date=today, time_out__isnull=True).count()
-    checked_out_count = AttendanceLog.objects.filter(scan_time__date=today, time_out__isnull=False).count()
+    # 1. Basic Stats (from the daily rollup, not the raw logs)
+    today_stats = today_totals(today)
+    daily_count = today_stats['visits']
+    checked_out_count = today_stats['checkouts']
+    checked_in_count = daily_count - checked_out_count
 
     selected_dept = request.GET.get('department')
     selected_year = int(request.GET.get('year', current_year))
     selected_month = request.GET.get('month')
 
     # --- CHART LOGIC ---
-    chart_query = AttendanceLog.objects.filter(scan_time__year=selected_year)
+    chart_query = DailyAttendanceStat.objects.filter(date__year=selected_year)
     if selected_dept:
-        chart_query = chart_query.filter(patron__department=selected_dept)
+        chart_query = chart_query.filter(department=selected_dept)
 
     chart_labels = []
     chart_data = []
 
     if selected_month and selected_month != "":
         selected_month = int(selected_month)
-        chart_query = chart_query.filter(scan_time__month=selected_month)
-        daily_data = chart_query.annotate(day=ExtractDay('scan_time')).values('day').annotate(
-            count=Count('id')).order_by('day')
+        chart_query = chart_query.filter(date__month=selected_month)
+        daily_data = chart_query.annotate(day=ExtractDay('date')).values('day').annotate(
+            count=Sum('visits')).order_by('day')
         _, num_days = calendar.monthrange(selected_year, selected_month)
         chart_labels = [str(i) for i in range(1, num_days + 1)]
         chart_data = [0] * num_days
         for entry in daily_data:
             chart_data[entry['day'] - 1] = entry['count']
     else:
-        monthly_data = chart_query.annotate(month=ExtractMonth('scan_time')).values('month').annotate(
-            count=Count('id')).order_by('month')
+        monthly_data = chart_query.annotate(month=ExtractMonth('date')).values('month').annotate(
+            count=Sum('visits')).order_by('month')
         chart_labels = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
         chart_data = [0] * 12
         for entry in monthly_data:
             chart_data[entry['month'] - 1] = entry['count']
 
     # --- PIE CHART LOGIC ---
-    dept_stats = AttendanceLog.objects.values('patron__department').annotate(count=Count('id')).order_by('-count')
-    pie_labels = [item['patron__department'] for item in dept_stats]
-    pie_data = [item['count'] for item in dept_stats]
+    # All-time visits per department, from the running totals
+    dept_stats = DepartmentStat.objects.filter(visits__gt=0).order_by('-visits', 'department')
+    pie_labels = [item.department for item in dept_stats]
+    pie_data = [item.visits for item in dept_stats]
+
+    # --- LEADERBOARDS (from running per-patron stats) ---
+    # All-time by default; scoped to the year/month/department only when the user filters by them
+    board_scope = {
+        'year': selected_year if 'year' in request.GET else None,
+        'month': selected_month or None,
+        'department': selected_dept or None,
+    }
+    if board_scope['month'] and not board_scope['year']:
+        board_scope['year'] = selected_year
 
     # --- TOP 5 VISITORS (Frequency) ---
-    # UPDATED: Fetching 'patron__department' instead of program
-    top_visits = AttendanceLog.objects.values(
-        'patron__first_name', 'patron__last_name', 'patron__department'
-    ).annotate(visit_count=Count('id')).order_by('-visit_count')[:5]
+    top_visits = leaderboard('visits', **board_scope)
 
     # --- TOP 5 STUDY LEADERS (Time Spent) ---
-    # UPDATED: Storing Department alongside Name
-    logs_with_duration = AttendanceLog.objects.filter(time_out__isnull=False)
-    time_leaderboard = {}
-
-    for log in logs_with_duration:
-        duration = log.time_out - log.scan_time
-        # Key is now a tuple: (Name, Department) to ensure we capture both
-        key = (f"{log.patron.first_name} {log.patron.last_name}", log.patron.department)
-
-        if key in time_leaderboard:
-            time_leaderboard[key] += duration
-        else:
-            time_leaderboard[key] = duration
-
-    sorted_time = sorted(time_leaderboard.items(), key=lambda x: x[1], reverse=True)[:5]
     top_time_spent = []
-
-    for (name, dept), duration in sorted_time:
-        total_seconds = int(duration.total_seconds())
+    for leader in leaderboard('total_seconds', **board_scope):
+        total_seconds = leader['total_seconds']
         hours = total_seconds // 3600
         minutes = (total_seconds % 3600) // 60
         top_time_spent.append({
-            'name': name,
-            'dept': dept,  # Passing department to template
+            'name': f"{leader['patron__first_name']} {leader['patron__last_name']}",
+            'dept': leader['patron__department'],  # Passing department to template
             'time_str': f"{hours}h {minutes}m"
         })
 
-    # --- RECENT ACTIVITY ---
-    today_logs = AttendanceLog.objects.filter(scan_time__date=today).select_related('patron')
-    activity_feed = []
-
-    for log in today_logs:
-        activity_feed.append({
-            'patron': log.patron,
-            'role': log.patron.role,
-            'status': 'IN',
-            'time': log.scan_time
-        })
-        if log.time_out:
-            activity_feed.append({
-                'patron': log.patron,
-                'role': log.patron.role,
-                'status': 'OUT',
-                'time': log.time_out
-            })
-
-    activity_feed.sort(key=lambda x: x['time'], reverse=True)
-    recent_logs = activity_feed[:5]  # Limit to 5
+    # --- RECENT ACTIVITY (newer scans are pushed by the live feed) ---
+    recent_logs = recent_activity()
 
     context = {
         'daily_count': daily_count,
         'checked_in_count': checked_in_count,
         'checked_out_count': checked_out_count,
         'recent_logs': recent_logs,
+        'live_cursor': live_feed.cursor(),
+        'live_stream': isinstance(request, ASGIRequest),
+        'occupancy': current_occupancy(),
         'departments': Patron.DEPARTMENT_CHOICES,
         'chart_labels': chart_labels,
         'chart_data': chart_data,
@@ -181,66 +178,25 @@ def dashboard(request):
 @login_required
 def patron_list(request):
     """Displays list of users with search and filter options."""
-    query = request.GET.get('q', '').strip()
-    role_filter = request.GET.get('role')
-    dept_filter = request.GET.get('department')
     program_filter = request.GET.get('program')
     year_filter = request.GET.get('year_level')
 
-    patrons = Patron.objects.prefetch_related(
-        Prefetch('logs', queryset=AttendanceLog.objects.order_by('-scan_time'))
+    # Last visit per patron as correlated subqueries (one index seek each),
+    # instead of prefetching every log the patron ever had. Patrons with no
+    # visit this academic year fall back to the archive.
+    last_log = AttendanceLog.objects.filter(patron=OuterRef('pk')).order_by('-scan_time')
+    last_archived = AttendanceArchive.objects.filter(patron=OuterRef('pk')).order_by('-scan_time')
+    patrons = Patron.objects.annotate(
+        current_scan_time=Subquery(last_log.values('scan_time')[:1]),
+    ).annotate(
+        last_scan_time=Coalesce('current_scan_time', Subquery(last_archived.values('scan_time')[:1])),
+        last_time_out=Case(
+            When(current_scan_time__isnull=False, then=Subquery(last_log.values('time_out')[:1])),
+            default=Subquery(last_archived.values('time_out')[:1]),
+        ),
     ).order_by('-created_at')
 
-    if query:
-        # Split the query into individual terms (e.g., "Vincent Faustino" -> ["Vincent", "Faustino"])
-        terms = query.split()
-        
-        # Create a base Q object that matches everything initially
-        search_filter = Q()
-
-        # For each term, we want to ensure it appears in AT LEAST ONE of the fields.
-        # But since we want ALL terms to be present (AND logic between terms),
-        # we combine them iteratively.
-        
-        # Logic: (Term1 in First OR Term1 in Last OR ...) AND (Term2 in First OR Term2 in Last OR ...)
-        
-        for term in terms:
-            term_filter = (
-                Q(first_name__icontains=term) |
-                Q(middle_name__icontains=term) |
-                Q(last_name__icontains=term) |
-                Q(id_number__icontains=term)
-            )
-            # Combine with AND
-            if search_filter == Q():
-                search_filter = term_filter
-            else:
-                search_filter &= term_filter
-        
-        patrons = patrons.filter(search_filter)
-
-    if role_filter:
-        patrons = patrons.filter(role=role_filter)
-
-    if dept_filter:
-        patrons = patrons.filter(department=dept_filter)
-
-    if dept_filter == 'BES':
-        # BES Logic: UI 'Year Level' -> DB 'Program', UI 'Program' -> DB 'Major'
-        if year_filter:
-            patrons = patrons.filter(program=year_filter)
-        if program_filter:
-            patrons = patrons.filter(major=program_filter)
-    else:
-        # Standard College Logic
-        if program_filter:
-            if " - " in program_filter and "Grade" in program_filter:
-                prog_part, major_part = program_filter.split(" - ", 1)
-                patrons = patrons.filter(program=prog_part, major__icontains=major_part)
-            else:
-                patrons = patrons.filter(program=program_filter)
-        if year_filter:
-            patrons = patrons.filter(year_level=year_filter)
+    patrons = filter_patrons(patrons, request.GET)
 
     # --- PAGINATION (Fix for Broken Pipe / Slow Loading) ---
     paginator = Paginator(patrons, 50) # Show 50 users per page
@@ -264,6 +220,26 @@ def patron_list(request):
     return render(request, 'library_app/qr_list.html', context)
 
 
+@login_required
+def patron_search(request):
+    """Typeahead for the patron list and manual check-in: top matches as JSON."""
+    query = request.GET.get('q', '').strip()
+    if len(query) < 2:
+        return JsonResponse({'results': []})
+
+    matches = search_patrons(Patron.objects.order_by('last_name', 'first_name'), query)[:10]
+    return JsonResponse({'results': [
+        {
+            'id_number': patron['id_number'],
+            'name': f"{patron['first_name']} {patron['last_name']}",
+            'role': patron['role'],
+            'department': patron['department'],
+            'program': patron['program'],
+        }
+        for patron in matches.values('id_number', 'first_name', 'last_name', 'role', 'department', 'program')
+    ]})
+
+
 @login_required
 def add_patron(request):
     if request.method == 'POST':
@@ -299,27 +275,9 @@ def add_patron(request):
             )
 
             if email:
-                try:
-                    qr_img = qrcode.make(patron.id_number)
-                    buffer = BytesIO()
-                    qr_img.save(buffer, format="PNG")
-                    buffer.seek(0)
-
-                    subject = "UCC Library - Your QR ID"
-                    body = f"Hello {patron.first_name},\n\nAttached is your personal QR Code for the library attendance system."
-
-                    email_msg = EmailMessage(
-                        subject, body, settings.DEFAULT_FROM_EMAIL, [email],
-                    )
-                    filename = f"QR_{patron.id_number}.png"
-                    email_msg.attach(filename, buffer.getvalue(), 'image/png')
-                    email_msg.send(fail_silently=False)
-                    messages.success(request, f"User added and QR code sent to {email}!")
-                    log_action(request, "Add User", f"Added {role}: {first_name} {last_name} ({id_number}) with Email")
-
-                except Exception as email_err:
-                    print(f"Email Error: {email_err}")
-                    messages.warning(request, "User saved, but email failed to send.")
+                # Queued: the outbox worker sends it, so a slow SMTP server can't hang this page
+                enqueue_qr_email(patron)
+                messages.success(request, f"User added! Their QR code is being sent to {email}.")
             else:
                 messages.success(request, f"Successfully added {role}: {first_name} {last_name}")
 
@@ -427,23 +385,13 @@ def resend_qr(request, id_number):
             return HttpResponseRedirect(referer)
         return redirect('patron_list')
 
-    try:
-        qr_img = qrcode.make(patron.id_number)
-        buffer = BytesIO()
-        qr_img.save(buffer, format="PNG")
-        buffer.seek(0)
-
-        subject = "UCC Library - Your QR ID (Resent)"
-        body = f"Hello {patron.first_name},\n\nHere is a copy of your QR Code for the library attendance system."
-        filename = f"QR_{patron.id_number}.png"
-
-        email_msg = EmailMessage(subject, body, settings.DEFAULT_FROM_EMAIL, [patron.email])
-        email_msg.attach(filename, buffer.getvalue(), 'image/png')
-        email_msg.send(fail_silently=False)
-        messages.success(request, f"QR Code successfully resent to {patron.email}")
-        log_action(request, "Resend QR", f"Resent QR code to {patron.id_number} ({patron.email})")
-    except Exception as e:
-        messages.error(request, f"Failed to send email: {e}")
+    enqueue_qr_email(
+        patron,
+        "UCC Library - Your QR ID (Resent)",
+        "Hello {first_name},\n\nHere is a copy of your QR Code for the library attendance system.",
+    )
+    messages.success(request, f"QR Code queued for sending to {patron.email}")
+    log_action(request, "Resend QR", f"Resent QR code to {patron.id_number} ({patron.email})")
 
     # Check for 'HTTP_REFERER' to go back to the previous page
     referer = request.META.get('HTTP_REFERER')
@@ -457,50 +405,103 @@ def resend_qr(request, id_number):
 # 3. QR GENERATION & SCANNING
 # ==========================================
 
+@cache_control(public=True, max_age=31536000, immutable=True)
+@condition(etag_func=lambda request, id_number: qr_key(id_number))
 def generate_qr(request, id_number):
-    qr = qrcode.QRCode(version=1, box_size=10, border=4)
-    qr.add_data(id_number)
-    qr.make(fit=True)
-    img = qr.make_image(fill_color="black", back_color="white")
-    response = HttpResponse(content_type="image/png")
-    img.save(response, "PNG")
+    """QR PNG for an ID. The ETag is the content hash, so a revalidation is a 304 with no render."""
+    _, png = qr_cache.get(id_number)
+    return HttpResponse(png, content_type="image/png")
+
+
+@login_required
+def qr_bulk_zip(request):
+    """QR PNGs for every patron matching the Registered Users filters, as a streamed ZIP."""
+    patrons = filter_patrons(Patron.objects.all(), request.GET)
+    id_numbers = list(patrons.order_by('last_name', 'first_name', 'pk').values_list('id_number', flat=True))
+
+    name = '_'.join(filter(None, [request.GET.get('department'), request.GET.get('program')])) or 'all'
+    response = StreamingHttpResponse(stream_qr_zip(id_numbers), content_type='application/zip')
+    response['Content-Disposition'] = f'attachment; filename="QR_{slugify(name)}.zip"'
+    log_action(request, "Bulk QR Download", f"Downloaded {len(id_numbers)} QR codes ({name})")
+    return response
+
+
+@login_required
+def qr_cards_pdf(request):
+    """Printable A4 sheets of QR ID cards for everyone matching the Registered Users filters."""
+    patrons = filter_patrons(Patron.objects.all(), request.GET)
+    cards = list(patrons.order_by('last_name', 'first_name', 'pk').values_list(
+        'first_name', 'last_name', 'id_number', 'program'))
+
+    pdf = build_card_sheets(cards, logo_path=finders.find('ucc_logo.png'))
+
+    name = '_'.join(filter(None, [request.GET.get('department'), request.GET.get('program')])) or 'all'
+    response = HttpResponse(pdf, content_type='application/pdf')
+    response['Content-Disposition'] = f'inline; filename="QR_Cards_{slugify(name)}.pdf"'
+    log_action(request, "Print QR Cards", f"Generated {len(cards)} QR ID cards ({name})")
     return response
 
 
+@login_required
+def email_qr_campaign(request):
+    """Emails QR codes to everyone matching the Registered Users filters (POSTed as 'filters')."""
+    if request.method != 'POST':
+        return redirect('patron_list')
+
+    campaign = campaign_for(QueryDict(request.POST.get('filters', '')), user=request.user)
+    start_campaign(campaign)
+    log_action(request, "Email QR Campaign", f"Started QR email campaign: {campaign.label}")
+    return redirect('email_campaign', campaign_id=campaign.pk)
+
+
+@login_required
+def email_campaign(request, campaign_id):
+    campaign = get_object_or_404(EmailCampaign, pk=campaign_id)
+    return render(request, 'library_app/email_campaign.html', {
+        'campaign': campaign,
+        'progress': campaign_progress(campaign),
+        'failures': campaign.emails.filter(status='dead').select_related('patron')[:50],
+    })
+
+
+@login_required
+def email_campaign_status(request, campaign_id):
+    """Polled by the campaign page."""
+    campaign = get_object_or_404(EmailCampaign, pk=campaign_id)
+    return JsonResponse(campaign_progress(campaign))
+
+
 @csrf_exempt
 def process_scan(request):
     if request.method == 'POST':
         try:
             data = json.loads(request.body)
             scanned_id = data.get('qr_code')
+            # The kiosk's idempotency key; it sends the same one if it replays this scan offline
+            key = str(data.get('key') or '')[:64]
 
-            patron = Patron.objects.filter(id_number=scanned_id).first()
+            # Cached patron lookup + one atomic check-in/check-out statement
+            result = toggle_attendance(scanned_id, capacity=settings.LIBRARY_CAPACITY or None, key=key)
 
-            if patron:
-                now = timezone.localtime()
-
-                open_session = AttendanceLog.objects.filter(
-                    patron=patron,
-                    time_out__isnull=True
-                ).first()
+            if result and result.scan_type == 'full':
+                return JsonResponse({
+                    'status': 'error', 'full': True,
+                    'message': f"The library is full ({settings.LIBRARY_CAPACITY} inside). Please wait for someone to check out.",
+                }, status=409)
 
-                if open_session:
-                    open_session.time_out = now
-                    open_session.save()
+            if result:
+                if result.scan_type == 'out':
                     status_message = "Checked OUT"
-                    scan_type = "out"
                 else:
-                    AttendanceLog.objects.create(patron=patron, scan_time=now)
                     status_message = "Checked IN"
-                    scan_type = "in"
 
                 return JsonResponse({
                     'status': 'success',
-                    'name': f"{patron.first_name} {patron.last_name}",
-                    'id': patron.id_number,
-                    'role': patron.role.capitalize(),
-                    'time': now.strftime('%I:%M %p'),
-                    'type': scan_type,
+                    'name': f"{result.first_name} {result.last_name}",
+                    'id': result.id_number,
+                    'role': result.role.capitalize(),
+                    'time': result.time.strftime('%I:%M %p'),
+                    'type': result.scan_type,
                     'message': status_message
                 })
             else:
@@ -512,61 +513,127 @@ def process_scan(request):
     return JsonResponse({'status': 'error', 'message': 'Invalid request'}, status=400)
 
 
-# ==========================================
-# 4. REPORT GENERATION (PDF)
-# ==========================================
+MAX_BATCH_SCANS = 500
 
-def link_callback(uri, rel):
-    if settings.STATIC_URL and uri.startswith(settings.STATIC_URL):
-        path = os.path.join(settings.BASE_DIR, 'library_app', 'static', uri.replace(settings.STATIC_URL, ""))
-        if not os.path.isfile(path):
-            result = finders.find(uri)
-            if result:
-                path = result[0] if isinstance(result, (list, tuple)) else result
-    elif settings.MEDIA_URL and uri.startswith(settings.MEDIA_URL):
-        path = os.path.join(settings.MEDIA_ROOT, uri.replace(settings.MEDIA_URL, ""))
-    else:
-        return uri
 
-    if not os.path.isfile(path):
-        return uri
-    return path
+@csrf_exempt
+def process_scan_batch(request):
+    """
+    Accepts scans queued by an offline kiosk:
+    {"scans": [{"key": "<uuid>", "qr_code": "...", "scanned_at": "<ISO 8601>"}, ...]}
+    Replaying a key is safe; it returns the original result with "duplicate": true.
+    Each scan gets its own result. Only those with "retry": true should stay
+    queued; the rest (including errors such as an unknown ID) are final.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'status': 'error', 'message': 'Invalid request'}, status=400)
 
+    try:
+        items = json.loads(request.body).get('scans') or []
+    except (ValueError, AttributeError):
+        return JsonResponse({'status': 'error', 'message': 'Invalid JSON'}, status=400)
 
-def report_selection(request):
-    return render(request, 'library_app/report_selection.html')
+    if not isinstance(items, list) or len(items) > MAX_BATCH_SCANS:
+        return JsonResponse({'status': 'error', 'message': f'Send a list of at most {MAX_BATCH_SCANS} scans'}, status=400)
+
+    now = timezone.now()
+    scans = []
+    invalid = {}
+
+    for index, item in enumerate(items):
+        item = item if isinstance(item, dict) else {}
+        key = str(item.get('key') or '')[:64]
+        id_number = str(item.get('qr_code') or '').strip()
+        scanned_at = parse_datetime(str(item.get('scanned_at') or ''))
+
+        if not key or not id_number or scanned_at is None:
+            invalid[index] = {'key': key, 'status': 'error', 'message': 'Missing key, qr_code or scanned_at'}
+            continue
+        if timezone.is_naive(scanned_at):
+            scanned_at = timezone.make_aware(scanned_at)
+        # A kiosk with a fast clock must not create sessions in the future
+        scans.append(BatchScan(key, id_number, min(scanned_at, now)))
 
+    applied = iter(apply_scan_batch(scans)) if scans else iter(())
+    results = [invalid[i] if i in invalid else next(applied) for i in range(len(items))]
+    return JsonResponse({'status': 'success', 'results': results})
 
-SCHOOL_DATA = {
-    "SBS": [
-        "Bachelor of Science in Computer Science",
-        "Bachelor of Science in Information Systems",
-        "Bachelor of Science in Accountancy",
-        "Bachelor of Science in Business Administration",
-        "Bachelor of Science in Real Estate Management"
-    ],
-    "SHES": [
-        "Bachelor of Science in Nursing"
-    ],
-    "SEAS": [
-        "Bachelor of Arts in English",
-        "Bachelor of Arts in History",
-        "Bachelor of Arts in Political Science",
-        "Bachelor of Early Childhood Education",
-        "Bachelor of Elementary Education",
-        "Bachelor of Secondary Education"
-    ],
-    "GS": [
-        "Master of Arts in Education",
-        "Master of Arts in Nursing"
-    ],
-    "BES": [
-        "Nursery", "Kinder 1", "Kinder 2",
-        "Grade 1", "Grade 2", "Grade 3", "Grade 4", "Grade 5", "Grade 6",
-        "Grade 7", "Grade 8", "Grade 9", "Grade 10",
-        "Grade 11", "Grade 12"
-    ]
-}
+
+# Longest a long-poll request holds a server thread
+LIVE_POLL_TIMEOUT = 20
+
+
+@login_required
+def live_activity_poll(request):
+    """
+    Long-poll for the dashboard's live feed (works under waitress/WSGI).
+    GET ?cursor=... waits up to LIVE_POLL_TIMEOUT seconds for new events and
+    returns {"cursor", "events"}; without a usable cursor it returns the
+    current snapshot with "reset": true.
+    """
+    cursor = request.GET.get('cursor', '')
+    events, cursor = live_feed.read(cursor)
+    if events == []:
+        events, cursor = live_feed.wait(cursor, LIVE_POLL_TIMEOUT)
+    if events is None:
+        return JsonResponse({
+            'reset': True, 'cursor': live_feed.cursor(),
+            'events': recent_activity(), 'counts': live_counts(),
+        })
+    return JsonResponse({'cursor': cursor, 'events': events})
+
+
+@login_required
+async def live_activity_stream(request):
+    """
+    Server-sent events for the dashboard's live feed; needs the ASGI server
+    (asgi.py). Each message is one event (or a "reset" snapshot) and its id
+    is the feed cursor, so EventSource resumes where it left off.
+    """
+    if not isinstance(request, ASGIRequest):
+        return JsonResponse({'status': 'error', 'message': 'Use live-activity/poll/ under WSGI'}, status=400)
+
+    cursor = request.headers.get('Last-Event-ID') or request.GET.get('cursor', '')
+
+    async def stream():
+        nonlocal cursor
+        yield 'retry: 3000\n\n'
+        quiet = 0.0
+        while True:
+            live_feed.watch()
+            events, cursor = live_feed.read(cursor)
+            if events is None:
+                snapshot = {'events': await sync_to_async(recent_activity)(), 'counts': await sync_to_async(live_counts)()}
+                yield f"id: {cursor}\nevent: reset\ndata: {json.dumps(snapshot, cls=DjangoJSONEncoder)}\n\n"
+            for event in events or []:
+                yield f"id: {cursor}\ndata: {json.dumps(event, cls=DjangoJSONEncoder)}\n\n"
+            if events:
+                quiet = 0.0
+            elif quiet >= 15:
+                # Keeps proxies from closing an idle connection
+                yield ': ping\n\n'
+                quiet = 0.0
+            await asyncio.sleep(live_feed.poll_interval)
+            quiet += live_feed.poll_interval
+
+    response = StreamingHttpResponse(stream(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+@login_required
+def patron_cache_stats(request):
+    """Returns hit/miss counters of the scanner's patron cache (this process)."""
+    return JsonResponse(patron_cache.stats())
+
+
+# ==========================================
+# 4. REPORT GENERATION (PDF)
+# ==========================================
+
+def report_selection(request):
+    return render(request, 'library_app/report_selection.html')
 
 
 def print_pdf(request):
@@ -577,70 +644,33 @@ def print_pdf(request):
     if report_type == 'monthly':
         # Monthly Report
         selected_month = int(request.GET.get('month', timezone.now().month))
-        month_name = calendar.month_name[selected_month]
-        display_name = f"Monthly Attendance Report - {month_name} {selected_year}"
-        
-        months_map = {selected_month: selected_year}
-        month_names = [month_name]
     else:
         # Yearly Report (Default)
-        display_name = f"Annual Attendance Report - {selected_year}"
-        # Map 1-12 to the selected year
-        months_map = {i: selected_year for i in range(1, 13)}
-        # Use abbreviated months (Jan, Feb) to fit in PDF
-        month_names = [calendar.month_abbr[i] for i in range(1, 13)]
-
-    report_data = {}
-
-    for dept_code, programs_list in SCHOOL_DATA.items():
-        dept_data = {}
-        # Initialize totals: 1 per month + 1 for the row total
-        totals = [0] * (len(months_map) + 1)
-
-        for prog in programs_list:
-            monthly_counts = []
-            total_prog = 0
-            for i, (month_num, year_num) in enumerate(months_map.items()):
-                count = AttendanceLog.objects.filter(
-                    scan_time__month=month_num,
-                    scan_time__year=year_num,
-                    patron__department=dept_code,
-                    patron__program=prog
-                ).count()
-                monthly_counts.append(count)
-                total_prog += count
-                totals[i] += count  # Add to column total
-
-            monthly_counts.append(total_prog)
-            totals[-1] += total_prog  # Add to grand total
-            dept_data[prog] = monthly_counts
-        
-        # Only show totals if there is more than 1 program (Excludes SHES)
-        report_data[dept_code] = {
-            'programs': dept_data,
-            'totals': totals if len(programs_list) > 1 else None
-        }
+        report_type, selected_month = 'yearly', 0
 
-    context = {
-        'display_name': display_name,
-        'month_names': month_names,
-        'report_data': report_data,
-        'departments': dict(Patron.DEPARTMENT_CHOICES),
-    }
+    # Rendered by the background worker and cached per data version
+    artifact = get_report(report_type, selected_year, selected_month)
+    _, display_name, _ = report_period(report_type, selected_year, selected_month)
 
-    template_path = 'library_app/print_pdf.html'
-    template = get_template(template_path)
-    html = template.render(context)
+    if artifact.status == 'ready':
+        response = FileResponse(open(artifact.file_path, 'rb'), content_type='application/pdf')
+        response['Content-Disposition'] = 'inline; filename="Library_Report.pdf"'
+        log_action(request, "Print Report", f"Generated {display_name}")
+        return response
 
-    response = HttpResponse(content_type='application/pdf')
-    response['Content-Disposition'] = 'inline; filename="Library_Report.pdf"'
+    if artifact.status == 'failed':
+        return HttpResponse('We had some errors <pre>' + escape(artifact.error) + '</pre>')
 
-    pisa_status = pisa.CreatePDF(html, dest=response, link_callback=link_callback)
-    if pisa_status.err:
-        return HttpResponse('We had some errors <pre>' + html + '</pre>')
+    return render(request, 'library_app/report_pending.html', {
+        'display_name': display_name,
+        'status_url': reverse('report_status', args=[artifact.pk]),
+    })
 
-    log_action(request, "Print Report", f"Generated {display_name}")
-    return response
+
+def report_status(request, artifact_id):
+    """Polled by the 'generating report' page until the PDF is ready."""
+    artifact = get_object_or_404(ReportArtifact, pk=artifact_id)
+    return JsonResponse({'status': artifact.status})
 
 
 # ==========================================
@@ -651,23 +681,16 @@ def print_pdf(request):
 def manual_checkin(request):
     if request.method == 'POST':
         id_number = request.POST.get('id_number').strip()
-        patron = Patron.objects.filter(id_number=id_number).first()
+        result = toggle_attendance(id_number)
 
-        if not patron:
+        if not result:
             messages.error(request, f"ID '{id_number}' not found in the database.")
+        elif result.scan_type == 'out':
+            messages.warning(request, f"CHECKED OUT: {result.first_name} {result.last_name}")
+            log_action(request, "Manual Check-Out", f"Processed manual check-out for {result.id_number}")
         else:
-            now = timezone.localtime()
-            open_session = AttendanceLog.objects.filter(patron=patron, time_out__isnull=True).first()
-
-            if open_session:
-                open_session.time_out = now
-                open_session.save()
-                messages.warning(request, f"CHECKED OUT: {patron.first_name} {patron.last_name}")
-                log_action(request, "Manual Check-Out", f"Processed manual check-out for {patron.id_number}")
-            else:
-                AttendanceLog.objects.create(patron=patron, scan_time=now)
-                messages.success(request, f"CHECKED IN: {patron.first_name} {patron.last_name}")
-                log_action(request, "Manual Check-In", f"Processed manual check-in for {patron.id_number}")
+            messages.success(request, f"CHECKED IN: {result.first_name} {result.last_name}")
+            log_action(request, "Manual Check-In", f"Processed manual check-in for {result.id_number}")
 
     return render(request, 'library_app/manual_checkin.html')
 
@@ -677,32 +700,33 @@ def scan_history(request):
     date_start = request.GET.get('date_start')
     date_end = request.GET.get('date_end')
     query_id = request.GET.get('q_id')
+    # Past academic years live in the archive table (see archive_attendance)
+    archived = request.GET.get('archived') == '1'
+    log_model = AttendanceArchive if archived else AttendanceLog
 
     # Optimize query: Fetch patron details in the same query to avoid N+1 problem
-    logs = AttendanceLog.objects.select_related('patron').order_by('-scan_time')
-
-    if date_start:
-        logs = logs.filter(scan_time__date__gte=date_start)
-    if date_end:
-        logs = logs.filter(scan_time__date__lte=date_end)
-    if query_id:
-        logs = logs.filter(patron__id_number__icontains=query_id)
+    logs = log_model.objects.select_related('patron')
+    logs = filter_attendance_logs(logs, date_start, date_end, query_id)
 
-    # --- PAGINATION ---
-    paginator = Paginator(logs, 50)  # Show 50 logs per page
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    # --- PAGINATION (keyset on scan_time, id: deep pages cost the same as the first) ---
+    page_obj = keyset_page(logs, 'scan_time', request.GET)
+    if date_start or date_end or query_id:
+        page_obj.count = logs.count()
+    else:
+        page_obj.count, page_obj.count_is_estimate = estimated_count(log_model)
 
     # Preserve filters for pagination links
     query_params = request.GET.copy()
-    if 'page' in query_params:
-        del query_params['page']
+    for key in PAGE_PARAMS:
+        query_params.pop(key, None)
 
     context = {
         'logs': page_obj,
         'filter_start': date_start,
         'filter_end': date_end,
         'filter_id': query_id,
+        'archived': archived,
+        'archive_start': timezone.localtime(archive_cutoff()),
         'query_params': query_params.urlencode(),
     }
     return render(request, 'library_app/history.html', context)
@@ -711,30 +735,30 @@ def scan_history(request):
 @login_required
 def system_logs(request):
     """Displays the audit trail of admin actions."""
-    logs = SystemLog.objects.select_related('user').order_by('-action_time')
-    
+    audit_log.flush()  # include entries still waiting in the buffer
+    logs = SystemLog.objects.select_related('user')
+
     # Date Filters
     date_start = request.GET.get('date_start')
     date_end = request.GET.get('date_end')
 
-    if date_start:
-        logs = logs.filter(action_time__date__gte=date_start)
-    if date_end:
-        logs = logs.filter(action_time__date__lte=date_end)
+    logs = filter_local_dates(logs, 'action_time', date_start, date_end)
 
     # Optional: Filter by action type
     action_filter = request.GET.get('action')
     if action_filter:
         logs = logs.filter(action=action_filter)
 
-    # --- PAGINATION ---
-    paginator = Paginator(logs, 50)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    # --- PAGINATION (keyset on action_time, id) ---
+    page_obj = keyset_page(logs, 'action_time', request.GET)
+    if date_start or date_end or action_filter:
+        page_obj.count = logs.count()
+    else:
+        page_obj.count, page_obj.count_is_estimate = estimated_count(SystemLog)
 
     query_params = request.GET.copy()
-    if 'page' in query_params:
-        del query_params['page']
+    for key in PAGE_PARAMS:
+        query_params.pop(key, None)
 
     context = {
         'logs': page_obj,
@@ -753,7 +777,10 @@ def bulk_import(request):
     - Converts Acronyms to Full Names.
     - Converts Year Numbers to Text.
     - DOES NOT send emails.
+    - "Preview only" reports what would change without saving anything.
     """
+    context = {'departments': Patron.DEPARTMENT_CHOICES}
+
     if request.method == "POST":
         csv_file = request.FILES.get('csv_file')
         if not csv_file:
@@ -764,159 +791,71 @@ def bulk_import(request):
             return redirect('bulk_import')
 
         selected_dept = request.POST.get('department')
+        dry_run = request.POST.get('dry_run') == 'on'
 
-        ACRONYM_MAP = {
-            # SBS
-            "BSA": "Bachelor of Science in Accountancy",
-            "BSBA": "Bachelor of Science in Business Administration",
-            "BSIS": "Bachelor of Science in Information Systems",
-            "BSCS": "Bachelor of Science in Computer Science",
-            "BSRM": "Bachelor of Science in Real Estate Management",
-            "BSREM": "Bachelor of Science in Real Estate Management",
-
-            # SHES
-            "BSN": "Bachelor of Science in Nursing",
-
-            # SEAS
-            "BA English": "Bachelor of Arts in English",
-            "AB English": "Bachelor of Arts in English",
-            "BA History": "Bachelor of Arts in History",
-            "AB History": "Bachelor of Arts in History",
-            "BA PolSci": "Bachelor of Arts in Political Science",
-            "AB PolSci": "Bachelor of Arts in Political Science",
-            "AB Political Science": "Bachelor of Arts in Political Science",
-            "BECEd": "Bachelor of Early Childhood Education",
-            "BEEd": "Bachelor of Elementary Education",
-            "BSEd": "Bachelor of Secondary Education",
-            "BSED": "Bachelor of Secondary Education",
-            "BEED": "Bachelor of Elementary Education",
-            "BECED": "Bachelor of Early Childhood Education",
-            "AB": "Bachelor of Arts",
-
-            # GS
-            "MAED": "Master of Arts in Education",
-            "MAE": "Master of Arts in Education",
-            "MAN": "Master of Arts in Nursing",
-
-            # BES
-            "K1": "Kinder 1",
-            "K2": "Kinder 2",
-            "G1": "Grade 1", "G2": "Grade 2", "G3": "Grade 3",
-            "G4": "Grade 4", "G5": "Grade 5", "G6": "Grade 6",
-            "G7": "Grade 7", "G8": "Grade 8", "G9": "Grade 9",
-            "G10": "Grade 10",
-            "1": "Grade 11",
-            "2": "Grade 12",
-            "SHS": "Grade 11",
-        }
+        # The page polls bulk_import_progress with this token while the upload runs
+        token = request.POST.get('progress_token', '')
+        progress_key = f"bulk-import-progress:{token}" if token else None
 
-        YEAR_MAP = {
-            "1": "1st Year",
-            "2": "2nd Year",
-            "3": "3rd Year",
-            "4": "4th Year",
-            "11": "Grade 11",
-            "12": "Grade 12"
-        }
+        def report_progress(rows):
+            cache.set(progress_key, {'rows': rows, 'done': False}, 600)
 
         try:
-            decoded_file = csv_file.read().decode('utf-8-sig').splitlines()
-            reader = csv.DictReader(decoded_file)
-            count_created = 0
-            count_updated = 0
-
-            for row in reader:
-                id_number = row.get('Code', '').strip()
-                if not id_number:
-                    continue
-
-                first_name = row.get('First Name', '').strip()
-                last_name = row.get('Last Name', '').strip()
-                middle_name = row.get('Middle Name', '').strip()
-
-                raw_program = row.get('Course', '').strip()
-                program = ACRONYM_MAP.get(raw_program, raw_program)
-                major = ""
-
-                raw_year = row.get('Year', '').strip()
-                year_level = YEAR_MAP.get(raw_year, raw_year)
-
-                # Special Logic for BES Senior High (STEM, ABM, etc.)
-                # 1 -> Grade 11, 2 -> Grade 12
-                if selected_dept == 'BES' and raw_program.upper() in ["STEM", "ABM", "HUMSS", "GAS", "TVL"]:
-                    if raw_year == '1':
-                        program = "Grade 11"
-                        year_level = "Grade 11"
-                    elif raw_year == '2':
-                        program = "Grade 12"
-                        year_level = "Grade 12"
-                    
-                    major = f"Academic Track: {raw_program.upper()}"
-
-                raw_email = row.get('Email', '').strip()
-                if raw_email and raw_email.lower() != 'nan':
-                    email = raw_email.replace(' ', '')
-                else:
-                    email = None
-
-                patron, created = Patron.objects.update_or_create(
-                    id_number=id_number,
-                    defaults={
-                        'first_name': first_name,
-                        'middle_name': middle_name,
-                        'last_name': last_name,
-                        'program': program,
-                        'major': major,
-                        'year_level': year_level,
-                        'email': email,
-                        'role': 'student',
-                        'department': selected_dept
-                    }
-                )
-                if created:
-                    count_created += 1
-                else:
-                    count_updated += 1
-
-            messages.success(request, f"Import Complete! Created: {count_created}, Updated: {count_updated}.")
-            log_action(request, "Bulk Import", f"Imported {count_created} new, updated {count_updated} users into {selected_dept}")
-            return redirect('patron_list')
-
+            result = import_patrons(
+                csv_file, selected_dept, dry_run=dry_run,
+                progress=report_progress if progress_key else None,
+            )
         except Exception as e:
             messages.error(request, f"Error processing file: {e}")
             return redirect('bulk_import')
+        finally:
+            if progress_key:
+                cache.set(progress_key, {'rows': None, 'done': True}, 600)
 
-    return render(request, 'library_app/bulk_import.html', {
-        'departments': Patron.DEPARTMENT_CHOICES
-    })
+        summary = (f"Created: {result.created}, Updated: {result.updated}, "
+                   f"Unchanged: {result.unchanged}, Invalid: {result.invalid}")
+        if dry_run:
+            context.update({'result': result, 'selected_dept': selected_dept, 'file_name': csv_file.name})
+            return render(request, 'library_app/bulk_import.html', context)
+
+        messages.success(request, f"Import Complete! {summary}. Use \"Email QRs\" to send this department their QR codes.")
+        log_action(request, "Bulk Import", f"Imported {result.created} new, updated {result.updated} users into {selected_dept} ({result.invalid} invalid rows skipped)")
+        return redirect(f"{reverse('patron_list')}?{urlencode({'department': selected_dept})}")
+
+    return render(request, 'library_app/bulk_import.html', context)
+
+
+@login_required
+def bulk_import_progress(request, token):
+    """Rows processed so far by the bulk import tagged with token."""
+    return JsonResponse(cache.get(f"bulk-import-progress:{token}") or {'rows': 0, 'done': False})
 
 
 @login_required
 def export_patrons_csv(request):
-    """Exports all patrons to a CSV file."""
-    response = HttpResponse(content_type='text/csv')
-    response['Content-Disposition'] = 'attachment; filename="patron_list.csv"'
-
-    writer = csv.writer(response)
-    # Write the header row
-    writer.writerow(['ID Number', 'First Name', 'Middle Name', 'Last Name', 'Email', 'Role', 'Department', 'Program', 'Major', 'Year Level'])
-
-    patrons = Patron.objects.all().order_by('last_name')
-    for patron in patrons:
-        writer.writerow([
-            patron.id_number,
-            patron.first_name,
-            patron.middle_name,
-            patron.last_name,
-            patron.email,
-            patron.get_role_display(),
-            patron.get_department_display(),
-            patron.program,
-            patron.major,
-            patron.year_level
-        ])
+    """Exports all patrons to a CSV file (streamed, so memory stays flat)."""
+    return csv_response('patron_list.csv', PATRON_HEADER, patron_rows())
 
-    return response
+
+@login_required
+def export_attendance_csv(request):
+    """Exports attendance logs to CSV with the same filters as scan_history."""
+    return export_attendance(
+        request.GET.get('date_start'), request.GET.get('date_end'), request.GET.get('q_id'),
+        archived=request.GET.get('archived') == '1',
+    )
+
+
+def metrics(request):
+    """Request metrics in the Prometheus text format, for staff or a scraper holding METRICS_TOKEN."""
+    token = settings.METRICS_TOKEN
+    auth = request.headers.get('Authorization', '')
+    if not (token and constant_time_compare(auth, f'Bearer {token}')):
+        if not request.user.is_authenticated:
+            return redirect_to_login(request.get_full_path(), 'login')
+        if not request.user.is_staff:
+            raise PermissionDenied
+    return HttpResponse(request_metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
 
 
 # ==========================================
@@ -934,10 +873,10 @@ class CustomLoginView(LoginView):
         return response
 
 @login_required
+@cache_control(private=True, max_age=5)
 def check_active_sessions(request):
-    """Returns the count of currently active (checked-in) users."""
-    count = AttendanceLog.objects.filter(time_out__isnull=True).count()
-    return JsonResponse({'count': count})
+    """Returns the count of currently active (checked-in) users, from the occupancy counter."""
+    return JsonResponse({'count': current_occupancy(), 'capacity': settings.LIBRARY_CAPACITY or None})
 
 @login_required
 def logout_and_checkout(request):
@@ -71,6 +71,8 @@ INSTALLED_APPS = [
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',
+    'library_app.middleware.RequestMetricsMiddleware',
+    'library_app.middleware.RequestProfilingMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -154,13 +156,44 @@ STATIC_ROOT = BASE_DIR / 'staticfiles'
 
 LOGIN_REDIRECT_URL = 'dashboard'
 
+# --- SCANNER PATRON CACHE ---
+# In-process LRU of patron identities used by /scan/. Set PATRON_CACHE_ALIAS to
+# the name of an entry in CACHES (e.g. a shared Redis cache) when running
+# several server processes so they share invalidations.
+PATRON_CACHE_SIZE = int(os.getenv('PATRON_CACHE_SIZE', 5000))
+PATRON_CACHE_ALIAS = os.getenv('PATRON_CACHE_ALIAS') or None
+PATRON_CACHE_TIMEOUT = 3600
+
+# --- PDF REPORT CACHE ---
+# Rendered reports are stored here and reused until their data changes.
+# REPORT_RENDER_SYNC renders inside the request instead of the background worker (tests).
+REPORT_CACHE_DIR = BASE_DIR / 'report_cache'
+REPORT_RENDER_SYNC = False
+
+# --- QR CODE RENDER CACHE ---
+# PNGs are cached in memory by content hash; set QR_CACHE_DIR to also keep them
+# on disk (shared between server processes). Bulk ZIP misses and large ID-card
+# sheets are rendered across QR_RENDER_WORKERS processes (default: one per CPU).
+QR_CACHE_SIZE = 2000
+QR_CACHE_DIR = os.getenv('QR_CACHE_DIR') or None
+QR_RENDER_WORKERS = None
+
+# --- AUDIT LOG ---
+# SystemLog entries are buffered and written in bulk by a background thread
+# (every AUDIT_FLUSH_INTERVAL seconds or AUDIT_FLUSH_SIZE entries).
+# AUDIT_LOG_SYNC writes each entry straight away instead; tests that assert
+# on SystemLog turn it on with override_settings.
+AUDIT_FLUSH_SIZE = 50
+AUDIT_FLUSH_INTERVAL = 2.0
+AUDIT_LOG_SYNC = False
+
 # settings.py
 
 # EMAIL CONFIGURATION (Gmail)
-EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
-EMAIL_HOST = 'smtp.gmail.com'
-EMAIL_PORT = 587
-EMAIL_USE_TLS = True
+EMAIL_BACKEND = os.getenv('EMAIL_BACKEND', 'django.core.mail.backends.smtp.EmailBackend')
+EMAIL_HOST = os.getenv('EMAIL_HOST', 'smtp.gmail.com')
+EMAIL_PORT = int(os.getenv('EMAIL_PORT', 587))
+EMAIL_USE_TLS = os.getenv('EMAIL_USE_TLS', 'True') == 'True'
 EMAIL_USE_SSL = False
 
 # Credentials from .env (Make sure these are your GMAIL credentials)
@@ -169,6 +202,46 @@ EMAIL_HOST_PASSWORD = os.getenv('EMAIL_HOST_PASSWORD')
 
 DEFAULT_FROM_EMAIL = EMAIL_HOST_USER
 
+# Emails are queued in OutboundEmail and sent by library_app.outbox. With
+# AUTO_DRAIN a background thread starts sending as soon as one is queued;
+# the scheduler (or `manage.py send_outbox --loop`) retries the rest.
+# For local testing set EMAIL_BACKEND to the console/file/locmem backend, or
+# point EMAIL_HOST/EMAIL_PORT at a local debugging SMTP server (EMAIL_USE_TLS=False).
+EMAIL_OUTBOX_AUTO_DRAIN = True
+# Messages per minute across this process (0 = unlimited). Keeps bulk QR
+# campaigns under the provider's sending limits.
+EMAIL_RATE_LIMIT = int(os.getenv('EMAIL_RATE_LIMIT', 60))
+
+# Month the academic year starts. archive_attendance moves closed sessions
+# from earlier academic years out of the live AttendanceLog table.
+ACADEMIC_YEAR_START_MONTH = int(os.getenv('ACADEMIC_YEAR_START_MONTH', 8))
+
+# Most people allowed inside at once; kiosk check-ins beyond it are refused
+# (check-outs and manual check-ins always go through). 0 = no limit.
+LIBRARY_CAPACITY = int(os.getenv('LIBRARY_CAPACITY', 0))
+
+# Scan idempotency keys (ScanReceipt) only need to outlive a kiosk's offline
+# queue; the nightly archive job deletes receipts older than this many days.
+SCAN_RECEIPT_DAYS = int(os.getenv('SCAN_RECEIPT_DAYS', 14))
+
+# --- REQUEST METRICS ---
+# /metrics/ serves per-view request counts, latency, query and response size
+# histograms in the Prometheus text format to staff users, or to a scraper
+# sending "Authorization: Bearer <METRICS_TOKEN>". Empty = staff only.
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+
+# --- REQUEST PROFILING ---
+# Switched on by staff in the admin (Profiling settings). Sampled requests
+# (cProfile + SQL) and slow ones (SQL) are written to PROFILING_DIR as one
+# <timestamp>-<view>.json (and .prof) per request. SQL is stored without its
+# parameter values and URLs without query values. There is no time-based
+# expiry: after every write all but the newest PROFILING_KEEP captures are
+# deleted, and turning profiling off leaves the rest until the directory is
+# cleared by hand. PROFILING_WRITE_SYNC writes inside the request (tests).
+PROFILING_DIR = BASE_DIR / 'profiles'
+PROFILING_KEEP = 200
+PROFILING_WRITE_SYNC = False
+
 # --- LOGGING CONFIGURATION ---
 # This saves errors to a file named 'debug.log' in your project folder.
 LOGGING = {
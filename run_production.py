@@ -2,9 +2,11 @@ from waitress import serve
 from library_project.wsgi import application
 import socket
 
-# Get the local IP address automatically
-hostname = socket.gethostname()
-local_ip = socket.gethostbyname(hostname)
+if __name__ == '__main__':
+    # Get the local IP address automatically
+    hostname = socket.gethostname()
+    local_ip = socket.gethostbyname(hostname)
 
-print(f"Serving on http://{local_ip}:8000")
-serve(application, host='0.0.0.0', port=8000)
\ No newline at end of file
+    print(f"Serving on http://{local_ip}:8000")
+    # Dashboards hold a thread while long-polling for live activity (up to 20s each)
+    serve(application, host='0.0.0.0', port=8000, threads=16)